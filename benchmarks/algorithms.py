@@ -0,0 +1,160 @@
+"""Time libcaribu algorithms on synthetic canopies of increasing size
+
+Canopies are random leaves (small triangles of random orientation) filling a toric pattern whose area grows with
+the number of triangles, at constant leaf area index. For each size and algorithm, the time spent writing the
+scene, running the tools (compute) and reading back the outputs (I/O) are recorded, with the peak memory and the
+per-stage timings of canestrad, and written as JSON.
+
+usage: python benchmarks/algorithms.py [-o results.json] [--compare previous.json]
+                                       [--algos raycasting,radiosity] [--max-radiosity n] [n_triangles ...]
+"""
+import argparse
+import datetime
+import json
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import openalea.libcaribu as libcaribu
+import openalea.libcaribu.algos as lcal
+import openalea.libcaribu.commands as lcmd
+import openalea.libcaribu.io as lcio
+
+ALGOS = ('raycasting', 'toric_raycasting', 'radiosity', 'mixed_radiosity')
+SIZES = (1_000, 10_000, 100_000, 1_000_000)
+DENSITY = 100  # triangles per unit of soil area
+LAI = 3
+HEIGHT = 1
+
+
+def canopy(n, seed=0):
+    """n random leaves in a toric pattern holding DENSITY triangles per unit area, at leaf area index LAI"""
+    rng = np.random.default_rng(seed)
+    side = np.sqrt(n / DENSITY)
+    size = np.sqrt(4 * LAI / DENSITY / np.sqrt(3))  # edge of equilateral triangles of area LAI / DENSITY
+    centers = rng.uniform((0, 0, 0), (side, side, HEIGHT), size=(n, 3))
+    base = np.array([(1, 0, 0), (-0.5, np.sqrt(3) / 2, 0), (-0.5, -np.sqrt(3) / 2, 0)]) * size / np.sqrt(3)
+    # random rotations (normalised quaternions)
+    q = rng.normal(size=(n, 4))
+    w, x, y, z = (q / np.linalg.norm(q, axis=1, keepdims=True)).T
+    rotations = np.stack([1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w),
+                          2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w),
+                          2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)], axis=1)
+    triangles = centers[:, None, :] + np.einsum('nij,vj->nvi', rotations.reshape(n, 3, 3), base)
+    labels = lcio.encode_labels(1, 1 + np.arange(n) // 1000, 1 + (np.arange(n) // 10) % 100, np.arange(n) % 10)
+    return (triangles, labels), (0, 0, side, side)
+
+
+def _run(algo, scene_path):
+    if algo == 'raycasting':
+        return lcal.raycasting(scene_path)
+    if algo == 'toric_raycasting':
+        return lcal.toric_raycasting(scene_path)
+    if algo == 'radiosity':
+        return lcal.radiosity(scene_path)
+    return lcal.mixed_radiosity(scene_path, sd=1, layers=5, height=HEIGHT)
+
+
+def bench(algo, n, seed=0, workdir=None):
+    """Run algo on a canopy of n triangles
+
+    Returns:
+        a dict with write_time (scene files), compute_time (tool runs), io_time (everything else: outputs
+        parsing, intermediate files), total_time (s), max_rss (bytes, max over tool runs) and canestrad stages
+    """
+    scene, pattern = canopy(n, seed)
+    scene_path = Path(tempfile.mkdtemp(prefix='libcaribu-bench-', dir=workdir))
+    try:
+        t0 = time.perf_counter()
+        lcal.set_scene(scene_path, canopy=scene, pattern=pattern, lights=[(1, (0, 0, -1))],
+                       opts=lcio.canestra_opt(lcio.set_opticals(leaf=(0.1, 0.05))), bands='par')
+        write_time = time.perf_counter() - t0
+        with lcmd.Profile() as profile:
+            t0 = time.perf_counter()
+            results, _, _ = _run(algo, scene_path)
+            run_time = time.perf_counter() - t0
+        assert results.size == n
+    finally:
+        shutil.rmtree(scene_path, ignore_errors=True)
+    compute_time = sum(run.wall_time for run in profile.runs)
+    tools, stages = {}, {}
+    for run in profile.runs:
+        tools[run.tool] = tools.get(run.tool, 0) + run.wall_time
+        for stage, (wall, _) in run.stages.items():
+            stages[stage] = stages.get(stage, 0) + wall
+    return {'algo': algo,
+            'triangles': n,
+            'seed': seed,
+            'write_time': write_time,
+            'compute_time': compute_time,
+            'io_time': run_time - compute_time,
+            'total_time': write_time + run_time,
+            'max_rss': max((run.max_rss or 0 for run in profile.runs), default=0),
+            'tools': tools,
+            'stages': stages}
+
+
+def environment():
+    return {'libcaribu': getattr(libcaribu, '__version__', None),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'processor': platform.processor() or platform.machine(),
+            'date': datetime.datetime.now().isoformat(timespec='seconds')}
+
+
+def compare(runs, previous):
+    """Print total time ratios of runs against the runs of a previous benchmark file"""
+    reference = {(r['algo'], r['triangles']): r for r in previous['runs']}
+    print(f"{'algo':>17} {'triangles':>10} {'before (s)':>11} {'after (s)':>10} {'ratio':>6}")
+    for run in runs:
+        before = reference.get((run['algo'], run['triangles']))
+        if before is not None:
+            print(f"{run['algo']:>17} {run['triangles']:>10} {before['total_time']:>11.3f} "
+                  f"{run['total_time']:>10.3f} {run['total_time'] / before['total_time']:>6.2f}")
+
+
+def run(sizes=SIZES, algos=ALGOS, max_radiosity=100_000, seed=0, output=None, workdir=None):
+    print(f"{'algo':>17} {'triangles':>10} {'write (s)':>10} {'compute (s)':>12} {'io (s)':>8} "
+          f"{'total (s)':>10} {'rss (MB)':>9}")
+    runs = []
+    for n in sizes:
+        for algo in algos:
+            if 'radiosity' in algo and n > max_radiosity:
+                continue
+            r = bench(algo, n, seed, workdir)
+            runs.append(r)
+            print(f"{algo:>17} {n:>10} {r['write_time']:>10.3f} {r['compute_time']:>12.3f} {r['io_time']:>8.3f} "
+                  f"{r['total_time']:>10.3f} {r['max_rss'] / 2 ** 20:>9.1f}")
+    report = {'environment': environment(), 'runs': runs}
+    if output is not None:
+        Path(output).write_text(json.dumps(report, indent=1))
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('sizes', nargs='*', type=int, default=SIZES, help='numbers of triangles')
+    parser.add_argument('--algos', default=','.join(ALGOS), help='comma separated algorithms')
+    parser.add_argument('--max-radiosity', type=int, default=100_000,
+                        help='largest canopy for radiosity algorithms (form factors grow as n^2)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', help='JSON file of results')
+    parser.add_argument('--compare', help='JSON file of a previous run')
+    parser.add_argument('--workdir', help='directory of temporary scenes')
+    args = parser.parse_args(argv)
+    algos = args.algos.split(',')
+    unknown = set(algos) - set(ALGOS)
+    if unknown:
+        parser.error(f"unknown algorithms: {', '.join(sorted(unknown))}")
+    report = run(args.sizes, algos, args.max_radiosity, args.seed, args.output, args.workdir)
+    if args.compare:
+        compare(report['runs'], json.loads(Path(args.compare).read_text()))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,55 @@
+"""Compare the legacy per-triangle .can formatter with io.write_can
+
+usage: python benchmarks/can_writer.py [n_triangles ...]
+"""
+import sys
+import os
+import tempfile
+import time
+from itertools import cycle
+
+import numpy as np
+import openalea.libcaribu.io as lcio
+
+
+def legacy_can_string(triangles, labels):
+    out = []
+    for tri, label in zip(np.asarray(triangles), cycle(labels.tolist())):
+        coords = " ".join(f"{c:.6f}" for c in tri.reshape(-1))
+        out.append(f"p 1 {label:012d} 3 {coords}\n")
+    return "".join(out)
+
+
+def canopy(n, seed=0):
+    rng = np.random.default_rng(seed)
+    triangles = rng.uniform(-50, 50, size=(n, 3, 3))
+    labels = lcio.encode_labels(1, rng.integers(1, 100, n), 1, rng.integers(0, 1000, n))
+    return triangles, labels
+
+
+def timeit(func, *args):
+    t0 = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - t0, result
+
+
+def run(sizes=(10_000, 100_000, 1_000_000)):
+    print(f"{'triangles':>10} {'legacy (s)':>11} {'string (s)':>11} {'file (s)':>9} {'speedup':>8}")
+    for n in sizes:
+        triangles, labels = canopy(n)
+        t_legacy, expected = timeit(legacy_can_string, triangles, labels)
+        t_string, content = timeit(lcio.can_string, triangles, labels)
+        assert content == expected
+        del content, expected
+        fd, path = tempfile.mkstemp(suffix='.can')
+        os.close(fd)
+        try:
+            t_file, _ = timeit(lcio.write_can, path, triangles, labels)
+        finally:
+            os.unlink(path)
+        print(f"{n:>10} {t_legacy:>11.3f} {t_string:>11.3f} {t_file:>9.3f} {t_legacy / t_string:>7.1f}x")
+
+
+if __name__ == '__main__':
+    sizes = [int(a) for a in sys.argv[1:]] or (10_000, 100_000, 1_000_000)
+    run(sizes)
@@ -139,8 +139,30 @@ bool BSP::contient(Point &P) const {
   return dedans;
 }//BSP::contient()
 
-
-
-
-
-
+void BSP::ecrit(FILE *f) {
+  unsigned int no;
+  fwrite(&label,sizeof(int),1,f);
+  fwrite(position_min,sizeof(reel),3,f);
+  fwrite(position_max,sizeof(reel),3,f);
+  fwrite(&nb_diffuseurs,sizeof(int),1,f);
+  for(Noeud<Diffuseur *> *nd=Ldiff.tete();nd!=NULL;nd=nd->next()) {
+    no=nd->donne()->num(0);
+    fwrite(&no,sizeof(unsigned int),1,f);
+  }
+}//BSP::ecrit()
+
+bool BSP::lit(FILE *f, Diffuseur **Tdiff, unsigned int nbdiff) {
+  int i,n;
+  unsigned int no;
+  if(fread(&label,sizeof(int),1,f)!=1
+     || fread(position_min,sizeof(reel),3,f)!=3
+     || fread(position_max,sizeof(reel),3,f)!=3
+     || fread(&n,sizeof(int),1,f)!=1 || n<0)
+    return false;
+  for(i=0;i<n;i++) {
+    if(fread(&no,sizeof(unsigned int),1,f)!=1 || no>=nbdiff || Tdiff[no]==NULL)
+      return false;
+    ajouter(Tdiff[no]);
+  }
+  return true;
+}//BSP::lit()
@@ -190,9 +190,9 @@ void hd_calc_Bfar(VEC *Cenv,char *pcEnvName,Diffuseur ** TabDiff,double Eclt){
 	  Cenv->ve[is+1]+=rho[1]*(cl[0]*Tenv(j,0)+cl[1]*Tenv(j,1));
       }
       is++;
-      Cenv->ve[is]*=Eclt;
     }
-    Cenv->ve[is-1]*=Eclt;
+    // Pas de mise a l'echelle par Eclt : MCsail produit des flux
+    // (cf. env() dans ff.cpp, correction MCdec2003)
     is++;
   }
 
@@ -8,6 +8,10 @@ using namespace std ;
 
 #include <cmath>
 #include <cstdio>
+#include <atomic>
+#include <climits>
+#include <thread>
+#include <vector>
 
 #include "outils.h"
 #include "chrono.h"
@@ -122,7 +126,7 @@ void Canopy::sail_pur(VEC **Cfar,double *Eclt,char* envname){
 
 //++ Prototype pour la projection
 
-void colorie_triangle( void *,void *,REELLE **, const Punkt,const Punkt,const Punkt, int,int, double,double, void (*f)(void *, int, int, void*));
+void colorie_triangle( void *,void *,REELLE **, const Punkt,const Punkt,const Punkt, int,int, double,double, void (*f)(void *, int, int, void*), int j0=0, int j1=INT_MAX);
 void colorie_capteur(REELLE **Zbuf,Punkt a,Punkt b,Punkt c, int Tx, int Ty,double tx, double ty,int& pB0);
 
 
@@ -141,6 +145,20 @@ void zFF(void *, int, int, void*) {
 
 }//zFF()
 
+//+************ en_parallele()
+// appelle f(debut,fin,thread) sur nth tranches contigues de [0,n[, dans nth threads
+template <class F> static void en_parallele(size_t n,int nth,F f) {
+  vector<thread> pool;
+  int t;
+
+  if(nth>(long)n) nth=max<size_t>(1,n);
+  for(t=1;t<nth;t++)
+    pool.emplace_back(f,n*t/nth,n*(t+1)/nth,t);
+  f(0,n/nth,0);
+  for(thread &th : pool)
+    th.join();
+}//en_parallele()
+
 static  int addbox(BSP * box,reel dx,reel dy, Boxi *Tabox,int ind) {
   int i;
   if(ind!=0) {
@@ -157,6 +175,11 @@ static  int addbox(BSP * box,reel dx,reel dy, Boxi *Tabox,int ind) {
   return ++ind;
 }//addbox()
 
+// compteurs de calc_FF_Bfar(), propres a chaque thread
+typedef struct {
+  int nb_rec,nb_emi,nb_test,cum_box,nb_error;
+} StatFF;
+
 #ifdef _HD
 void Canopy::calc_FF_Bfar(
 #else
@@ -168,17 +191,8 @@ void Canopy::calc_FF_Bfar(SPMAT *FF,
 			  bool bias,
 			  double denv,
 			  int nbsim) {
-  int p,t,b,nb_rec=0,nb_emi=0,nb_test=0,cum_box=0,nb_error=0,nb_ff,nop=0;;
-  unsigned char i,nb_box,pr=0;
-  int pmax,tmax,inc[3],Gi[3];
-  int n,i_sup,i_inf=0,idx,idxn;
-  Diffuseur *diffR, *diffE;
-  BSP *box;
-  Boxi Tabox[8];
-  Point G,T;
-  reel move[2];
-  double mid,S[3],dGS[3],d2env=denv*denv,ff,dER2; //attention aux tests entre d et d^2
-  bool rechauffe,sol,select;
+  int nb_rec=0,nb_emi=0,nb_test=0,cum_box=0,nb_error=0;
+  double d2env=denv*denv; //attention aux tests entre d et d^2
   
   if(verbose>1) {
     Ferr <<"Canopy::calc_FF_Bfar() denv=Rsph="  << denv
@@ -190,9 +204,23 @@ void Canopy::calc_FF_Bfar(SPMAT *FF,
   SPROW	*r_sup,*r_inf;
   init_NFF(envname,Esource,denv,bias);
 #endif
-  for(Ldiff.debut();! Ldiff.finito();Ldiff.suivant()){
-    nb_ff=0;
-    diffR=Ldiff.contenu();
+
+  // FF et Bfar d'un recepteur : les diffuseurs, boites et voxels ne sont que lus (faces des emetteurs
+  // notees par active_emetteur()), si bien que plusieurs recepteurs sont traites en parallele
+  auto recepteur=[&](Diffuseur *diffR, LigneFF &lff, StatFF &st) {
+    int b,nb_ff=0;
+    unsigned char i,nb_box;
+    int inc[3],Gi[3];
+    int n,i_sup,i_inf=0,idx,idxn;
+    Diffuseur *diffE;
+    BSP *box;
+    Boxi Tabox[8];
+    Point G,T;
+    reel move[2];
+    double mid,S[3],dGS[3],dER2;
+    bool sol,select;
+    Chrono tps;
+
     sol = (diffR->primi().name()==0)? true : false;
     //pmax=diffR->nb_patch();
     // printf("[calc_FF_Bfar] diffR = %d\n",diffR->num());
@@ -204,22 +232,19 @@ void Canopy::calc_FF_Bfar(SPMAT *FF,
     //printf("* pmax = %d\n",pmax); 
     //for(p=0;p<pmax;p++) {//cas du diffuseur patche
     //diffR->select_patch(p);
-    diffR->active(0);//active la face sup
     init_proj(diffR);
     G=diffR->centre();
-    i_sup=diffR->num();
+    i_sup=diffR->num(0);//face sup
     //printf("\n %d -",i_sup);
 #ifndef _HD
     r_sup = FF->row+ i_sup;
 #endif
     if(!diffR->isopaque()) {
-      diffR->togle_face();
-      i_inf=diffR->num();
+      i_inf=diffR->num(1);
       // printf(" %d ",i_inf);
 #ifndef _HD
       r_inf = FF->row+ i_inf;
 #endif
-      diffR->togle_face();
     }
     nb_box=0;
     for(i=0;i<3;i++) {
@@ -308,7 +333,7 @@ void Canopy::calc_FF_Bfar(SPMAT *FF,
 	nb_box=addbox(mesh(Gi[0]+inc[0],Gi[1]+inc[1],Gi[2]+inc[2]),move[0],move[1],Tabox,nb_box);
       }
     }
-    cum_box+=nb_box;
+    st.cum_box+=nb_box;
  
    
     //allez zou, on calcule les FF et les Bfar par projection
@@ -322,9 +347,10 @@ void Canopy::calc_FF_Bfar(SPMAT *FF,
       // Ferr << __FILE__ " : "<< __LINE__ << '\n' ;
       //Ferr << "Boite no "<<b<<'\n';
       //loop sur les diffuseurs de la boite
-      for(box->Ldiff.debut();! box->Ldiff.finito();box->Ldiff.suivant()){
+      // (parcours sans le curseur de la liste, partagee entre threads)
+      for(Noeud<Diffuseur *> *nd=box->Ldiff.tete();nd!=NULL;nd=nd->next()){
 	//Ferr << __FILE__ " : "<< __LINE__ << '\n' ;
-	diffE=box->Ldiff.contenu();
+	diffE=nd->donne();
 	if (diffE->isreal() && diffE!=diffR) 
 	  //si diffE n'est pas un capteur virtuel et si pas cas Diagonale : FF=1
 	  if(!(sol && diffE->primi().name()==0)) {
@@ -334,7 +360,7 @@ void Canopy::calc_FF_Bfar(SPMAT *FF,
 	    //for(t=0;t<tmax;t++) {
 	    //diffE->select_patch(t);
 	    
-	    nb_test++;
+	    st.nb_test++;
 	    //OLD si bias==false, test de distance pas fait et triangle traite
 	     //OLDif(!(bias && G.dist2(T)> d2env)) {
 	    // si bias==false, test de distance point-triangle
@@ -375,10 +401,9 @@ void Canopy::calc_FF_Bfar(SPMAT *FF,
 	    }
 	    if(select){
 	      Vecteur dir(G,T);
-	      if(dir.prod_scalaire(diffE->normal())!=0){
+	      if(dir.prod_scalaire(diffE->primi().normal())!=0){
 		nb_ff++;
-		diffE->active(dir);
-		n=diffE->num();
+		n=active_emetteur(diffE,dir);
 		//Ferr << __FILE__ " : "<< __LINE__ << '\n' ;
 #ifdef _HD
 		idx= ADS_val(n);
@@ -389,7 +414,7 @@ void Canopy::calc_FF_Bfar(SPMAT *FF,
 		//if( sprow_idx(r_sup,n)<0) {
 		if(((idx*idxn)/2)%3 == 0){
 		  //Anti-Doublon System
-		  if(idx+idxn==5) nb_error++;
+		  if(idx+idxn==5) st.nb_error++;
 #ifdef _HD
 		  ADS_maj(n,idx+idxn);
 #else
@@ -398,7 +423,7 @@ void Canopy::calc_FF_Bfar(SPMAT *FF,
 		  // Ferr << __FILE__ " : "<< __LINE__ << '\n' ;
 		  proj_ortho(diffE,Tabox[b].inc);
 		  //Ferr << __FILE__ " : "<< __LINE__ << '\n' ;
-		  nb_emi++; proj_cpt++;
+		  st.nb_emi++;
 		  
 		}//if pas deja traite
 	      }//if pas parllele a la direction
@@ -407,29 +432,66 @@ void Canopy::calc_FF_Bfar(SPMAT *FF,
 	  }//if pas sol-sol //if diffE != diffR
       }//for box->Ldiff 
     }//jqa nb_box(b) (ou if rechauffe si AntiDoublon)
-    nb_rec++;
+    st.nb_rec++;
     //Calcul des FF en fct des Buffers
     if(verbose>3){
       tps.Stop();
-      cout<<++nop<<" : proj ortho-sph de "<<nb_ff<<" T en "<<tps<<endl;
+      cout<<st.nb_rec<<" : proj ortho-sph de "<<nb_ff<<" T en "<<tps<<endl;
       //Bug MC2006: ++nop est fait deux fois!!
       //    Ferr <<++nop<<" : proj ortho-sph de "<<nb_ff<<" T en "<<tps<<'\n';
-      Ferr <<nop<<" : proj ortho-sph de "<<nb_ff<<" T en "<<tps<<'\n';
+      Ferr <<st.nb_rec<<" : proj ortho-sph de "<<nb_ff<<" T en "<<tps<<'\n';
     }
     
 #ifdef _HD
-    NFF(i_sup,i_inf,Cfar);
+    NFF(i_sup,i_inf,Cfar,lff);
 #else
     NFF(FF,i_sup,i_inf,Cfar);
 #endif    //chron.Stop();
 
     if(verbose>4){
       Ferr <<__FILE__ <<" : "<< __LINE__<< " : ";
-      Ferr<<proj_cpt<<'\n'<<" NFF computed "<<'\n';
+      Ferr<<st.nb_emi<<'\n'<<" NFF computed "<<'\n';
     }
 
     //}//for nb patch diffR
-  }//for Ldiff
+  };//recepteur()
+
+  // Recepteurs par lots : les lignes d'un lot sont calculees en parallele (chaque thread prenant le
+  // recepteur suivant), puis ecrites dans l'ordre des recepteurs
+#ifdef _HD
+  int nth=max(1,nthreads);
+#else
+  int nth=1;// FF ecrits directement dans la matrice creuse
+#endif
+  vector<Diffuseur *> Trec;
+  vector<StatFF> Tstat(nth,StatFF{0,0,0,0,0});
+  size_t lot=256*nth;
+  vector<LigneFF> Tligne(lot);
+
+  for(Ldiff.debut();! Ldiff.finito();Ldiff.suivant())
+    Trec.push_back(Ldiff.contenu());
+  for(size_t deb=0;deb<Trec.size();deb+=lot) {
+    size_t fin=min(Trec.size(),deb+lot);
+    atomic<size_t> suivant(deb);
+    en_parallele(nth,nth,[&](size_t,size_t,int t) {
+	size_t k;
+	init_NFF_thread();
+	while((k=suivant++)<fin)
+	  recepteur(Trec[k],Tligne[k-deb],Tstat[t]);
+	fin_NFF_thread();
+      });
+#ifdef _HD
+    for(size_t k=deb;k<fin;k++)
+      ecrit_NFF(Tligne[k-deb]);
+#endif
+  }
+  for(StatFF &st : Tstat) {
+    nb_rec+=st.nb_rec;
+    nb_emi+=st.nb_emi;
+    nb_test+=st.nb_test;
+    cum_box+=st.cum_box;
+    nb_error+=st.nb_error;
+  }
 
   stat_NFF(); 
 
@@ -501,6 +563,87 @@ void Canopy::calc_FF(SPMAT *FF){
 
 #endif
 
+//+************ triangles_projetes()
+// triangle projete sur l'ecran de projplan, a colorier avec colorie_triangle(pdiff,..,p[0],p[1],p[2],...)
+typedef struct {
+  Diffuseur *pdiff;
+  Punkt p[3];
+} TriProj;
+
+// ajoute a Ttri les triangles (ordonnes en y) de la projection de la primitive pdiff et de ses copies
+// periodiques, dans l'ordre de coloriage
+static void triangles_projetes(Diffuseur *pdiff,Vecteur *delta,Vecteur &SvE,Vecteur &u,Vecteur &v,Vecteur &w,
+			       vector<TriProj> &Ttri) {
+  Point Pp[4],P;
+  TriProj tri;
+  int i,j,k,l=0;
+  signed char acv_idx,acv_fin=0;
+  bool up,down;
+  double pente;
+
+  tri.pdiff=pdiff;
+  switch(pdiff->acv) {
+  case 0: acv_fin=0; break;
+  case 1: acv_fin=1; break;
+  case 2: 
+  case 4: acv_fin=2; break;
+  }
+  for(acv_idx=0;acv_idx<=acv_fin;acv_idx++) {
+    if(acv_idx==1 && pdiff->acv==2)
+      acv_idx++;
+    for(i=0;i<3;i++) { // Cas des triangles
+      P=pdiff->primi()[i];
+      P+=delta[acv_idx];
+      P-=SvE;
+      Pp[i]=P.chgt_base(v,w,u);
+    }//for triangle
+    // Tri sommets tq Pp[i][1]<<Pp[j][1]<<Pp[k][1] ie A[1] < B[1] < C[1]
+    j = (Pp[1][1]>Pp[2][1])? 1: 2; // calc intermed
+    k = (Pp[0][1]>Pp[j][1])? 0: j; // indice max pour coord y
+    i = (k+1)%3; j= (i+1)%3;
+    i = (Pp[i][1]<Pp[j][1])? i : j; // indice min pour coord y
+    j = 3- i-k;
+    if ((i!=k)&& !((A[0]==B[0])&&(B[0]==C[0]))&& !((A[1]==B[1])&&(B[1]==C[1]))){
+      // Pts A,B,Cpas  alignes selon les axes Xou Y
+      up=down=false;
+      if (A[1]==B[1]) // up 
+	{ i = (A[0] <B[0])?i:j;
+	  j = 3-i-k; 
+	  up=(A[0] != B[0]);
+	}//if up
+      else{
+	if(B[1] == C[1]){ // down 
+	  k = (B[0] <C[0])?k:j; 
+	  j = 3-i-k;
+	  down =(B[0] != C[0]);
+	}//if down
+	else { 
+	  D[1] = B[1];
+	  pente=(D[1]-A[1])/(C[1]-A[1]);
+	  D[0] = pente*(C[0]-A[0])+A[0];
+	  D[2] = pente*(C[2]-A[2])+A[2];
+	  up=down=(B[0]==D[0])?false: true;
+	  if(D[0]>B[0]) { l=i; i=j; j=3;}
+	  else          { l=i; i=3;     }
+	}//else cas quelconque, ni up , ni down 
+      }
+      if(up) {
+	pt2pkt(C,tri.p[0]);
+	pt2pkt(A,tri.p[1]);
+	pt2pkt(B,tri.p[2]);
+	Ttri.push_back(tri);
+      }
+      if(down) {
+	if (up) { k=j; j=i; i=l; }
+	pt2pkt(A,tri.p[0]);
+	pt2pkt(B,tri.p[1]);
+	pt2pkt(C,tri.p[2]);
+	Ttri.push_back(tri);
+      }// if down
+    }//if pas un triangle plat
+  }//for acv
+}//triangles_projetes()
+
 void Canopy::projplan(Vecteur &visee,bool infty, double* Bo) {
   int i,j,k,l,img_surf;
   Point roof[4];
@@ -677,103 +820,31 @@ void Canopy::projplan(Vecteur &visee,bool infty, double* Bo) {
   delta[2][1]=vmax[1]-vmin[1];
   
   // Cas des primitives (non capteurs virtuels)
-  // int comptr;
-  //comptr=0;
-  for(Ldiff.debut();(! Ldiff.finito()) && Ldiff.contenu()->isreal();Ldiff.suivant()){
-    //Ferr<<"* diff no. "<<++comptr<<endl;
-    pdiff=Ldiff.contenu();
-    pastoutvu=false;
-    //cout <<"Canopy[projplan] primitive = "<<pdiff->primi().name()<<endl;
-    //cout <<"Canopy[projplan] P{Re} = ";Ecran[i+1].show();
-    /*if( (Ecran[i+1][2]<0.0) || pastoutvu){  // Prim  PARTIELLEMENT pas vue
-      if( Ecran[i+1][2]<0.0) {
-      pastoutvu=true; 
-      //cout <<"Camera[calc_visi] Z neg\n";
-      }
-      }
-      else{
-      */
-    //cout <<"Camera[projplan] Pp{Rimage}["<<i<<"]  = ";Pp[i].show();
-    switch(pdiff->acv) {
-    case 0: acv_fin=0; break;
-    case 1: acv_fin=1; break;
-    case 2: 
-    case 4: acv_fin=2; break;
-    }
-    if(!pastoutvu) 
-      for(acv_idx=0;acv_idx<=acv_fin;acv_idx++) {
-	if(acv_idx==1 && pdiff->acv==2)
-	  acv_idx++;
-	for(i=0;i<3;i++) { // Cas des triangles
-	  Ecran[i+1]=pdiff->primi()[i];
-	  Ecran[i+1]+=delta[acv_idx];
-	  Ecran[i+1]-=SvE;
-	  Ecran[i+1]=Ecran[i+1].chgt_base(v,w,u);
-	  Pp[i][0]=Ecran[i+1][0];
-	  Pp[i][1]=Ecran[i+1][1];
-	  Pp[i][2]=Ecran[i+1][2];//distZ;
-	}//for triangle
-	// Tri sommets tq Pp[i][1]<<Pp[j][1]<<Pp[k][1] ie A[1] < B[1] < C[1]
-	j = (Pp[1][1]>Pp[2][1])? 1: 2; // calc intermed
-	k = (Pp[0][1]>Pp[j][1])? 0: j; // indice max pour coord y
-      i = (k+1)%3; j= (i+1)%3;
-      i = (Pp[i][1]<Pp[j][1])? i : j; // indice min pour coord y
-      j = 3- i-k;
-      //       cout<<" (i,j,k) = "<<i<<j<<k<<endl;
-      if ((i!=k)&& !((A[0]==B[0])&&(B[0]==C[0]))&& !((A[1]==B[1])&&(B[1]==C[1]))){
-	// Pts A,B,Cpas  alignes selon les axes Xou Y
-	// tri Ok
-	up=down=false;
-	if (A[1]==B[1]) // up 
-	{ i = (A[0] <B[0])?i:j;
-	j = 3-i-k; 
-	up=(A[0] != B[0]);
-	}//if up
-	else{
-	  if(B[1] == C[1]){ // down 
-	    k = (B[0] <C[0])?k:j; 
-	    j = 3-i-k;
-	    down =(B[0] != C[0]);
-	  }//if down
-	  else { 
-	    D[1] = B[1];
-	    pente=(D[1]-A[1])/(C[1]-A[1]);
-	    D[0] = pente*(C[0]-A[0])+A[0];
-	    // D[2] = (A[2]*(C[1]-D[1]) + C[2]*(D[1]-A[1]))/(C[1]-A[1]);
-	    D[2] = pente*(C[2]-A[2])+A[2];
-	    up=down=(B[0]==D[0])?false: true;
-	    if(D[0]>B[0]) { l=i; i=j; j=3;}
-	    else          { l=i; i=3;     }
-	  }//else cas quelconque, ni up , ni down 
-	}
-	//     cout<<"2 (i,j,k) = "<<i<<j<<k<<endl;
-	// rappel syntaxe colorie_triangle()
-	//void colorie_triangle( void * tria,void *Zprim, double **Zbuf,Punkt a,Punkt b,Punkt c, int Tx, int Ty,double tx, double ty,void (*f)(void * Zprim, int i, int j, void* tria)){
-
-	if(up) {
-	  pt2pkt(A,a);
-	  pt2pkt(B,b);
-	  pt2pkt(C,c);
-	  /* printf(" UP : \tA[0]= %g, A[1]=%g, A[2]=%g\n",A[0], A[1],A[2]);
-	  printf(" \t\tB[0]= %g, B[1]=%g, B[2]=%g\n",B[0], B[1],B[2]);
-	  printf(" \t\tC[0]= %g, C[1]=%g, C[2]=%g\n",C[0], C[1],C[2]);
-	  */
-	  colorie_triangle(pdiff,Zprim,Zbuf, c,a,b,Timg,Timg,du,dv,zproj);
-	}
-	if(down) {
-	  if (up) { k=j; j=i; i=l; }
-	  pt2pkt(A,a);
-	  pt2pkt(B,b);
-	  pt2pkt(C,c);
-	  /* printf(" DOWN : \tA[0]= %g, A[1]=%g, A[2]=%g\n",A[0], A[1],A[2]);
-	  printf(" \t\tB[0]= %g, B[1]=%g, B[2]=%g\n",B[0], B[1],B[2]);
-	  printf(" \t\tC[0]= %g, C[1]=%g, C[2]=%g\n",C[0], C[1],C[2]);
-	  */
-	  colorie_triangle(pdiff,Zprim,Zbuf, a,b,c, Timg,Timg,du,dv,zproj);
-	}// if down
-      }//if pas un triangle plat
-    }//if !pastoutvu 
-  }// for liste diffuseurs
+  // par lots de primitives : projection des triangles en parallele, puis coloriage du Zbuf en parallele par
+  // bandes de lignes, chaque bande coloriant tous les triangles dans l'ordre de la liste => meme image qu'en
+  // sequentiel
+  const int lot=1<<16;
+  int nth=max(1,min(nthreads,Timg));
+  vector<Diffuseur *> Tprim;
+  vector< vector<TriProj> > Ttri(nth);
+
+  for(Ldiff.debut();(! Ldiff.finito()) && Ldiff.contenu()->isreal();Ldiff.suivant())
+    Tprim.push_back(Ldiff.contenu());
+  for(size_t deb=0;deb<Tprim.size();deb+=lot) {
+    size_t fin=min(Tprim.size(),deb+lot);
+    // en_parallele utilise moins de threads qu'il n'y a de listes si le lot est petit : toutes sont videes
+    for(vector<TriProj> &T : Ttri)
+      T.clear();
+    en_parallele(fin-deb,nth,[&](size_t i0,size_t i1,int t) {
+	for(size_t ip=deb+i0;ip<deb+i1;ip++)
+	  triangles_projetes(Tprim[ip],delta,SvE,u,v,w,Ttri[t]);
+      });
+    en_parallele(Timg,nth,[&](size_t j0,size_t j1,int) {
+	for(int t=0;t<nth;t++)
+	  for(TriProj &tri : Ttri[t])
+	    colorie_triangle(tri.pdiff,Zprim,Zbuf, tri.p[0],tri.p[1],tri.p[2],Timg,Timg,du,dv,zproj,j0,j1);
+      });
+  }
 
   //Infinitisation
   if(infty && visee[2]>-1+1e-6) {
@@ -965,7 +1036,9 @@ void Canopy::projplan(Vecteur &visee,bool infty, double* Bo) {
 
 //-*************** colorie_triangle() ************************
 
-void colorie_triangle( void * tria,void *Zprim, REELLE **Zbuf,const Punkt a,const Punkt b,const Punkt c, int Tx, int Ty,double tx, double ty,void (*f)(void *, int, int, void*)){
+// seules les lignes j0 <= j < j1 sont coloriees (bande d'un thread de projplan), avec les memes increments
+// que pour le triangle entier
+void colorie_triangle( void * tria,void *Zprim, REELLE **Zbuf,const Punkt a,const Punkt b,const Punkt c, int Tx, int Ty,double tx, double ty,void (*f)(void *, int, int, void*), int j0, int j1){
   double penteL,penteR,xL,xR,zL,yrel,vab,vac,vbc,z,dz; // L Left, R  Right
   int i,j, iR,iL, deby,finy;
   signed char sens;
@@ -999,6 +1072,8 @@ void colorie_triangle( void * tria,void *Zprim, REELLE **Zbuf,const Punkt a,cons
   
   deby=max(0,deby);
   finy=min(Ty-1,finy);
+  if( finy<j0 || deby>=j1 )
+    return;
   
   //	calcul de grandeurs fixes utilisees pour obtenir l'altitude des pixels
   vab = (b[2] - a[2])/(b[1] - a[1]);
@@ -1021,13 +1096,13 @@ void colorie_triangle( void * tria,void *Zprim, REELLE **Zbuf,const Punkt a,cons
   //cout<<"\tpenteL= "<<penteL<<" -penteR= "<<penteR<<" - sens = "<<(int) sens<<" - vab= "<<vab<<" - vbc = "<<vbc<<endl;
   
   //	boucle sur les lignes 
-  for(j=deby;j<=finy;j++){
+  for(j=deby;j<=finy && j<j1;j++){
     //iL=min(Tx-1,max(0,int(xL*K[0]+0.5)));    // centre de gravite 
     //iR=min(Tx-1,max(0,int(xR*K[0]-0.5)));    // dans le triangle
     iL=max(0,int(xL*K[0]+0.5));
     iR=min(Tx-1,int(xR*K[0]-0.5)); 
     //cout<<"LOOP\t xL= "<<xL    <<" - xR= "<<xR<< "(iL,iR)="<<iL<<", "<<iR<<" -j= "<<j<<" -zL="<<zL<< endl;
-    if (iL<=iR) {
+    if (iL<=iR && j>=j0) {
       //dz= yrel*vbc/(xR-xL);
       z = zL;
       for(i=iL;i<=iR;i++){
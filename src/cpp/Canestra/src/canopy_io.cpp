@@ -16,6 +16,8 @@ using namespace std ;
 #endif
 #endif
 #include <sstream>
+#include <vector>
+#include <cstring>
 
 #include <cmath>
 
@@ -87,6 +89,95 @@ Actop* lectop(ifstream &fopti, bool opac=false){
   return actop;
 }//lectopt()
 
+//lit_optiques() : lit le fichier '.opt' dans tabopaque (sol en 0, face opaque de l'espece e en e) et
+// tabtransp (faces sup et inf de l'espece e en e-1). ii recoit le nombre d'especes, renvoie le nombre
+// d'entrees lues (sol et especes)
+int lit_optiques(ifstream &fopti, char *nopti, Tabdyn<Actop*,1> &tabopaque, Tabdyn<Actop*,2> &tabtransp,
+		 int &ii){
+  char c, line[256];
+  int nbopt=0;
+
+  ii=0;
+  do{
+    fopti>>c;
+    if(!fopti) break;
+    switch(c) {
+    case '#':
+      fopti.getline(line,256);
+      break;
+    case 'n':
+      fopti>>ii;
+      if(verbose>1) 
+	Ferr<<" nb especes (optiques) = "<<ii<<'\n' ;//endl;
+      tabtransp.alloue(ii,2);
+      tabopaque.alloue(ii+1); 
+      
+      fopti.getline(line,256);		        
+      break; 
+    case 's':
+      if(ii==0) syntax_error(nopti);
+      //Ferr <<"Canopy[lit_optiques]ficoptik : sol lu\n";
+      tabopaque(nbopt) = lectop(fopti, true); 
+      raus(tabopaque(nbopt)==nullptr,"Canopy[lit_optiques] allocation tabopaque impossible!");
+      nbopt++;
+      fopti.getline(line,256);
+      break;
+    case 'e':
+      if(ii==0) syntax_error(nopti);
+      //Ferr <<"Canopy[lit_optiques]ficoptik : espece no "<<nbopt<<'\n' ;//endl;
+      tabopaque(nbopt) =  lectop(fopti, true); 
+      raus(tabopaque(nbopt)==nullptr,"Canopy[lit_optiques] allocation tabopaque impossible!");
+      tabtransp(nbopt-1,0)= lectop(fopti); 
+      raus(tabtransp(nbopt-1,0)==nullptr,"Canopy[lit_optiques] allocation tabtransp_sup impossible!");
+      tabtransp(nbopt-1,1)= lectop(fopti); //face inf
+      raus(tabtransp(nbopt-1,1)==nullptr,"Canopy[lit_optiques] allocation tabtransp_inf impossible!");      
+      nbopt++;
+      fopti.getline(line,256);
+      break; 
+    default  :
+      syntax_error(nopti);  
+    }//switch c
+    // cout <<"fopti="<<!fopti<<'\n' ;//endl; 
+  } while(fopti && (nbopt<=ii));
+  if(nbopt<ii)  
+	syntax_error(nopti);  
+  if(verbose>1) 
+	Ferr<<"-_-_-_-_-_  Proprietes optiques chargees\n";
+  return nbopt;
+}//lit_optiques()
+
+//-********************   Canopy::maj_optiques()    ***********************
+// remplace les proprietes optiques de la scene chargee par celles de nopti (meme especes), en place
+// dans les Actop partages par les diffuseurs
+bool Canopy::maj_optiques(char *nopti){
+  ifstream fopti(nopti,ios::in);
+  Tabdyn<Actop*,1> opaque;
+  Tabdyn<Actop*,2> transp;
+  int i,ii,nb;
+  bool ok;
+
+  if(!fopti) {
+    Ferr << "ERREUR - Impossible d'ouvrir :"<<nopti<<'\n' ;
+    return false;
+  }
+  nb=lit_optiques(fopti,nopti,opaque,transp,ii);
+  ok=(ii==nbesp && nb==nbopt);
+  if(!ok)
+    Ferr << "ERREUR - "<<nopti<<" ne decrit pas les memes especes que la scene chargee\n" ;
+  for(i=0;i<nb;i++) {
+    if(ok)
+      *dynamic_cast<Lambert*>(tabopaque(i))=*dynamic_cast<Lambert*>(opaque(i));
+    delete dynamic_cast<Lambert*>(opaque(i));
+  }
+  for(i=0;i<nb-1;i++)
+    for(int face=0;face<2;face++) {
+      if(ok)
+	*dynamic_cast<Lambert*>(tabtransp(i,face))=*dynamic_cast<Lambert*>(transp(i,face));
+      delete dynamic_cast<Lambert*>(transp(i,face));
+    }
+  return ok;
+}//Canopy::maj_optiques()
+
 
 
 
@@ -130,9 +221,7 @@ long int Canopy::parse_can(char *ngeom,char *nopti,char * name8,reel *bornemin,r
   ifstream fopti(nopti,ios::in);
   char c, line[256];
   double popt[4];
-  int nbopt=0,ii=0;
-  Tabdyn<Actop*,1> tabopaque;
-  Tabdyn<Actop*,2> tabtransp;
+  int ii=0;
   Actop *testopt; 
    
   if (!fopti){
@@ -148,51 +237,8 @@ long int Canopy::parse_can(char *ngeom,char *nopti,char * name8,reel *bornemin,r
     exit(10);
   }
   // lecture des proprietes optiques (fichier '.opt')
-  do{
-    fopti>>c;
-    if(!fopti) break;
-    switch(c) {
-    case '#':
-      fopti.getline(line,256);
-      break;
-    case 'n':
-      fopti>>ii;
-      if(verbose>1) 
-	Ferr<<" nb especes (optiques) = "<<ii<<'\n' ;//endl;
-      tabtransp.alloue(ii,2);
-      tabopaque.alloue(ii+1); 
-      
-      fopti.getline(line,256);		        
-      break; 
-    case 's':
-      if(ii==0) syntax_error(nopti);
-      //Ferr <<"Canopy[parse_can]ficoptik : sol lu\n";
-      tabopaque(nbopt) = lectop(fopti, opak); 
-      raus(tabopaque(nbopt)==nullptr,"Canopy[parse_can] allocation tabopaque impossible!");
-      nbopt++;
-      fopti.getline(line,256);
-      break;
-    case 'e':
-      if(ii==0) syntax_error(nopti);
-      //Ferr <<"Canopy[parse_can]ficoptik : espece no "<<nbopt<<'\n' ;//endl;
-      tabopaque(nbopt) =  lectop(fopti, opak); 
-      raus(tabopaque(nbopt)==nullptr,"Canopy[parse_can] allocation tabopaque impossible!");
-      tabtransp(nbopt-1,0)= lectop(fopti); 
-      raus(tabtransp(nbopt-1,0)==nullptr,"Canopy[parse_can] allocation tabtransp_sup impossible!");
-      tabtransp(nbopt-1,1)= lectop(fopti); //face inf
-      raus(tabtransp(nbopt-1,1)==nullptr,"Canopy[parse_can] allocation tabtransp_inf impossible!");      
-      nbopt++;
-      fopti.getline(line,256);
-      break; 
-    default  :
-      syntax_error(nopti);  
-    }//switch c
-    // cout <<"fopti="<<!fopti<<'\n' ;//endl; 
-  } while(fopti && (nbopt<=ii));
-  if(nbopt<ii)  
-	syntax_error(nopti);  
-  if(verbose>1) 
-	Ferr<<"-_-_-_-_-_  Proprietes optiques chargees\n";
+  nbopt=lit_optiques(fopti,nopti,tabopaque,tabtransp,ii);
+  nbesp=ii;
   
   //cas infini
   if(name8!=nullptr) {
@@ -224,6 +270,101 @@ long int Canopy::parse_can(char *ngeom,char *nopti,char * name8,reel *bornemin,r
   espid*=100000;
   //printf("espid=%g\n",espid);
 
+  // Ajout d'une primitive lue : rejet si degeneree ou hors du motif (cas infini),
+  // sinon creation du diffuseur (formats texte et binaire)
+  auto ajoute_primitive = [&](Primitive* prim, double nom, short specie) {
+    acv=0;
+    assert (prim != nullptr);
+    rejet=false;
+    if(min[0]>max[0]){ //primitive rejete
+	//Ferr <<" *****  Primitive rejete : libelle = "<<nom<<'\n' ;//endl;
+	rejet=true;
+    }
+    /* Traitement des a-cheval ici et non dans BSP::volume_englobant,
+	 co parcinopy a cause de visu3d.C*/
+    else 
+	if(infty) {
+	  //printf("infty!!!!!");
+	  Point G;
+	  int bps[3],cpts;//Bon Pour le Service
+	  rejet=true;
+	  G=prim->centre();
+	  if(G[0]>bornemin[0] &&G[1]>bornemin[1]&&G[0]<=bornemax[0]&&G[1]<=bornemax[1]){
+	    //centroide (G) dans le cube
+	    rejet=false;
+	    cpts=prim->nb_sommet();
+	    for (i=0; i<2; i++) {
+	      bps[i]=prim->nb_in(bornemin[i],bornemax[i], i);
+	      //printf("bps[%d]=%d\n",i,(int)bps[i]);
+	    }
+	    if(bps[0]!=0) acv++;
+	    if(bps[1]!=0) acv+=2;
+	  }
+	  else
+	    rejet=true;
+	}//if infty
+    if(rejet) {
+	//printf( "Rejetee !\n");
+	Ldiff0.ajoute(nom);
+	delete prim;
+    }
+    else {
+	//printf( " Ok\n");
+	//cout<<"prim="<<prim<<'\n' ;//endl;
+	//printf("prim(%ld) = %ld\n",nbp,(long) prim);
+	//printf(":::> smax=%g\n",smax);
+	//printf("prim(%ld) = %ld\n",nbp,(long) prim);
+	smax=(prim->surface()>smax)? prim->surface() : smax;
+	for (i=0; i<3; i++){
+	  if(infty)
+	    i=2;
+	  bornemin[i]=T_min(bornemin[i],min[i]);
+	  bornemax[i]=T_max(bornemax[i],max[i]);
+	}
+	/* ajout d'un diffuseur a la liste */
+	if(opak)  
+	  diff=new DiffO(prim, tabopaque(specie));
+	else
+	  diff=new DiffT(prim, tabtransp(specie-1,0),tabtransp(specie-1,1) );   
+	assert (diff != nullptr);
+	//cout<<"numero = "<<diff->num()<<'\n' ;//endl;
+	diff->acv=acv;
+	Ldiff.ajoute(diff);
+	Ldiff0.ajoute(-1); //bon triangle : code label <0 - MC10
+	nbp++;
+    }//else rejected primi
+  };//ajoute_primitive()
+
+  // format binaire (io.write_canb) : "CANB", uint32 taille des coordonnees (4|8),
+  // uint64 nb triangles, labels int64[n], sommets float32|float64[n][9]
+  char magic[4]={0,0,0,0};
+  fgeom.read(magic,4);
+  if(fgeom.gcount()==4 && strncmp(magic,"CANB",4)==0) {
+    unsigned int itemsize=0;
+    unsigned long long nbin=0,k;
+    fgeom.read((char*)&itemsize,sizeof(itemsize));
+    fgeom.read((char*)&nbin,sizeof(nbin));
+    if(!fgeom || (itemsize!=sizeof(float) && itemsize!=sizeof(double))) syntax_error(ngeom);
+    vector<long long> labels(nbin);
+    vector<char> xyz(9*itemsize);
+    float P[3][3];
+    fgeom.read((char*)labels.data(),nbin*sizeof(long long));
+    for(k=0;k<nbin && fgeom;k++){
+      fgeom.read(xyz.data(),9*itemsize);
+      for(i=0;i<9;i++)
+	P[i/3][i%3]= (itemsize==sizeof(float)) ?
+	  reinterpret_cast<float*>(xyz.data())[i] : static_cast<float>(reinterpret_cast<double*>(xyz.data())[i]);
+      nom=static_cast<double>(labels[k]);
+      specie=static_cast<short>(nom / espid);
+      opak=static_cast<long>(nom / 1000)%1000 ==0;
+      prim=new Polygone(P,nom,min,max);
+      ajoute_primitive(prim,nom,specie);
+    }
+    if(!fgeom) syntax_error(ngeom);
+  }
+  else {
+  fgeom.clear();
+  fgeom.seekg(0);
   do {
     nl++;fgeom>> T; //printf("T(%d)=%c\n",nl,T);
     if(fgeom.eof()) {
@@ -285,69 +426,11 @@ long int Canopy::parse_can(char *ngeom,char *nopti,char * name8,reel *bornemin,r
       default : syntax_error(ngeom);  
       }//switch T
       //delete pch;
-      acv=0;
-      assert (prim != nullptr);
-      rejet=false;
-      if(min[0]>max[0]){ //primitive rejete
-	//Ferr <<" *****  Primitive rejete : libelle = "<<nom<<'\n' ;//endl;
-	rejet=true;
-      }
-      /* Traitement des a-cheval ici et non dans BSP::volume_englobant,
-	 co parcinopy a cause de visu3d.C*/
-      else 
-	if(infty) {
-	  //printf("infty!!!!!");
-	  Point G;
-	  int bps[3],cpts;//Bon Pour le Service
-	  rejet=true;
-	  G=prim->centre();
-	  if(G[0]>bornemin[0] &&G[1]>bornemin[1]&&G[0]<=bornemax[0]&&G[1]<=bornemax[1]){
-	    //centroide (G) dans le cube
-	    rejet=false;
-	    cpts=prim->nb_sommet();
-	    for (i=0; i<2; i++) {
-	      bps[i]=prim->nb_in(bornemin[i],bornemax[i], i);
-	      //printf("bps[%d]=%d\n",i,(int)bps[i]);
-	    }
-	    if(bps[0]!=0) acv++;
-	    if(bps[1]!=0) acv+=2;
-	  }
-	  else
-	    rejet=true;
-	}//if infty
-      if(rejet) {
-	//printf( "Rejetee !\n");
-	Ldiff0.ajoute(nom);
-	delete prim;
-      }
-      else {
-	//printf( " Ok\n");
-	//cout<<"prim="<<prim<<'\n' ;//endl;
-	//printf("prim(%ld) = %ld\n",nbp,(long) prim);
-	//printf(":::> smax=%g\n",smax);
-	//printf("prim(%ld) = %ld\n",nbp,(long) prim);
-	smax=(prim->surface()>smax)? prim->surface() : smax;
-	for (i=0; i<3; i++){
-	  if(infty)
-	    i=2;
-	  bornemin[i]=T_min(bornemin[i],min[i]);
-	  bornemax[i]=T_max(bornemax[i],max[i]);
-	}
-	/* ajout d'un diffuseur a la liste */
-	if(opak)  
-	  diff=new DiffO(prim, tabopaque(specie));
-	else
-	  diff=new DiffT(prim, tabtransp(specie-1,0),tabtransp(specie-1,1) );   
-	assert (diff != nullptr);
-	//cout<<"numero = "<<diff->num()<<'\n' ;//endl;
-	diff->acv=acv;
-	Ldiff.ajoute(diff);
-	Ldiff0.ajoute(-1); //bon triangle : code label <0 - MC10
-	nbp++;
-      }//else rejected primi
+      ajoute_primitive(prim,nom,specie);
       tabid.free();
     }//else  !valid
   }while (fgeom);
+  }//else format texte
   fgeom.close();
   //  if(rejet) cout <<"Canopy[parse_can] *************  Segment(s) rejete(s) *******\n";
   if(verbose)  cout << "Canopy [parse_can] nbre de primitives  ss sol = "<<nbp<<'\n' ;//endl;
@@ -441,8 +524,6 @@ long int Canopy::parse_can(char *ngeom,char *nopti,char * name8,reel *bornemin,r
     //bornemin[i]-=(bmax[i]-bmin[i])/100.0; 
     //bornemax[i]+=(bmax[i]-bmin[i])/100.0;
   }
-  tabopaque.free();
-  tabtransp.free();
   nb_face=diff->idx;
   nbprim=Ldiff.card();
 
@@ -557,9 +638,7 @@ long int Canopy::read_shm(
   Diffuseur* diff;
   ifstream fopti(nopti,ios::in);
   char c, line[256];
-  int nbopt=0,ii=0;
-  Tabdyn<Actop*,1> tabopaque;
-  Tabdyn<Actop*,2> tabtransp;
+  int ii=0;
   Patch *Ts;
 
  
@@ -577,7 +656,7 @@ long int Canopy::read_shm(
 #ifndef WIN32
   // Unix
   int shmid;
-  shmid=shmget((key_t)clef,SEGSIZE*sizeof(Patch) ,IPC_CREAT|0666);
+  shmid=shmget((key_t)clef,Nt*sizeof(Patch) ,IPC_CREAT|0666);
   if(shmid==-1){//en cas de pb
     Ferr << "<!> ouverture du segment partage no. "<< clef
 	 <<" impossible =>exit" << "\n" ;
@@ -601,59 +680,15 @@ long int Canopy::read_shm(
 	FILE_MAP_ALL_ACCESS,
 	0,
 	0,
-	SEGSIZE*sizeof(Patch) ) ;
+	Nt*sizeof(Patch) ) ;
       assert ( lpSharedSegIn != nullptr ) ;
       Ts = (Patch *)lpSharedSegIn ;
 #endif
       if(true||verbose) 
 	Ferr <<"Canestra{read_shm] Clef="  << clef<<", Nt="  << Nt<<"\n" ;
   // lecture des proprietes optiques (fichier '.opt')
-  do{
-    fopti>>c; 
-    if(!fopti) break;
-    switch(c) {
-    case '#':
-      fopti.getline(line,256);
-      break;
-    case 'n':
-      fopti>>ii;
-      if(verbose>1) 
-	Ferr<<" nb especes (optiques) = "<<ii<<'\n' ;//endl;
-      tabtransp.alloue(ii,2);
-      tabopaque.alloue(ii+1); 
-      
-      fopti.getline(line,256);		        
-      break; 
-    case 's':
-      if(ii==0) syntax_error(nopti);
-      //Ferr <<"Canopy[read_shm]ficoptik : sol lu\n";
-      tabopaque(nbopt) = lectop(fopti, opak); 
-      raus(tabopaque(nbopt)==nullptr,"Canopy[read_shm] allocation tabopaque impossible!");  
-      nbopt++;
-      fopti.getline(line,256);
-      break;
-    case 'e':
-      if(ii==0) 
-	syntax_error(nopti);
-      //Ferr <<"Canopy[read_shm]ficoptik : espece no "<<nbopt<<'\n' ;//endl;
-      tabopaque(nbopt) =  lectop(fopti, opak); 
-      raus(tabopaque(nbopt)==nullptr,"Canopy[read_shm] allocation tabopaque impossible!");
-      tabtransp(nbopt-1,0)= lectop(fopti); 
-      raus(tabtransp(nbopt-1,0)==nullptr,"Canopy[read_shm] allocation tabtransp_sup impossible!");
-      tabtransp(nbopt-1,1)= lectop(fopti); //face inf
-      raus(tabtransp(nbopt-1,1)==nullptr,"Canopy[read_shm] allocation tabtransp_inf impossible!");      
-      nbopt++;
-      fopti.getline(line,256);
-      break; 
-    default  :
-      syntax_error(nopti);  
-    }//switch c
-    // cout <<"fopti="<<!fopti<<'\n' ;//endl; 
-  } while(fopti && (nbopt<=ii));
-  if(nbopt<ii)  
-	syntax_error(nopti);  
-  if(verbose>2) 
-	Ferr<<"-_-_-_-_-_  Proprietes optiques chargees\n";
+  nbopt=lit_optiques(fopti,nopti,tabopaque,tabtransp,ii);
+  nbesp=ii;
   
   //cas infini
   if(name8!=nullptr) {
@@ -762,7 +797,7 @@ long int Canopy::read_shm(
   //liberation du shm
 #ifndef WIN32
   // Unix
-  shmdt(reinterpret_cast<void *>((size_t) shmid));
+  shmdt(reinterpret_cast<void *>(Ts));
 #else
   // Win NT
     UnmapViewOfFile(lpSharedSegIn) ; // invalidation du ptr sur mem partagee
@@ -855,8 +890,6 @@ long int Canopy::read_shm(
     //bornemin[i]-=(bmax[i]-bmin[i])/100.0; 
     //bornemax[i]+=(bmax[i]-bmin[i])/100.0;
   }
-  tabopaque.free();
-  tabtransp.free();
   nb_face=diff->idx;
   nbprim=Ldiff.card();
 
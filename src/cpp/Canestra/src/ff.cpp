@@ -6,6 +6,8 @@ using namespace std ;
 #include <cstdio>
 #include <cmath>
 #include <ctime>
+#include <atomic>
+#include <vector> // avant meschach (macro catch)
 
 
 #include "Mmath.h"
@@ -42,29 +44,46 @@ typedef struct {
 } MPE;
 */
 // Chronometrage
-time_t Tnff=0, Tproj=0, dTnff, dTproj,now;
+atomic<time_t> Tnff(0), Tproj(0);
+static thread_local time_t dTnff, dTproj,now;
 
 //Variables globales
-
-static double dFF,mpe[3][4],denv,neginvR;
-static double *mpei;
-static double &mpe_00=mpe[0][0],&mpe_01=mpe[0][1],&mpe_02=mpe[0][2],&mpe_03=mpe[0][3];
-static double &mpe_10=mpe[1][0],&mpe_11=mpe[1][1],&mpe_12=mpe[1][2],&mpe_13=mpe[1][3];
-static double &mpe_20=mpe[2][0],&mpe_21=mpe[2][1],&mpe_22=mpe[2][2],&mpe_23=mpe[2][3];
-
-static double RE[4],REt[4];
+// Les variables propres au recepteur en cours (thread_local) permettent de calculer les FF de plusieurs
+// recepteurs en parallele ; les autres sont fixees par init_NFF() et lues seulement ensuite
+
+static double dFF,denv,neginvR;
+static thread_local double mpe[3][4];
+static thread_local double *mpei;
+// (macros plutot que references : tout acces a une reference thread_local passe par sa fonction d'initialisation)
+#define mpe_00 mpe[0][0]
+#define mpe_01 mpe[0][1]
+#define mpe_02 mpe[0][2]
+#define mpe_03 mpe[0][3]
+#define mpe_10 mpe[1][0]
+#define mpe_11 mpe[1][1]
+#define mpe_12 mpe[1][2]
+#define mpe_13 mpe[1][3]
+#define mpe_20 mpe[2][0]
+#define mpe_21 mpe[2][1]
+#define mpe_22 mpe[2][2]
+#define mpe_23 mpe[2][3]
+
+static thread_local double RE[4],REt[4];
 //variable propre a diffR
-static bool transp,acv;
-static Vecteur u,v,w;
-static Point Pp[3],Ps[3],O,P,mid[2],So[3];
-static double M[3][3],b[3];
-static Diffuseur * receiver;
-static unsigned long int ff_cum,vfar_cum,far_cum,glop_cum;
+static bool acv;
+static thread_local bool transp;
+static thread_local Vecteur u,v,w;
+static thread_local Point Pp[3],Ps[3],O,P,mid[2],So[3];
+static thread_local double M[3][3],b[3];
+static thread_local Diffuseur * receiver;
+// compteurs du thread, cumules dans les totaux par fin_NFF_thread()
+static thread_local unsigned long int ff_cum,vfar_cum,far_cum,glop_cum;
+static atomic<unsigned long int> ff_tot,vfar_tot,far_tot,glop_tot;
 static double nbFF=0;
 //zbuff
 //pd static  et template avec le cstructeur
-static Tabdyn<Diffuseur *,2> DbuffS,DbuffI;
-static Tabdyn<float,2> ZbuffS,ZbuffI;
+static thread_local Tabdyn<Diffuseur *,2> DbuffS,DbuffI;
+static thread_local Tabdyn<float,2> ZbuffS,ZbuffI;
 static double* rhotab;//H : image carree NBxNB
 static double* i2stab;//tabule le chgt de coord
 static Tabdyn<double,2> Tenv;
@@ -80,8 +99,10 @@ static double *Eclt;
 static int nb_prim,nb_face,diag_idx,ff_idx;
 
 static Tabdyn<int,1>diag;
-static Tabdyn<int,1>ligne;
-static Tabdyn<double,2>bfc;
+static thread_local Tabdyn<int,1>ligne;
+static thread_local Tabdyn<double,2>bfc;
+// face active des emetteurs vus du recepteur en cours (indice : no de leur face sup)
+static thread_local Tabdyn<unsigned char,1>actif;
 #endif
 //fin des declarations
 
@@ -289,10 +310,6 @@ void   init_NFF(char * EnvName,double *Esource,double &Rsph,bool bias) {
     Ferr <<"*** Resolution du disque de projection :  "  
 	 << NB<<"x"  << NB<<'\n' ;
   MB=NB;
-  DbuffS.alloue(NB,MB);
-  DbuffI.alloue(NB,MB);
-  ZbuffS.alloue(NB,MB);
-  ZbuffI.alloue(NB,MB);
 #ifdef _KONTAC
    tabnc.alloue(NB,MB);
    tabnc.maj(0);
@@ -301,14 +318,13 @@ void   init_NFF(char * EnvName,double *Esource,double &Rsph,bool bias) {
   dimension=(int)(NB/4.0*(NB/2.0+1));
   rhotab=new double[dimension];
   i2stab=new double[NB];
-  ff_cum=vfar_cum=far_cum=glop_cum=0;
+  ff_tot=vfar_tot=far_tot=glop_tot=0;
 #ifdef _HD
   nb_prim=nbpr;
   nb_face=nbf;
   diag_idx=0;
   diag.alloue(nb_prim+1);
   diag(0)=1;
-  ligne.alloue(nb_face);
 #endif
   for(i=0;i<NB;i++) {
     i2stab[i]=(2*i+1)/(double)NB-1.0;
@@ -355,7 +371,6 @@ void   init_NFF(char * EnvName,double *Esource,double &Rsph,bool bias) {
     fscanf(fenv,"%d %lf",&Nc,&dzc);
     if(verbose>3) printf("Nc = %d - dz = %lf\n",Nc,dzc);
 #ifdef _HD    
-    bfc.alloue(4,Nc+1);
     FILE* ffb;
     if(verbose>5) 
       Ferr<<"FF.cpp: init_NFF(): file "<<pcBfName<<" open for writing\n"; 
@@ -374,6 +389,35 @@ void   init_NFF(char * EnvName,double *Esource,double &Rsph,bool bias) {
   //printf("***  SPEED_INC = ");scanf("%d",&SPEED_INC);
   //printf(" speed_inc =%d\n",SPEED_INC);
 }//init_NFF
+
+void init_NFF_thread() {
+  DbuffS.alloue(NB,MB);
+  DbuffI.alloue(NB,MB);
+  ZbuffS.alloue(NB,MB);
+  ZbuffI.alloue(NB,MB);
+#ifdef _HD
+  ligne.alloue(nb_face);
+  actif.alloue(nb_face);
+  if(Nc>0)
+    bfc.alloue(4,Nc+1);
+#endif
+  ff_cum=vfar_cum=far_cum=glop_cum=0;
+}//init_NFF_thread()
+
+void fin_NFF_thread() {
+  ff_tot+=ff_cum;
+  vfar_tot+=vfar_cum;
+  far_tot+=far_cum;
+  glop_tot+=glop_cum;
+  ZbuffI.free(); ZbuffS.free();
+  DbuffI.free(); DbuffS.free();
+#ifdef _HD
+  ligne.free();
+  actif.free();
+  bfc.free();
+#endif
+}//fin_NFF_thread()
+
 //init_proj (en fct de diffR)
 
 #ifdef _HD
@@ -384,6 +428,24 @@ int ADS_val(int n) {
 void ADS_maj(int n,int val) {
   ligne(n)=val;
 }
+
+// les faces des emetteurs sont notees par recepteur (thread) et non activees dans les diffuseurs partages
+int active_emetteur(Diffuseur* E, Vecteur &dir) {
+  unsigned int n=E->num(0);
+  actif(n)=E->face(dir);
+  return E->num(actif(n));
+}
+static inline int num_emetteur(Diffuseur* E) {
+  return E->num(actif(E->num(0)));
+}
+#else
+int active_emetteur(Diffuseur* E, Vecteur &dir) {
+  E->active(dir);
+  return E->num();
+}
+static inline int num_emetteur(Diffuseur* E) {
+  return E->num();
+}
 #endif
 
 void init_proj(Diffuseur * diffR ) {
@@ -397,7 +459,7 @@ void init_proj(Diffuseur * diffR ) {
   //printf("FF:init_proj() Oz=%lf\n",O[2]);
   u.formation_vecteur(diffR->primi().sommets(1),diffR->primi().sommets(0));
   u.normalise();
-  w=diffR->normal();
+  w=diffR->primi().normal();//normale de la face sup
   v=w.prod_vectoriel(u);
   //debug Bfar
   //printf("FF:init_proj() (u,v,w) = \n");
@@ -414,7 +476,7 @@ void init_proj(Diffuseur * diffR ) {
 
 //Projection orthospherique (cas du triangle)
 //variable locale (globale ) a proj_ortho
-static double x,y,extrem,div_extr,den_extr,pos_extr,speed_B[4];
+static thread_local double x,y,extrem,div_extr,den_extr,pos_extr,speed_B[4];
 void proj_ortho(Diffuseur* E,reel *inc) {
   int i,j,i1,i2,jm,j0;
   signed char pasglop=0,in=0,ins=0,nbd,face,iz0[2]={-1,-1},izm[2]={-1,-1},izp[2]={-1,-1},t;
@@ -723,14 +785,14 @@ void proj_ortho(Diffuseur* E,reel *inc) {
 //Nusselt Form-Factor (Renaud, LIFL)
 
 //variable de NFF
-static   Diffuseur *E;
-static  SPROW	*r_sup,*r_inf;
-static   double FFenv,rho[2],tau[2];
+static thread_local Diffuseur *E;
+static thread_local SPROW	*r_sup,*r_inf;
+static thread_local double FFenv,rho[2],tau[2];
 
 
 #ifdef _HD
-void NFF(int i_sup,int i_inf,VEC **Cfar){
-  int ii,nnz=0;
+void NFF(int i_sup,int i_inf,VEC **Cfar,LigneFF &lff){
+  int ii;
 #else
 void NFF(SPMAT*FF,int &i_sup,int &i_inf,VEC **Cfar){
 #endif
@@ -740,13 +802,11 @@ void NFF(SPMAT*FF,int &i_sup,int &i_inf,VEC **Cfar){
   //Chrono
   time(&dTnff);
   //init des prp optiques
-  rho[0]=receiver->rho();
+  rho[0]=receiver->rho(0);
   if (transp) {
-    tau[0]=receiver->tau();
-    receiver->togle_face();
-    tau[1]=receiver->tau();
-    rho[1]=receiver->rho();
-    receiver->togle_face();
+    tau[0]=receiver->tau(0);
+    tau[1]=receiver->tau(1);
+    rho[1]=receiver->rho(1);
   }
   //init des lignes
 #ifdef _HD
@@ -772,7 +832,7 @@ void NFF(SPMAT*FF,int &i_sup,int &i_inf,VEC **Cfar){
 	E=DbuffS(i,j);
 	//printf("==> NFF(%d,%d) = %d : ",i,j,(E==NULL)?0:1);
 	if(E!=NULL) {
-	  n=E->num();
+	  n=num_emetteur(E);
 	  //face sup en reflectance
 	  ff_cum++;
 #ifdef _HD
@@ -814,7 +874,7 @@ void NFF(SPMAT*FF,int &i_sup,int &i_inf,VEC **Cfar){
 	  //autre hemisphere
 	  E=DbuffI(i,j);
 	  if(E!=NULL) {
-	    n=E->num();
+	    n=num_emetteur(E);
 	    //face inf en reflectance
 	    ff_cum++;
 	    ff_cum++;
@@ -848,24 +908,46 @@ void NFF(SPMAT*FF,int &i_sup,int &i_inf,VEC **Cfar){
     }//for j
   }//for i
 #ifdef _HD
-  FILE *ffb;
-  //  if(verbose>5)  Ferr<<"FF.cpp: NFF(): file "<<pcNzName<<" open for writing\n"; 
-  ffb=fopen(pcNzName,"ab");
-  int tamp[2];
+  //ligne creuse et coeff des Bfar, ecrits ensuite par ecrit_NFF()
+  lff.transp=transp;
+  lff.nz.clear();
   for(i=0;i<nb_face;i++) 
     if(ligne(i)!=0) {
-      nnz++;
-      tamp[0]=i;
-      tamp[1]=ligne(i);
-      // if(i_sup/2==29) printf(" rec %d  - emit = %d - iff = %d\n",i_sup/2,i,ligne(i));
-      fwrite(tamp,sizeof(int),2,ffb);
-      //fprintf(ffa,"%d %d  ",tamp[0],tamp[1]);
+      lff.nz.push_back(i);
+      lff.nz.push_back(ligne(i));
+    }
+  lff.bf.clear();
+  if(Nc>0){
+    for(i=0;i<=Nc;i++){
+      lff.bf.push_back(bfc(0,i)*dFF);
+      lff.bf.push_back(bfc(1,i)*dFF);
     }
+    if(transp)
+      for(i=0;i<=Nc;i++){
+	lff.bf.push_back(bfc(2,i)*dFF);
+	lff.bf.push_back(bfc(3,i)*dFF);
+      } 
+  }
+#endif
+  time(&now);
+  dTnff-=now;
+  Tnff-=dTnff;
+}//NFF()
+
+#ifdef _HD
+//ajoute la ligne d'un recepteur a la matrice des FF et aux coeff des Bfar (dans l'ordre des recepteurs)
+void ecrit_NFF(LigneFF &lff) {
+  FILE *ffb;
+  int nnz=lff.nz.size()/2;
+
+  //  if(verbose>5)  Ferr<<"FF.cpp: ecrit_NFF(): file "<<pcNzName<<" open for writing\n"; 
+  ffb=fopen(pcNzName,"ab");
+  fwrite(lff.nz.data(),sizeof(int),lff.nz.size(),ffb);
   fclose(ffb);
   diag(diag_idx+1)=(int)fabs(diag(diag_idx))+nnz;
   diag_idx++;
   nbFF+=nnz;
-  if(transp){
+  if(lff.transp){
     nbFF+=nnz;
     diag(diag_idx)*=-1;
   }
@@ -874,31 +956,19 @@ void NFF(SPMAT*FF,int &i_sup,int &i_inf,VEC **Cfar){
   //remplissage en append du fichier des coeff de la CL des Bfar
   if(Nc>0){
     ffb=fopen(pcBfName,"ab");
-    float clc[2];
-    for(i=0;i<=Nc;i++){
-      clc[0]=bfc(0,i)*dFF;
-      clc[1]=bfc(1,i)*dFF;
-      fwrite(clc,sizeof(float),2,ffb);
-    }
-    if(transp)
-      for(i=0;i<=Nc;i++){
-	clc[0]=bfc(2,i)*dFF;
-	clc[1]=bfc(3,i)*dFF;
-	fwrite(clc,sizeof(float),2,ffb);
-      } 
+    fwrite(lff.bf.data(),sizeof(float),lff.bf.size(),ffb);
     fclose(ffb);
   }
+}//ecrit_NFF()
 #endif
-  time(&now);
-  dTnff-=now;
-  Tnff-=dTnff;
-}//NFF()
 
 void stat_NFF() {
   //affichage des stats
 #define EPSILON 1E-6
 #define NONZERO(A) if ((A<EPSILON)&&(A>-EPSILON)){A= A>0 ? EPSILON: -EPSILON;}
   double dummy ;
+  unsigned long int ff_cum=ff_tot,vfar_cum=vfar_tot,far_cum=far_tot,glop_cum=glop_tot;
+  time_t Tproj=::Tproj,Tnff=::Tnff;
 
   dummy= (double)(ff_cum+far_cum) ;
   //Ferr<<"dummy= "<<dummy<<'\n';
@@ -935,9 +1005,6 @@ void stat_NFF() {
   fclose(diagb);
   //liberez la memoire!
   diag.free();
-  ligne.free();
-  ZbuffI.free(); ZbuffS.free();
-  DbuffI.free(); DbuffS.free();
   delete rhotab; delete i2stab;  
 #endif
 }//stat_NFF()
@@ -1,19 +1,33 @@
 #ifdef _NFF
 #define EXTR
 #else
-#define EXTR extern 
+#define EXTR extern
 #endif
 
+// ligne des FF d'un recepteur, calculee par NFF() (eventuellement dans un thread de calcul)
+// puis ecrite par ecrit_NFF() dans l'ordre des recepteurs
+typedef struct {
+  bool transp;
+  std::vector<int> nz;   // couples (no emetteur, nb de proxels)
+  std::vector<float> bf; // coeff des Bfar par couche de SAIL
+} LigneFF;
+
 //protos utilise dans Canopy
 
 //partie commune
 EXTR void proj_ortho(Diffuseur* E, reel *);
 EXTR void init_proj(Diffuseur * diffR );
 EXTR void stat_NFF();
+// buffers de projection, propres a chaque thread qui calcule des FF
+EXTR void init_NFF_thread();
+EXTR void fin_NFF_thread();
+// active la face de l'emetteur E vue dans la direction dir, renvoie son numero
+EXTR int active_emetteur(Diffuseur* E, Vecteur &dir);
 
 //partie differente entre version RAM et HD
 #ifdef _HD
-EXTR void NFF(int i_sup,int i_inf,VEC **Cfar);
+EXTR void NFF(int i_sup,int i_inf,VEC **Cfar,LigneFF &lff);
+EXTR void ecrit_NFF(LigneFF &lff);
 EXTR int ADS_val(int n);
 EXTR void ADS_maj(int n,int val);
 EXTR void init_NFF(char * envname,double *Esource,int nbpr,int nbf,double &Rsph,bool bias);
@@ -8,6 +8,8 @@
 *************************************************************/
 
 #include <iostream> // introduire la notion de namespace
+#include <chrono>
+#include <ctime>
 using namespace std ;
 
 #include <ferrlog.h>
@@ -20,6 +22,10 @@ HANDLE	hSharedSeg ;	// Handle du fichier mappe
 LPVOID	lpSharedSeg ;	// pointeur LPVOID sur seg. partage
 
 #include <assert.h>	// associe a detection d'erreurs IO Windows
+#include <io.h>		// dup, dup2 (-D)
+#else
+#include <sys/resource.h>	// getrusage (-T)
+#include <unistd.h>	// dup, dup2 (-D)
 #endif
 
 #include <outils.h>
@@ -48,6 +54,8 @@ static  void beep(const char *,int);
 static  void erreur_syntaxe(char *);
 static int options(int argc,char **argv);
 static  void genres();
+static  void simulation();
+static  void sert();
 
 // Variables globales 
 extern unsigned int NB;
@@ -69,11 +77,30 @@ static  bool ffseul, infty, geom, ordre1,
 static  double seuil;
 static  char *maqname, *envname, *optname, *lightname, *name8; 
 static   int clef_shm=-1;
+static   unsigned int isim_res=0; // simulation printed by genres()
+
+// wall and cpu times of the main stages, written in the log as "<stage> name wall=.. cpu=.." lines
+static struct {
+  std::chrono::steady_clock::time_point wall;
+  std::clock_t cpu;
+  void start(){
+    wall=std::chrono::steady_clock::now();
+    cpu=std::clock();
+  }
+  void stop(const char *name){
+    double dwall=std::chrono::duration<double>(std::chrono::steady_clock::now()-wall).count();
+    double dcpu=double(std::clock()-cpu)/CLOCKS_PER_SEC;
+    Ferr <<"<stage> "<<name<<" wall="<<dwall<<" cpu="<<dcpu<<"\n";
+  }
+} stage;
 static  char *dirname, *matname;
 // Option capteur virtuel - MC0699
 static  bool solem; 
 static char * nsolem;
 static bool doartifact;
+static bool serveur; // -D : repond a des requetes sur stdin
+static FILE *freponse;
+static char *gridname; // sauvegarde de la grille de voxels (-G)
 
 ferrlog Ferr((char*)"canestra.log") ;
 #ifndef NOMAIN
@@ -96,6 +123,7 @@ int main(int argc,char **argv){
   	
     //*********** Chargement de la scene et evt des capteurs virtuels ********
     clock.Start();
+    stage.start();
     if(byfile){
       scene.parse_can(maqname,optname,name8,bornemin, 
                       bornemax,sol,nsolem,doartifact,TabDiff);
@@ -128,6 +156,7 @@ int main(int argc,char **argv){
     }
     clock.Stop();
     Ferr<<"\n>>> Canestra[main] Scene chargee en "<<clock<< '\n';
+    stage.stop("load");
     // BUG?F(IPD)
     //fflush(stdout); 
     // fflush(stderr); 
@@ -138,19 +167,55 @@ int main(int argc,char **argv){
   
     if(!(radonly || ordre1 || denv==0))  {
       clock.Start();
+      stage.start();
       //ex-pb effet de bord avec projplan car modifie les bornes => vmin et vmax
-      scene.cstruit_grille(denv);
+      scene.cstruit_grille(denv,gridname);
       clock.Stop();
       Ferr<<">>> Canestra[main] Grille construite en "<<clock<< '\n' ;//endl;
+      stage.stop("grid");
     }
     //scene.mesh.visu();
   
+    if(serveur)
+      sert();
+    else
+      simulation();
+    // Gestion des fichiers persistants
+    if(bMemoriseMatrix==false) {
+      EffaceMatrices();
+    }
+#ifndef WIN32
+    if(memsize){// peak resident memory (kB) => maxmem.res
+      struct rusage usage;
+      getrusage(RUSAGE_SELF,&usage);
+      Ferr <<"<stage> maxrss="<<usage.ru_maxrss<<"\n";
+      FILE *fmem=fopen("maxmem.res","w");
+      fprintf(fmem,"%ld\n",usage.ru_maxrss);
+      fclose(fmem);
+    }
+#endif
+    Ferr <<"This is the end...\n"<<'\n';
+    Ferr.close();
+    return 0 ;
+  } //main()
+
+
+
+  /*****************************************************************************
+   **********               Fonctions Locales                          *********
+   *****************************************************************************/
+
+  //======> simulation(): eclairement direct, rediffusions et resultats d'une simulation (ou de nbsim avec -S)
+  void simulation(){
+    Chrono clock;
+
     //************ Calcul de l'eclairage direct (soleil & ciel)  ***************
     //    initialisation
     double *Bsource;
     opak=0;
   
     clock.Start();
+    stage.start();
     Bsource = new double[scene.radim];
     B= B0 = new VEC*[nbsim]; //B=B0 si pas de calcul des rediffusions
     for(i=0;i<nbsim;i++) {
@@ -165,11 +230,22 @@ int main(int argc,char **argv){
     double Esource,rho;
     //     calcul de l'eclairage direct (soleil, ciel)
     ifstream flight(lightname,ios::in);
+    char light_line[512];
+    int isim;
+    double dir_lu[3];
     do {
-      flight>>Esource;
-      if(!flight) 
+      // E vx vy vz [isim] : the 5th column gives the simulation of the source (-S), 0 by default
+      flight.getline(light_line,512);
+      if(!flight)
           break;
-      flight>>dir_source[0]>>dir_source[1]>>dir_source[2];
+      isim=0;
+      if(sscanf(light_line,"%lf %lf %lf %lf %d",&Esource,dir_lu,dir_lu+1,dir_lu+2,&isim)<4)
+          continue;
+      if(isim<0 || isim>=(int)nbsim){
+          Ferr <<"<!> Light source of simulation "<<isim<<" with -S "<<nbsim<<" => exit\n";
+          exit(17);
+      }
+      dir_source[0]=dir_lu[0]; dir_source[1]=dir_lu[1]; dir_source[2]=dir_lu[2];
     
       for(i=0;i<scene.radim;i++) {
           Bsource[i]=0.0;
@@ -188,7 +264,7 @@ int main(int argc,char **argv){
 	    rho=-TabDiff[i]->tau() * Bsource[i] / TabDiff[i]->surface();
 	  }
 	  // Cumule les contrib des differents angles solides
-	  B0[0]->ve[i]+=Esource*rho;
+	  B0[isim]->ve[i]+=Esource*rho;
 	  //Ferr <<"i="  << i<<" : Bsource="  << Bsource[i]<<", B0="  
 	  //     << B0[0]->ve[i]<<"\n" ;
 	  TabDiff[i]->active(0);// reactive le diff sur la face sup (defaut)
@@ -198,6 +274,7 @@ int main(int argc,char **argv){
     flight.close();
     clock.Stop();
     Ferr<<">>> Canestra[main] calcul du direct en "<<clock<<'\n' ; 
+    stage.stop("direct");
   
     if(byfile && doartifact){//ecriture du direct dans un fichier E0
       fres=fopen("E0.dat","w");
@@ -245,6 +322,7 @@ int main(int argc,char **argv){
     if(!ordre1){// Calcul des rediffusions
       //Calcul des FF et des Bfar
       clock.Start();
+      stage.start();
     
       VEC  *r0,*x;
       Cenv = new VEC*[nbsim];
@@ -263,6 +341,8 @@ int main(int argc,char **argv){
 
 	  hdmat_init(dirname,matname);
 	  scene.calc_FF_Bfar(Cenv,&Esource,envname,bias,denv,nbsim);
+	  // les requetes suivantes d'un serveur (-D) relisent la matrice
+	  radonly=serveur;
 	}
 	else{
 	  //lecture de la mat. : maj des NzName, DgName et BfName
@@ -299,6 +379,7 @@ int main(int argc,char **argv){
 #endif
 	clock.Stop();
 	Ferr<<">>> Canestra[main] FF et Bfar calcules  en "<<clock<< '\n';
+	stage.stop("formfactors");
 	//fflush(stderr);
       
 	/****************************************************/
@@ -318,16 +399,22 @@ int main(int argc,char **argv){
 	// FF -> syst. lineaire 1-Xi*Fij
 	if(verbose>1)  
 	  Ferr <<"==>Bi=E+Bfar\n" ;
-	for(i=0;i<scene.radim;i++) 
-	  B0[0]->ve[i]+=Cenv[0]->ve[i];
+	for(unsigned int k=0;k<nbsim;k++)
+	  for(i=0;i<scene.radim;i++) 
+	    B0[k]->ve[i]+=Cenv[k]->ve[i];
       
 	// Solve Ax=b; B precondionneur, tol seuil, limit nb_iter_max
 	clock.Start();
+	stage.start();
 	Ferr <<" MGCR-HD : seuil de cvgence = "  << seuil
 	     <<" - nb_iter_max = "  << nb_iter<<"\n " ;
       
 	//print_hd_mat(TabDiff);
-	hd_mgcr(B[0],B0[0],TabDiff,seuil,100, nb_iter, &num_steps);
+	// the form factors are shared by all the simulations, and read once if they fit in the memory budget
+	HdMat *ffmat=hd_mat_load();
+	for(unsigned int k=0;k<nbsim;k++)
+	  hd_mgcr(B[k],B0[k],TabDiff,ffmat,seuil,100, nb_iter, &num_steps);
+	hd_mat_free(ffmat);
 
 #else
 	if(ff_print) {
@@ -347,7 +434,8 @@ int main(int argc,char **argv){
 	double trans,refl,*pval;
 	opak=0;
 	for(i=0;i<FF->m;i++) {
-	  B0[0]->ve[i]+=Cenv[0]->ve[i];
+	  for(unsigned int k=0;k<nbsim;k++)
+	    B0[k]->ve[i]+=Cenv[k]->ve[i];
 	  r = FF->row+i;
 	  len=r->len;
 	  TabDiff[i]->activ_num(i);
@@ -385,11 +473,15 @@ int main(int argc,char **argv){
 	// Solve Ax=b; B precondionneur, tol seuil, limit nb_iter_max
 	//Methode  Leyk's MGCR
 	clock.Start();
+	stage.start();
 	Ferr <<" MGCR : seuil de cvgence = "  << seuil
 	     <<" - nb_iter_max = "  << nb_iter<<"\n " ;
       
-	B[0]=iter_spmgcr(FF, (SPMAT *)NULL, B0[0],seuil, B[0],
-			 20, nb_iter, &num_steps);
+	for(unsigned int k=0;k<nbsim;k++)
+	  B[k]=iter_spmgcr(FF, (SPMAT *)NULL, B0[k],seuil, B[k],
+			   20, nb_iter, &num_steps);
+	sp_free(FF);
+	v_free(r0);
 #endif
 	clock.Stop();
 	if(num_steps<nb_iter)
@@ -397,14 +489,16 @@ int main(int argc,char **argv){
 	else
 	  Ferr <<" MGCRN'A PAS CONVERGE' ! \n" ;
 	Ferr<<">>> Canestra[main] Resolution du SL par MGCR en "<<clock<<'\n';
+	stage.stop("solve");
       }//if denv<>0
 
       /************************************************************************/
       else{//SAIL pur
 	//Ferr << __FILE__<< " : "<< __LINE__ << '\n' ;
 	scene.sail_pur(Cenv,&Esource,envname);
-	for(i=0;i<scene.radim;i++) 
-	  B[0]->ve[i]=B0[0]->ve[i]+Cenv[0]->ve[i];
+	for(unsigned int k=0;k<nbsim;k++)
+	  for(i=0;i<scene.radim;i++) 
+	    B[k]->ve[i]=B0[k]->ve[i]+Cenv[0]->ve[i];
       }//if denv==0 ie SAIL pur
     
       /**********************************************************************/
@@ -412,26 +506,99 @@ int main(int argc,char **argv){
     }//if calcul des rediffusions
   
     //Rendu - Traitement des resultats
-    genres();
-    // Gestion des fichiers persistants
-    if(bMemoriseMatrix==false) {
-      EffaceMatrices();
+    stage.start();
+    for(isim_res=0;isim_res<nbsim;isim_res++)
+      genres();
+    stage.stop("output");
+    // liberation des vecteurs (un serveur enchaine les simulations)
+    for(unsigned int k=0;k<nbsim;k++) {
+      if(B!=B0)
+	v_free(B[k]);
+      v_free(B0[k]);
+      if(!ordre1)
+	v_free(Cenv[k]);
     }
-    Ferr <<"This is the end...\n"<<'\n';
-    Ferr.close();
-    return 0 ;
-  } //main()
+    if(B!=B0)
+      delete [] B;
+    delete [] B0;
+    if(!ordre1)
+      delete [] Cenv;
+    delete [] Bsource;
+  }//simulation()
 
 
+  //======> sert(): serveur (-D), la scene chargee repond aux requetes lues sur stdin, une par ligne :
+  //   [-l lightname] [-p optname] [-e envname] [-S nbsim]
+  // les options absentes reprennent leur valeur de la ligne de commande. Chaque requete est une
+  // simulation (memes fichiers resultats), suivie de la reponse "ok" ou "error <cause>" sur stdout ;
+  // les sorties de canestra vont sur stderr. Les FF calcules par la 1ere requete sont relus par les
+  // suivantes. Termine sur "quit" ou en fin d'entree
+  void sert(){
+    char requete[4096],*opt,*val;
+    char *light0=lightname,*opt0=optname,*env0=envname;
+    const char *erreur;
+    unsigned int nbsim0=nbsim;
+    FILE *f;
+
+    while(fgets(requete,sizeof(requete),stdin)!=NULL) {
+      lightname=light0;
+      optname=opt0;
+      envname=env0;
+      nbsim=nbsim0;
+      erreur=NULL;
+      opt=strtok(requete," \t\r\n");
+      if(opt!=NULL && strcmp(opt,"quit")==0)
+	break;
+      for(;opt!=NULL && erreur==NULL;opt=strtok(NULL," \t\r\n")) {
+	val=strtok(NULL," \t\r\n");
+	if(val==NULL || opt[0]!='-' || strlen(opt)!=2)
+	  erreur="syntax";
+	else
+	  switch(opt[1]) {
+	  case 'l' : lightname=val;      break;
+	  case 'p' : optname=val;        break;
+	  case 'e' : envname=val;        break;
+	  case 'S' : nbsim=atoi(val);    break;
+	  default  : erreur="unknown option";
+	  }
+      }
+      if(erreur==NULL && (nbsim<1 || (nbsim>1 && (byseg || envname!=NULL))))
+	erreur="-S";
+      if(erreur==NULL && ((f=fopen(lightname,"r"))==NULL || fclose(f)))
+	erreur="light file";
+      if(erreur==NULL && envname!=NULL && ((f=fopen(envname,"r"))==NULL || fclose(f)))
+	erreur="env file";
+      if(erreur==NULL && !scene.maj_optiques(optname))
+	erreur="opt file";
+      if(erreur==NULL) {
+	Ferr <<">>> Canestra[sert] requete : light="<<lightname<<" opt="<<optname<<'\n';
+	simulation();
+      }
+      cout.flush();
+      fflush(stdout);
+      Ferr.flush();
+      if(erreur==NULL)
+	fprintf(freponse,"ok\n");
+      else
+	fprintf(freponse,"error %s\n",erreur);
+      fflush(freponse);
+    }
+    fclose(freponse);
+  }//sert()
 
-  /*****************************************************************************
-   **********               Fonctions Locales                          *********
-   *****************************************************************************/
 
   //======>  genres(): calcule et genere les fichiers de resultats - MC98 
   void genres(){
     // Impression des resultats : vecteur des  radiosites, if(bio) Eabs.dat et Einc.dat
     int nbf=scene.radim-scene.nbcell;
+    // with -S, results of simulation k go to Etri.vec<k> (and solem<k>.dat), artifacts are those of the first one
+    bool artifacts=doartifact && isim_res==0;
+    char etriname[32],solemname[32];
+    sprintf(etriname,"Etri.vec%u",isim_res);
+    if(isim_res==0)
+      strcpy(solemname,"solem.dat");
+    else
+      sprintf(solemname,"solem%u.dat",isim_res);
   
     if(false && !ordre1){// genere les fichiers .dat de debug B0 et Bf generes
       if(envname != NULL){
@@ -442,31 +609,31 @@ int main(int argc,char **argv){
       }
       fres=fopen("B0.dat","w");
       for(j=0;j<nbf;j++) {
-	fprintf(fres,"%.10lf \n ",B0[0]->ve[j]);
+	fprintf(fres,"%.10lf \n ",B0[isim_res]->ve[j]);
       }
       fclose(fres);
     }// if fichiers .dat de debug B0 et Bf generes
     // Ecriture des radiosites totales => B.dat
-    if(byfile && doartifact){
+    if(byfile && artifacts){
       fres=fopen("B.dat","w");
       Ferr <<"==> Impression des resultats radim="  << scene.radim<<", nbcell="  << scene.nbcell<<"\n" ;
       for(j=0;j<nbf;j++) {
-	fprintf(fres,"%.10lf \n ",B[0]->ve[j]);
+	fprintf(fres,"%.10lf \n ",B[isim_res]->ve[j]);
       }
       fclose(fres);
     }
     // Ecriture des ecliarement des capteurs virtues => solem.dat
     if(scene.nbcell>0){
       //id 1er ordre Total en eclairement et surface
-      fres=fopen("solem.dat","w");
+      fres=fopen(solemname,"w");
       for(j=0;j<scene.nbcell;j++) {
 	fprintf(fres,"%.0lf\t %.10lf\t %.10lf \t%.6lf\n",
 		TabDiff[nbf+j]->primi().name(),
-		B0[0]->ve[nbf+j],B[0]->ve[nbf+j],
+		B0[isim_res]->ve[nbf+j],B[isim_res]->ve[nbf+j],
 		TabDiff[nbf+j]->primi().surface());
 	if(0) 
 	  Ferr <<"SOLEM: " << j<<"/" << scene.nbcell<<" radim="  << scene.radim
-	       <<", j+nbf="  << j+nbf<<", B0="  << B0[0]->ve[nbf+j]<<"\n" ;
+	       <<", j+nbf="  << j+nbf<<", B0="  << B0[isim_res]->ve[nbf+j]<<"\n" ;
       }
       fclose(fres);
     }//if nbcell>0
@@ -478,7 +645,7 @@ int main(int argc,char **argv){
       double *Te=NULL,surf, nom; 
       int Nt; int Nt0=0;
       if(byfile) {//by file
-        if(doartifact) {
+        if(artifacts) {
 	        fa=fopen("Eabs.vec","w");
 	        fi=fopen("Einc.vec","w");
 	        ft=fopen("Etri.vec","w");
@@ -486,7 +653,7 @@ int main(int argc,char **argv){
 	        fprintf(ft,"# label1 Area Eabs(E/s/m2) Ei(sup) Ei(inf) (Ex=surfacic density of energy <nrj/s/m2>)\n");
 	        }
 	// Version repreannt la liste initiale de triangle du .can pr PyCaribu
-	ft0=fopen("Etri.vec0","w");    
+	ft0=fopen(etriname,"w");    
 	fprintf(ft0,"# canestrad: can=%s F8=%s opt=%s light=%s : denv=%.2f direct=%d \n",maqname,name8,optname,lightname,denv,(int)ordre1 );
 	fprintf(ft0,"# No Label1 Area Eabs(E/s/m2) Ei(inf+sup) Ei(sup) Ei(inf) (Ex=surfacic density of energy <nrj/s/m2>)\n");
       
@@ -500,7 +667,8 @@ int main(int argc,char **argv){
 	Ferr <<"==> print_Eabs(): Nt="  << Nt<<", clef_shm="  << clef_shm<<"\n" ;
 #ifndef WIN32
 	// Mode Unix
-	shmid2=shmget((key_t)clef_shm,SEGSIZE*sizeof(double) ,IPC_CREAT|0666);
+	// 5 blocks of Nt-1 values: Eabs*S, Ei(sup)*S, Ei(inf)*S (-S if opaque), S, Ei
+	shmid2=shmget((key_t)clef_shm,5*Nt*sizeof(double) ,IPC_CREAT|0666);
 	if(shmid2==-1){//en cas de pb
 	  // stderr2cerr: Parse error here ?
 	  // Found _1_ formats but _0_ printable arguments
@@ -529,7 +697,7 @@ int main(int argc,char **argv){
 				 FILE_MAP_ALL_ACCESS,
 				 0,
 				 0,
-				 SEGSIZE*sizeof(double ))) != NULL ) ;
+				 5*Nt*sizeof(double ))) != NULL ) ;
       
 	Te=(double *)lpSharedSeg ;
 #endif
@@ -543,7 +711,7 @@ int main(int argc,char **argv){
       scene.Ldiff0.debut(); // ! Ldiff.finito();Ldiff.suivant()){
       for(i=0;i<nbf;i++) {
 	//Geston de la sortie Etrivec0 identique a liste de triangle en entree - MC09
-	while(scene.Ldiff0.contenu()>=0 ){
+	while(byfile && scene.Ldiff0.contenu()>=0 ){// Ldiff0 is only filled by parse_can
 	  if(scene.Ldiff0.finito()) break;
 	  if(doartifact) fprintf(ft0,"%d %.0f 0 Nan NaN NaN NaN\n",Nt0,scene.Ldiff0.contenu());
 	  Nt0++;
@@ -575,11 +743,11 @@ int main(int argc,char **argv){
 	      Ei[i]=Eabs[ia]=sEi=-1;
 	    }
 	    else{
-	      Ei[i]=sEi=B[0]->ve[i]/diff->rho();
-	      Eabs[ia]=Ei[i]-B[0]->ve[i];
+	      Ei[i]=sEi=B[isim_res]->ve[i]/diff->rho();
+	      Eabs[ia]=Ei[i]-B[isim_res]->ve[i];
 	    }
 	    if(byfile){
-	      if(doartifact) {
+	      if(artifacts) {
 	      fprintf(fi,"%g\n",Ei[i]);
 	      fprintf(fa,"%g\n",Eabs[ia]*surf);
 	      fprintf(ft,"%.0f %f  %f  %f %f\n",nom, surf, Eabs[ia], Ei[i],-1.);
@@ -592,9 +760,11 @@ int main(int argc,char **argv){
 	      Te[ia]=Eabs[ia]*surf;
 	      //MCoct05: caribu4.4
 	      //met dans le SegMem les eclairement des faces sup et inf 
-	      // Bug MC nov05: Te[ia+(Nt+1)]=B[0]->ve[i]*surf; //face sup
+	      // Bug MC nov05: Te[ia+(Nt+1)]=B[isim_res]->ve[i]*surf; //face sup
 	      Te[ia+(Nt-1)]=Ei[i]*surf; //face sup
 	      Te[ia+2*(Nt-1)]=-surf; //face inf
+	      Te[ia+3*(Nt-1)]=surf;
+	      Te[ia+4*(Nt-1)]=sEi;
 	      // Ferr <<"Te["  << ia<<"]="  << Te[ia]<<"\n" ;
 	    }
 	    //MCMarch2006
@@ -615,27 +785,27 @@ int main(int argc,char **argv){
 	      Eabs[ia]=-1;
 	      Ei[i-1]=Ei[i]=-1;
 	      if(r0==t1){
-		    Eabs[ia]=B[0]->ve[i-1]*(1/r0-1)-B[0]->ve[i];
+		    Eabs[ia]=B[isim_res]->ve[i-1]*(1/r0-1)-B[isim_res]->ve[i];
 		    sEi = Eabs[ia] / (1 - r0 - t0);
 		    }
 	    }
 	    else{
-	      D0= B[0]->ve[i-1]*r1 - B[0]->ve[i]*t1;
-	      D1=r0*B[0]->ve[i] - t0*B[0]->ve[i-1];
+	      D0= B[isim_res]->ve[i-1]*r1 - B[isim_res]->ve[i]*t1;
+	      D1=r0*B[isim_res]->ve[i] - t0*B[isim_res]->ve[i-1];
 	      Ei[i-1]=D0/D;
 	      Ei[i]=D1/D;
-	      Eabs[ia]= Ei[i-1]+Ei[i] - (B[0]->ve[i-1]+B[0]->ve[i]);
+	      Eabs[ia]= Ei[i-1]+Ei[i] - (B[isim_res]->ve[i-1]+B[isim_res]->ve[i]);
 	      sEi = Ei[i-1] + Ei[i];
 	      /* debug
-		 Ferr  << r0<<"\t"  <<  t1<<"\t= "  <<  B[0]->ve[i-1]<<"\n" ;
-		 Ferr  << t0<<"\t"  <<  r1<<"\t= "  <<  B[0]->ve[i]<<"\n" ;
+		 Ferr  << r0<<"\t"  <<  t1<<"\t= "  <<  B[isim_res]->ve[i-1]<<"\n" ;
+		 Ferr  << t0<<"\t"  <<  r1<<"\t= "  <<  B[isim_res]->ve[i]<<"\n" ;
 		 Ferr <<"D0="  << D0<<", D1="  << D1<<", D="  << D<<" => E["  
 		 << i-1<<"]="  << Ei[i-1]<<", E["  << i<<"]="  << Ei[i]
 		 <<", Ea["  <<  ia<<"]="  <<  Eabs[ia]<<"\n\n" ;
 		 /recommenter */
 	    }
 	    if(byfile){
-	      if(doartifact){
+	      if(artifacts){
 	      fprintf(fi,"%g\n%g\n",Ei[i-1], Ei[i]);
 	      fprintf(fa,"%g\n",Eabs[ia]*surf);
 	      fprintf(ft,"%.0f %f  %f  %f %f\n",nom, surf, Eabs[ia], Ei[i-1], Ei[i]);
@@ -648,11 +818,13 @@ int main(int argc,char **argv){
 	      Te[ia]=Eabs[ia]*surf;
 	      //MCoct05: caribu4.4
 	      /* Bug 221105 MC
-		 Te[ia+(Nt+1)]=B[0]->ve[i-1]*surf;//face sup 
-		 Te[ia+2*(Nt+1)]=B[0]->ve[i]*surf; //face inf
+		 Te[ia+(Nt+1)]=B[isim_res]->ve[i-1]*surf;//face sup 
+		 Te[ia+2*(Nt+1)]=B[isim_res]->ve[i]*surf; //face inf
 	      */
 	      Te[ia+(Nt-1)]=Ei[i-1]*surf;//face sup 
 	      Te[ia+2*(Nt-1)]=Ei[i]*surf; //face inf
+	      Te[ia+3*(Nt-1)]=surf;
+	      Te[ia+4*(Nt-1)]=sEi;
 	   
 	      if(verbose>2) {
 		Ferr <<"Te["  << ia<<"]="  << Te[ia]<<" Ei(sup)="<<Ei[i-1]<<", Ei(inf)="<<Ei[i]<<"\n" ;
@@ -668,12 +840,12 @@ int main(int argc,char **argv){
 	}//if not soil appended
 	else{// soil appended and soil primitive
 	  /* Old version - Modif MC june08
-	     Esol+= B[0]->ve[i]*surf/diff->rho();
+	     Esol+= B[isim_res]->ve[i]*surf/diff->rho();
 	     Ssol+=surf;
 	  */
-	  Ei[i]=B[0]->ve[i]/diff->rho();
-	  Eabs[ia]=Ei[i]-B[0]->ve[i];
-	  if(byfile && doartifact){
+	  Ei[i]=B[isim_res]->ve[i]/diff->rho();
+	  Eabs[ia]=Ei[i]-B[isim_res]->ve[i];
+	  if(byfile && artifacts){
 	    fprintf(fi,"%g\n", Ei[i]);
 	    fprintf(fa,"%g\n",Eabs[ia]*surf);
 	    fprintf(ft,"%.0f %f  %f  %f %f\n",nom, surf, Eabs[ia], Ei[i],-2.);
@@ -684,7 +856,7 @@ int main(int argc,char **argv){
 	} 
       }//for nb_faces 
       //vidage de liste au cas ou - MC09
-      if(!scene.Ldiff0.finito())
+      if(byfile && !scene.Ldiff0.finito())
 	while(scene.Ldiff0.contenu()>=0 ){
 	  fprintf(ft0,"%d %.0f 0 NaN NaN NaN NaN\n",Nt0,scene.Ldiff0.contenu());
 	  Nt0++;
@@ -708,7 +880,7 @@ int main(int argc,char **argv){
       //Ferr << "Au max on atteint: Eabs["<<ia<<"]"<<'\n';
 
       if(byfile){
-	if(doartifact) {
+	if(artifacts) {
 	fclose(fi);
 	fclose(fa);
 	fclose(ft);
@@ -717,7 +889,7 @@ int main(int argc,char **argv){
       } else
 #ifndef WIN32
 	// Unix way
-	shmdt((void*)(size_t)shmid2);
+	shmdt((void*)Te);
 #else
       // Complicated Way
       UnmapViewOfFile(lpSharedSeg) ; // invalidation du ptr sur mem partagee
@@ -748,20 +920,25 @@ int main(int argc,char **argv){
       "  -8 filename \t Infinite periodic canopy \n"	 "  -e filename \t Mean fluxes data (computed by SAIL) \n"
       "  -r Rsph \t Radius of the surrounding sphere \n"
       "  -d Dsph \t Diameter of the surrounding sphere \n"
+      "  -G filename \t Read the voxel grid from filename if it was built for the same scene, else build and write it there\n"
       "  -F \t\t Print the form factors matrix \n"
       "  -R nb \t Resolution of the projection disk [52] \n"	
       "  -S nb \t Number of simulations [1] \n"
       "  -i nb \t Number of iteration of the CG solver [100]\n" 
       "  -a threshold \t Threshold of the CG solver [1e6] \n"
+      "  -b size \t Memory (MB) allowed to hold the form factors during the solve, else they are read from disk at each iteration [1024]\n"
       "  -1 \t\t Compute only the direct lightning \n"
       "  -L nb \t Resolution of the light screen [1536]  \n"
+      "  -j nb \t Number of threads of the projections on the light screen and of the form factors [1]\n"
       "  -A \t\t Generate  energy vector (Eabs.dat, Einc.dat)\n"
       "  -g \t\t Generate the geometry file (geom.dat)\n"
       "  -B \t\t Test the effect of the choice of inner triangles (bias?) \n"
-      "  -T \t\t Estimate the maximum required memory\n"
+      "  -T \t\t Write the peak memory usage (kB) in maxmem.res\n"
       "  -v nb \t The level of verbose\n"
       "  -C filename \t File describing the virtual sensors\n"
-      "  -n \t\t do not produce intermediate artifacts (B.dat, ...)"
+      "  -n \t\t do not produce intermediate artifacts (B.dat, ...)\n"
+      "  -D \t\t Serve requests read on stdin, one simulation per line of options among -l -p -e -S,\n"
+      "     \t\t replied by \"ok\" or \"error <cause>\" on stdout, the scene being loaded once\n"
 #ifdef _HD   
       "  -f filename \t Simulate and store the matrix in filemane \n"
       "  -w filename\t Read the matrix file to simulate an other radiative case, without to compute form factors \n"
@@ -774,16 +951,17 @@ int main(int argc,char **argv){
   //======> options(): traite la ligne de commande argv - MC98
   int options(int argc,char **argv){
     int c;
-    GetOpt option(argc,argv,"AC:BFTg1hs:L:M:R:S:8:a:d:e:f:i:l:m:np:r:t:v:w:");
+    GetOpt option(argc,argv,"AC:BDFG:Tg1hs:L:M:R:S:8:a:b:d:e:f:i:j:l:m:np:r:t:v:w:");
   
     // Valeur par defaut des options
     NB=52; nb_iter=1000; nbsim=1;
     denv=0.30; seuil=1e-6; //-1 ie seuil_solver=MACHEPS
-    ffseul=infty=geom=ordre1=ff_print=bio=byseg=byfile=radonly=memsize=solem=false;
+    ffseul=infty=geom=ordre1=ff_print=bio=byseg=byfile=radonly=memsize=solem=serveur=false;
     bias=doartifact=true;
-    lightname=maqname=envname=optname=name8=dirname=matname=nsolem=NULL;
+    lightname=maqname=envname=optname=name8=dirname=matname=nsolem=gridname=NULL;
     sol=0;
     scene.Timg=1536;
+    scene.nthreads=1;
     // Traitememnt des options
     if(argc<2){erreur_syntaxe(argv[0]);return 1;}
     while((c=option())!=EOF)
@@ -791,11 +969,15 @@ int main(int argc,char **argv){
       case 'A' : bio =true;                       break;// genere Eabs.dat et Einc.dat
       case 'B' : bias=false;                      break;// pb des a cheval sur la sphere  
       case 'C' : nsolem=option.optarg; solem=true;break;// solem.can     
+      case 'D' : serveur=true;                   break;// requetes sur stdin
       case 'F' : ff_print=true;                  break;// FF -> FF.dat
+      case 'G' : gridname=option.optarg;         break;// grille de voxels sauvegardee
       case 'L' : scene.Timg=atoi(option.optarg); break;//Resolution projplan 
+      case 'j' : scene.nthreads=atoi(option.optarg); break;// threads de projplan et calc_FF_Bfar
       case 'M' : maqname=option.optarg; byfile=true; break;//maquette .can
       case 'S' : nbsim=atoi(option.optarg);      break;// nombre de simulations  
       case 'R' : NB=atoi(option.optarg);      break;// Resolution FF
+      case 'b' : hd_mem_budget=atof(option.optarg); break;// budget memoire (Mo) des FF pour le solveur
       case 'T' : memsize=true;                   break;// Appel maxmem> maxmem.res mem en Ko 
       case '1' : ordre1=true;                    break;//stop apres ordre 1
       case '8' : infty=true;name8=option.optarg; break;//infinity  
@@ -839,7 +1021,18 @@ int main(int argc,char **argv){
 	"    [-M maqname| -m shmkey]  -p optname -l lightname \n " ;
       return 1;
     }  
+    if(nbsim<1 || (nbsim>1 && (byseg || envname!=NULL))){
+      // mean fluxes (-e) are computed for one light configuration only
+      Ferr <<"<!> Fatal error"  << (char)7<<"\n==> -S nb should be positive, and"
+	" can not be used with -m or -e\n " ;
+      return 1;
+    }
   
+    if(serveur) {// stdout est reserve aux reponses du serveur, les sorties de canestra vont sur stderr
+      fflush(stdout);
+      freponse=fdopen(dup(1),"w");
+      dup2(2,1);
+    }
     if(byfile) cout <<"\n Fichier maquette  :: "<<maqname;
     if(byseg ) cout <<"\n SegMem  maquette  :: "<<clef_shm;
     cout <<"\n Fichier optique   :: "<<optname;
@@ -894,15 +1087,6 @@ int main(int argc,char **argv){
   
     if(dirname==NULL) {
       dirname= new char[100]; strcpy(dirname,".\\");}
-    if(memsize){
-      char cmd[125];
-      snprintf(cmd,sizeof(cmd),"maxmem %s 1 > maxmem.res &",argv[0]);
-      if(verbose)
-	Ferr <<"Option -T :  Pour avoir le max de memoire occupee = "<<cmd<<"\n";
-      if (system(cmd) == -1) {
-		perror("Error executing system command");
-	  }
-    }
     fflush(stdout); fflush(stderr); 
     //Fin Gestion des Options
     return 0;
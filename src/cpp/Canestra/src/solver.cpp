@@ -35,23 +35,91 @@ extern "C" {
 
 static double nff;
 
+double hd_mem_budget=1024.;//Mo : matrices chargees en memoire si elles tiennent dans ce budget
+
+static HdMat *memff=NULL;// matrice de hd_mgcr() en cours, NULL si elle est lue sur disque
+
+static long file_size(const char *name) {
+  FILE *fic=fopen(name,"rb");
+  long size;
+
+  if(fic==NULL) return -1;
+  fseek(fic,0,SEEK_END);
+  size=ftell(fic);
+  fclose(fic);
+  return size;
+}
+
+void hd_mat_free(HdMat *ff) {
+  if(ff==NULL) return;
+  delete [] ff->diag;
+  delete [] ff->nz;
+  delete ff;
+}
+
+/* hd_mat_load -- charge diag.bzh et nzero.bzh en memoire s'ils tiennent dans hd_mem_budget (Mo)
+   -- sinon renvoie NULL, et hd_mv_mlt() relit les fichiers a chaque produit */
+HdMat *hd_mat_load() {
+  long dgsize=file_size(pcDgName), nzsize=file_size(pcNzName);
+  FILE *fic;
+  size_t nnz;
+  bool ok;
+  HdMat *ff;
+
+  if(dgsize<0 || nzsize<0 || dgsize+nzsize > hd_mem_budget*1024.*1024.) {
+    Ferr <<"hd_mat_load: form factors read from "<<pcNzName<<" at each product\n";
+    return NULL;
+  }
+  ff=new HdMat;
+  ff->diag=ff->nz=NULL;
+  fic=fopen(pcDgName,"rb");
+  ok=fread(&ff->n,sizeof(int),1,fic)==1 && fread(&ff->nd,sizeof(int),1,fic)==1
+    && fread(&ff->dff,sizeof(double),1,fic)==1;
+  if(ok) {
+    ff->diag=new int[ff->nd+1];
+    ok=fread(ff->diag,sizeof(int),ff->nd+1,fic)==(size_t)ff->nd+1;
+  }
+  fclose(fic);
+  nnz=nzsize/(2*sizeof(int));
+  ff->nz=new int[2*nnz+2];
+  fic=fopen(pcNzName,"rb");
+  ok=ok && fread(ff->nz,2*sizeof(int),nnz,fic)==nnz;
+  fclose(fic);
+  if(!ok) {
+    hd_mat_free(ff);
+    Ferr <<"hd_mat_load: form factors read from "<<pcNzName<<" at each product\n";
+    return NULL;
+  }
+  Ferr <<"hd_mat_load: form factors held in memory\n";
+  return ff;
+}
+
 /* hd_mv_mlt -- hard disk sparse matrix/dense vector multiply
    -- result is in out, which is returned unless out==NULL on entry
-   --  if out==NULL on entry then the result vector is created */
+   --  if out==NULL on entry then the result vector is created
+   -- the matrix is read from memory if hd_mgcr() was given one, else from the files */
 VEC *hd_mv_mlt(SPMAT* A,VEC *x,VEC* out) {
-  int	tamp[2],i,is, j_idx,j, n,iff,nd,*diag;//ip : indice prim, is indice face
+  int	tamp[2],i,is, j_idx,j, n,iff,nd,*diag,*nz;//ip : indice prim, is indice face
   Real	sum, *x_ve,sum2;
   double dff;//pour passer d'un FF en pixel a un FF reel
   double rho[2],tau[2],po;
   Diffuseur **TabDiff=(Diffuseur **)A;
-  FILE *fic;
+  FILE *fic=NULL;
   char transp;
   
-  fic=fopen(pcDgName,"rb");
-  
-  fread(&n,sizeof(int),1,fic);
-  fread(&nd,sizeof(int),1,fic);
-  fread(&dff,sizeof(double),1,fic);
+  if(memff) {
+    n=memff->n; nd=memff->nd; dff=memff->dff;
+    diag=memff->diag;
+  } else {
+    fic=fopen(pcDgName,"rb");
+    fread(&n,sizeof(int),1,fic);
+    fread(&nd,sizeof(int),1,fic);
+    fread(&dff,sizeof(double),1,fic);
+    //chargement des indices de la diago
+    diag=new int[nd+1];//nd= nb prim + 1
+    fread(diag,sizeof(int),nd+1,fic);
+    fclose(fic);
+  }
   if ( ! A || ! x )
     error(E_NULL, "hd_mv_mlt");
   if ( x->dim != n ){
@@ -63,21 +131,17 @@ VEC *hd_mv_mlt(SPMAT* A,VEC *x,VEC* out) {
   if ( out == x )
     error(E_INSITU,"hd_mv_mlt");
   x_ve = x->ve;
-  //chargement des indices de la diago
-  diag=new int[nd+1];//nd= nb prim + 1
-  fread(diag,sizeof(int),nd+1,fic);
-  fclose(fic);
   //Produit fait ligne a ligne
-  fic=fopen(pcNzName,"rb");
-  /*  FILE *fica,*f2;
-      fica=fopen("nzero.txt","r");
-      f2=fopen("nzero.dbx","w");
-      */
+  if(memff)
+    nz=memff->nz;
+  else {
+    nz=tamp;
+    fic=fopen(pcNzName,"rb");
+  }
   is=0;
   for ( i = 0; i < nd; i++ ){
      
      transp=(diag[i+1]>0)?0:1;
-     //printf(".. i=%d, is=%d, diag=%d, n=%d, nd=%d ",i,is,diag[i+1],n,nd); fflush(stdout);
      sum=x_ve[is];//la diago vaut 1
      TabDiff[is]->activ_num(is);
     rho[0]= -TabDiff[is]->rho();
@@ -91,17 +155,11 @@ VEC *hd_mv_mlt(SPMAT* A,VEC *x,VEC* out) {
     }
     TabDiff[is]->activ_num(is);
     for (j_idx = (int) fabs(double(diag[i]))-1; j_idx<fabs(double(diag[i+1]))-1; j_idx++) {
-      fread(tamp,sizeof(int),2,fic);
-      j=tamp[0]; iff=tamp[1];
-      /*if(j>=2000) 
-	Ferr <<"Solver : i="  << i<<" : j="  << j<<" - ji-= "  
-	<< diag[i]<<" -ji+="  << diag[i+1]<<"- iff="  << iff<<" \n" ;
-	fprintf(f2,"%d %d  ",j,iff);
-	fscanf(fica,"%d %d",&j,&iff);      
-	if(j>=2000) 
-	Ferr <<"Sol ASCII: i="  << i<<" : j="  << j<<" - ji-= "  
-	<< diag[i]<<" -ji+="  << diag[i+1]<<"- iff="  << iff<<" \n" ;
-       */
+      if(fic)
+        fread(tamp,sizeof(int),2,fic);
+      j=nz[0]; iff=nz[1];
+      if(!fic)
+        nz+=2;
       if(iff>0)
 	po=rho[0];
       else
@@ -119,25 +177,22 @@ VEC *hd_mv_mlt(SPMAT* A,VEC *x,VEC* out) {
      
     if(transp){
       out->ve[++is] = sum2;
-      //Ferr <<"T\n" ;
     }
-    //else
-    //Ferr <<"O\n" ;
-
-    //fflush(stdout);
       is++;
-    // fprintf(f2,"\n");
   }//for i (ligne)
-  fclose(fic);
-  //fclose(fica); fclose(f2);
+  if(fic) {
+    fclose(fic);
+    delete [] diag;
+  }
   return out;
 }
 
 
-void hd_mgcr(VEC *x,VEC *b, Diffuseur **TabDiff,double tol,int krylov,int limit, int *steps) {
+void hd_mgcr(VEC *x,VEC *b, Diffuseur **TabDiff,HdMat *ff,double tol,int krylov,int limit, int *steps) {
   //mise en forme de la structure iterative
   ITER *ip;
   
+  memff=ff;
   ip = iter_get(0,0);
   ip->Ax = (Fun_Ax) hd_mv_mlt;
   ip->A_par =TabDiff ;
@@ -341,6 +396,7 @@ void hd_mgcr(VEC *x,VEC *b, Diffuseur **TabDiff,double tol,int krylov,int limit,
   if (steps) *steps = ip->steps;
   ip->shared_x = ip->shared_b = TRUE;
   iter_free(ip);
+  memff=NULL;
 }//hd_mgcr()
 
 void print_hd_mat(Diffuseur **TabDiff) {
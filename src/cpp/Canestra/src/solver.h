@@ -3,5 +3,17 @@
 #else
 #define EXTR extern 
 #endif
-EXTR void hd_mgcr(VEC *x,VEC *b, Diffuseur **TabDiff,double tol,int krylov,int limit, int *steps);
+/* matrice des FF (diag.bzh et nzero.bzh) chargee en memoire */
+typedef struct {
+  int n,nd;
+  double dff;
+  int *diag;// nd+1 indices
+  int *nz;  // couples (j,iff)
+} HdMat;
+EXTR HdMat *hd_mat_load();
+EXTR void hd_mat_free(HdMat *ff);
+EXTR void hd_mgcr(VEC *x,VEC *b, Diffuseur **TabDiff,HdMat *ff,double tol,int krylov,int limit, int *steps);
 EXTR void print_hd_mat(Diffuseur **TabDiff);
+#ifndef _solver
+extern double hd_mem_budget;// Mo
+#endif
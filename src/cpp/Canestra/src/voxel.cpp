@@ -5,6 +5,9 @@ using namespace std ;
 // reglage de la subdivision adaptative en run-time
 
 #include <fstream> //.h>
+#include <cstring>
+#include <string>
+#include <vector>
 
 //#define SEUIL_NB_DIFF 2
 int SEUIL_NB_DIFF= 20; // 10fort.big.maq 184 lines
@@ -233,7 +236,7 @@ void Voxel::visu(){
 
 //-****************** Voxel::construction()  *****************
 void Voxel::construction(reel* bornemin, reel* bornemax,
-			 double Renv, ListeD<Diffuseur*>& Ldiff) {
+			 double Renv, ListeD<Diffuseur*>& Ldiff, char *fichier) {
   double delta[3],reste,ratio=1.0 ;
   int i;
   FILE *grille_par;
@@ -254,6 +257,7 @@ void Voxel::construction(reel* bornemin, reel* bornemax,
   }
   else {
     fscanf(grille_par,"%d %lg",&SEUIL_NB_DIFF,&ratio);
+    fclose(grille_par);
     Ferr <<"Seuil dans "  << grille_nom<<" = "  << SEUIL_NB_DIFF
        <<" - ratio = "  << ratio<<"\n" ;
     }
@@ -282,12 +286,161 @@ void Voxel::construction(reel* bornemin, reel* bornemax,
   SI.alloue(nb_vox[0],nb_vox [1],nb_vox [2]);
   SI.maj((BSP *)0 );
   // printf"Voxel[construction] creation de la grille\n)"; 
-  creation(bornemin, bornemax, nb_vox, Ldiff);
+  if(fichier!=NULL && lecture(fichier, Renv, ratio, bornemax, Ldiff))
+    Ferr <<"Voxel[construction] grille lue dans "  << fichier<<"\n" ;
+  else {
+    creation(bornemin, bornemax, nb_vox, Ldiff);
+    if(fichier!=NULL)
+      ecriture(fichier, Renv, ratio, bornemax, Ldiff);
+  }
   if(verbose) 
     Ferr <<"Voxel[construction] nbre de boites cre'e'es = "  << num_box<<"\n" ;
   // visu();
   Ferr <<"Voxel[construction] FIN\n" ;
 }//Voxel::construction()
 
+//-****************** Sauvegarde de la grille  *****************
+// La grille ne depend que de la scene et des parametres de subdivision : elle est ecrite dans un fichier
+// pour etre relue par les simulations suivantes de la meme scene (autres sources, optiques ou bandes)
+
+// entete du fichier : la grille n'est relue que si elle a ete construite avec les memes parametres pour
+// les memes diffuseurs (empreinte de leur numero et de leurs sommets)
+typedef struct {
+  char magic[8];
+  int version,seuil,nb_vox[3];
+  unsigned int nbdiff;
+  double Renv,ratio,taille;
+  reel bmin[3],bmax[3];
+  unsigned long long empreinte;
+} EnteteGrille;
+
+static void fnv1a(unsigned long long &h, const void *p, size_t n) {
+  const unsigned char *c=static_cast<const unsigned char *>(p);
+  for(size_t i=0;i<n;i++) {
+    h^=c[i];
+    h*=1099511628211ULL;
+  }
+}//fnv1a()
+
+static void entete(EnteteGrille &E, double Renv, double ratio, double taille, reel *O, reel *bornemax,
+		   int *nb_vox, ListeD<Diffuseur *>& Ldiff) {
+  Diffuseur *pdiff;
+  unsigned int no;
+  int i,n;
+  char reel_;
+
+  memset(&E,0,sizeof(EnteteGrille));// octets de bourrage compris
+  memcpy(E.magic,"CNSTGRID",8);
+  E.version=1;
+  E.seuil=SEUIL_NB_DIFF;
+  E.nbdiff=Diffuseur::idx;
+  E.Renv=Renv;
+  E.ratio=ratio;
+  E.taille=taille;
+  for(i=0;i<3;i++) {
+    E.nb_vox[i]=nb_vox[i];
+    E.bmin[i]=O[i];
+    E.bmax[i]=bornemax[i];
+  }
+  E.empreinte=14695981039346656037ULL;
+  for(Ldiff.debut();!Ldiff.finito();Ldiff.suivant()) {
+    pdiff=Ldiff.contenu();
+    no=pdiff->num(0);
+    reel_=pdiff->isreal();
+    n=pdiff->primi().nb_sommet();
+    fnv1a(E.empreinte,&no,sizeof(no));
+    fnv1a(E.empreinte,&reel_,1);
+    for(i=0;i<n;i++)
+      for(int k=0;k<3;k++) {
+	reel x=pdiff->primi().sommets(i)[k];
+	fnv1a(E.empreinte,&x,sizeof(reel));
+      }
+  }
+}//entete()
+
+void Voxel::ecriture(char *fichier, double Renv, double ratio, reel *bornemax, ListeD<Diffuseur *>& Ldiff) {
+  EnteteGrille E;
+  string tmp=string(fichier)+".tmp";
+  vector<bool> vue(num_box,false);
+  vector<int> Tnom(nb_vox[0]*nb_vox[1]*nb_vox[2]);
+  vector<BSP *> Tbox;
+  BSP *B;
+  FILE *f;
+  int i,j,k,n=0,nb;
 
+  for(i=0;i<nb_vox[0];i++)
+    for(j=0;j<nb_vox[1];j++)
+      for(k=0;k<nb_vox[2];k++) {
+	B=SI(i,j,k);
+	Tnom[n++]=(B==NULL)? -1 : B->nom();
+	if(B!=NULL && !vue[B->nom()]) {
+	  vue[B->nom()]=true;
+	  Tbox.push_back(B);
+	}
+      }
+  f=fopen(tmp.c_str(),"wb");
+  if(f==NULL) {
+    Ferr <<"<!> Voxel::ecriture() : impossible d'ecrire la grille dans "  << fichier<<"\n" ;
+    return;
+  }
+  entete(E,Renv,ratio,taille_vox,O,bornemax,nb_vox,Ldiff);
+  fwrite(&E,sizeof(EnteteGrille),1,f);
+  fwrite(&num_box,sizeof(int),1,f);
+  nb=Tbox.size();
+  fwrite(&nb,sizeof(int),1,f);
+  for(BSP *b : Tbox)
+    b->ecrit(f);
+  fwrite(Tnom.data(),sizeof(int),Tnom.size(),f);
+  fclose(f);
+  remove(fichier);
+  rename(tmp.c_str(),fichier);
+  Ferr <<"Voxel[construction] grille ecrite dans "  << fichier<<"\n" ;
+}//Voxel::ecriture()
 
+bool Voxel::lecture(char *fichier, double Renv, double ratio, reel *bornemax, ListeD<Diffuseur *>& Ldiff) {
+  EnteteGrille E,Elu;
+  vector<Diffuseur *> Tdiff(Diffuseur::idx,(Diffuseur *)NULL);
+  vector<BSP *> Tbox;
+  vector<int> Tnom(nb_vox[0]*nb_vox[1]*nb_vox[2]);
+  BSP *B;
+  FILE *f;
+  int i,j,k,n=0,nlab,nb;
+  bool ok;
+
+  f=fopen(fichier,"rb");
+  if(f==NULL)
+    return false;
+  entete(E,Renv,ratio,taille_vox,O,bornemax,nb_vox,Ldiff);
+  ok = fread(&Elu,sizeof(EnteteGrille),1,f)==1 && memcmp(&E,&Elu,sizeof(EnteteGrille))==0
+    && fread(&nlab,sizeof(int),1,f)==1 && fread(&nb,sizeof(int),1,f)==1 && nlab>=0 && nb>=0 && nb<=nlab;
+  if(ok) {
+    for(Ldiff.debut();!Ldiff.finito();Ldiff.suivant())
+      Tdiff[Ldiff.contenu()->num(0)]=Ldiff.contenu();
+    Tbox.assign(nlab,(BSP *)NULL);
+    for(i=0;ok && i<nb;i++) {
+      B=new BSP;
+      ok=B->lit(f,Tdiff.data(),Tdiff.size()) && B->nom()>=0 && B->nom()<nlab && Tbox[B->nom()]==NULL;
+      if(ok)
+	Tbox[B->nom()]=B;
+      else
+	delete B;
+    }
+    ok = ok && fread(Tnom.data(),sizeof(int),Tnom.size(),f)==Tnom.size();
+  }
+  fclose(f);
+  for(n=0;ok && n<(int)Tnom.size();n++)
+    ok = Tnom[n]>=-1 && Tnom[n]<nlab && (Tnom[n]==-1 || Tbox[Tnom[n]]!=NULL);
+  if(!ok) {
+    Ferr <<"<!> Voxel::lecture() : grille de "  << fichier<<" invalide ou d'une autre scene, reconstruite\n" ;
+    for(BSP *b : Tbox)
+      delete b;
+    return false;
+  }
+  n=0;
+  for(i=0;i<nb_vox[0];i++)
+    for(j=0;j<nb_vox[1];j++)
+      for(k=0;k<nb_vox[2];k++,n++)
+	SI(i,j,k)=(Tnom[n]==-1)? NULL : Tbox[Tnom[n]];
+  num_box=nlab;
+  return true;
+}//Voxel::lecture()
@@ -258,6 +258,8 @@ public:
   void ranger(Type);
   unsigned int card() // donne le nbre d'elements (cardinal) 
   {return nbe;}
+  Noeud<Type>* tete() // premier noeud, pour un parcours sans le pointeur courant (lectures concurrentes)
+  {return premier;}
 };// class Liste
 
 //template <class Type> inline void detruire_contenu(Liste<Type *>&);
@@ -2,6 +2,7 @@
 #define _BSP
 
 //#include "utilitaires.cc"
+#include <cstdio>
 #include "diffuseur.h"
 
 // BSP
@@ -38,6 +39,9 @@ public:
   // decoupe une boite en deux boites filles
   void decoupe_boite(int, BSP*, BSP*, double);
   bool contient(Point &P) const;
+  // ecrit/lit une boite feuille (bornes, nom et no des diffuseurs), Tdiff indexe par Diffuseur::num(0)
+  void ecrit(FILE*);
+  bool lit(FILE*, Diffuseur **Tdiff, unsigned int nbdiff);
 };
 
 #endif
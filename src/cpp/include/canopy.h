@@ -33,12 +33,17 @@ class Canopy{
   reel bmax[3],vmax[3];
   bool infty;
   reel delta[2]; //sert a l'infini
+  // proprietes optiques partagees par les diffuseurs (cf. lit_optiques()), nbesp especes en nbopt entrees
+  Tabdyn<Actop*,1> tabopaque;
+  Tabdyn<Actop*,2> tabtransp;
+  int nbesp,nbopt;
  public:
   //temporary public variable
   Voxel mesh;
   ListeD<Diffuseur *> Ldiff;
   ListeD<double> Ldiff0; //liste des labels des diffuseurs du .can (bon et pas bons) - MC10
   int Timg; //Resolution de l'image projplan (Avant en #define) - 0699 (default 1536)
+  int nthreads; //nombre de threads de projplan et calc_FF_Bfar (default 1)
   //member function
   unsigned int radim; // nombre de faces visibles de la scene
   // necessaire au capteur virtuel
@@ -46,11 +51,13 @@ class Canopy{
   unsigned int nbcell; 
   unsigned int nbprim; 
   
-  Canopy() {Etot=Einit=0.0;}
+  Canopy() {Etot=Einit=0.0; nthreads=1; nbesp=nbopt=0;}
   // cree la liste des diffuseurs de la scene
   long int  parse_can(char *,char *,char *,reel *,reel*,int,char *,bool, Diffuseur **&);
   long int  read_shm(int,char *,char *,reel *,reel*,int,char *,Diffuseur **&);
-  void cstruit_grille(double Renv) {mesh.construction(bmin,bmax,Renv,Ldiff);}
+  // remplace les proprietes optiques par celles d'un autre fichier .opt des memes especes (autre bande)
+  bool maj_optiques(char *);
+  void cstruit_grille(double Renv, char *fichier=NULL) {mesh.construction(bmin,bmax,Renv,Ldiff,fichier);}
   void sail_pur(VEC **Cfar,double *Esource,char* envname);
 
 #ifdef _HD
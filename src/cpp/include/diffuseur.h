@@ -37,6 +37,11 @@ public:
   virtual unsigned char face()=0;
   virtual double rho()=0;
   virtual double tau()=0;
+  // idem pour une face donnee, sans changer la face active (calcul des FF en parallele)
+  virtual unsigned int num(unsigned char cefa)=0;
+  virtual unsigned char face(Vecteur&)=0;// face qu'activerait active(dir)
+  virtual double rho(unsigned char cefa)=0;
+  virtual double tau(unsigned char cefa)=0;
   // amie
   friend int maxE(Diffuseur*,Diffuseur*); // utilise par QuickSort (TabDyn, ListeD)  
   // renvoie -1 si E1>E2, 0 si E1=E2, 1 si E1<E2 (Ei delta energie du difuseur i
@@ -63,6 +68,10 @@ public:
   void active(unsigned char cefa) {}
   void activ_num(unsigned int nummer) {}
   unsigned char face() { return 0;}
+  unsigned int num(unsigned char cefa) {return no;}
+  unsigned char face(Vecteur &dir) { return 0;}
+  double rho(unsigned char cefa) {return  opti->rho();}
+  double tau(unsigned char cefa) {return opti->tau();}
 };//DiffO
 
 class DiffP :public DiffO{ //Capteur virtuel
@@ -117,6 +126,12 @@ public:
     }
   }//activ_num()
   unsigned char face() {return actif;}
+  unsigned int num(unsigned char cefa) {return no[(cefa==1)?inf : sup];}
+  unsigned char face(Vecteur &dir) {
+    return (dir.prod_scalaire(prim->normal())<0)? sup : inf;
+  }
+  double rho(unsigned char cefa) {return  popt((cefa==1)?inf : sup)->rho();}
+  double tau(unsigned char cefa) {return popt((cefa==1)?inf : sup)->tau();}
 };//DiffT
 #endif
 
@@ -26,7 +26,8 @@ public:
   double milieu_vox(int axe,int indi) {return (indi+0.5)*taille_vox+O[axe];}
   double sommet(int axe,int indi) {return indi*taille_vox+O[axe];}
   // effectue la creation et la numezrotation de la Grille
-  void construction(reel*, reel*,double, ListeD<Diffuseur*>&); 
+  // (relue dans fichier si elle y a ete ecrite pour la meme scene, sinon construite puis ecrite dans fichier)
+  void construction(reel*, reel*,double, ListeD<Diffuseur*>&, char *fichier=NULL); 
   void visu();
 //************************************************************
 private:
@@ -37,6 +38,9 @@ private:
   void creation(reel *, reel *,int*,ListeD<Diffuseur *>&);
   // initialise les indices de SI
   void numerotation(BSP*);
+  // sauvegarde et relecture de la grille (voxels et boites feuilles)
+  void ecriture(char *, double, double, reel *, ListeD<Diffuseur *>&);
+  bool lecture(char *, double, double, reel *, ListeD<Diffuseur *>&);
 };
 
 #endif
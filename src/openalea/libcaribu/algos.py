@@ -1,38 +1,102 @@
 """Low level implementation of caribu algorithm"""
+import asyncio
+import hashlib
+import itertools
+import os
+import re
 import tempfile
+import time
+import numpy as np
 import shutil
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
 import openalea.libcaribu.io as lcio
 import openalea.libcaribu.commands as lcmd
+import openalea.libcaribu.workspace as lcws
+from openalea.libcaribu.cache import file_digest
+from openalea.libcaribu.results import Results
+from openalea.libcaribu.shm import SharedScene
 from pathlib import Path
 
 
 
-def _set_as_file(source, dst):
+def _link(source, dst):
+    # hard link, or symbolic link across file systems, falling back to a copy
+    try:
+        os.link(source, dst)
+    except OSError:
+        try:
+            os.symlink(Path(source).resolve(), dst)
+        except OSError:
+            shutil.copy(source, dst)
+
+
+def _set_as_file(source, dst, link=False):
+    # dst may be a link to a previous input: replace it rather than writing through
+    dst.unlink(missing_ok=True)
     if isinstance(source, Path):
-        shutil.copy(source, dst)
+        if link:
+            _link(source, dst)
+        else:
+            shutil.copy(source, dst)
     else:
         dst.write_text(source)
 
 
-def set_scene(scene_path=None, canopy=None, pattern=None, lights=None, sensors=None, opts=None, bands=None, soil=None):
+def _is_canopy(source):
+    # a (triangles, labels) pair, rather than a list of triangles
+    try:
+        triangles, labels = source
+    except (TypeError, ValueError):
+        return False
+    return np.ndim(labels) <= 1 and np.ndim(triangles) == 3
+
+
+def _set_as_can(source, dst, default, binary=False):
+    if not isinstance(source, (str, Path)):
+        if not _is_canopy(source):
+            source = default(source)
+        else:
+            triangles, labels = source
+            if binary:
+                lcio.write_canb(dst.with_suffix('.canb'), triangles, labels)
+            else:
+                lcio.write_can(dst, triangles, labels)
+            return
+    _set_as_file(source, dst)
+
+
+def _scene_file(scene_path, stem='scene'):
+    # binary canopy (scene.canb) is used in place of scene.can when present
+    return f"{stem}.canb" if (scene_path / 'scene.canb').exists() else f"{stem}.can"
+
+
+def _ensure_text_scene(scene_path):
+    # periodise only reads text canopies
+    if not (scene_path / 'scene.can').exists() and (scene_path / 'scene.canb').exists():
+        lcio.write_can(scene_path / 'scene.can', *lcio.read_canb(scene_path / 'scene.canb'))
+
+
+def set_scene(scene_path=None, canopy=None, pattern=None, lights=None, sensors=None, opts=None, bands=None, soil=None,
+              binary=False, link=False, soil_cache=None):
+    """Write the input files of a scene in scene_path (a new temporary directory if None)
+
+    With link, light, optical, pattern and sensor files given as paths are linked (hard link, or symbolic link
+    across file systems) into scene_path instead of copied: they should not be modified while the scene is used.
+    A soil given as a number of subdivisions of the pattern is taken from soil_cache (a cache.SoilCache) if any.
+    """
     if scene_path is None:
         scene_path = Path(tempfile.mkdtemp(prefix='libcaribu-'))
     else:
         scene_path = Path(scene_path).resolve()
         scene_path.mkdir(exist_ok=True)
     if canopy:
-        if not isinstance(canopy, (str, Path)):
-            try:
-                triangles, labels = canopy
-                assert isinstance(labels[0], str)
-                canopy = lcio.can_string(triangles, labels)
-            except (TypeError, ValueError, AssertionError):
-                canopy = lcio.canestra_scene(canopy)
-        _set_as_file(canopy, scene_path / 'scene.can')
-    if lights:
+        for name in ('scene.can', 'scene.canb'):
+            (scene_path / name).unlink(missing_ok=True)
+        _set_as_can(canopy, scene_path / 'scene.can', lcio.canestra_scene, binary=binary)
+    if isinstance(lights, np.ndarray) or lights:
         if not isinstance(lights, (str, Path)):
             lights = lcio.canestra_light(lights)
-        _set_as_file(lights, scene_path / 'scene.light')
+        _set_as_file(lights, scene_path / 'scene.light', link)
     if opts:
         if not isinstance(opts, list):
             opts = [opts]
@@ -45,25 +109,25 @@ def set_scene(scene_path=None, canopy=None, pattern=None, lights=None, sensors=N
             bands = [bands]
         assert len(bands) == len(opts)
         for opt, band in zip(opts, bands):
-            _set_as_file(opt, scene_path / f'{band}.opt')
+            _set_as_file(opt, scene_path / f'{band}.opt', link)
     if pattern:
         if not isinstance(pattern, (str, Path)):
             pattern = lcio.canestra_pattern(pattern)
-        _set_as_file(pattern, scene_path / 'scene.8')
+        _set_as_file(pattern, scene_path / 'scene.8', link)
     if sensors:
         if not isinstance(sensors, (str, Path)):
             sensors = lcio.canestra_sensor(sensors)
-        _set_as_file(sensors, scene_path / 'scene.sensor')
-    if soil:
-        if not isinstance(soil, (str, Path)):
-            try:
-                triangles, labels = soil
-                assert isinstance(labels[0], str)
-                soil = lcio.can_string(triangles, labels)
-            except (TypeError, ValueError, AssertionError):
-                domain = lcio.read_pattern(scene_path / 'scene.8')
-                soil = lcio.canestra_soil(domain, n_div=soil)
-        _set_as_file(soil, scene_path / 'scene.soil')
+        _set_as_file(sensors, scene_path / 'scene.sensor', link)
+    if isinstance(soil, (int, np.integer)) and not isinstance(soil, bool) and soil > 0:
+        domain = lcio.read_pattern(scene_path / 'scene.8')
+        (scene_path / 'scene.soil').unlink(missing_ok=True)
+        if soil_cache is None:
+            lcio.write_soil(scene_path / 'scene.soil', domain, soil)
+        else:
+            soil_cache.set_soil(scene_path, domain, soil)
+    elif soil:
+        _set_as_can(soil, scene_path / 'scene.soil',
+                    lambda n_div: lcio.canestra_soil(lcio.read_pattern(scene_path / 'scene.8'), n_div=n_div))
     return scene_path
 
 
@@ -72,21 +136,43 @@ def clean_scene(scene_path):
 
 
 def delete_scene(scene_path):
-    temp_dir = Path(tempfile.gettempdir())
-    if str(scene_path).startswith('libcaribu-') and temp_dir in scene_path.parents:
+    temp_dir = Path(tempfile.gettempdir()).resolve()
+    scene_path = Path(scene_path).resolve()
+    if scene_path.name.startswith('libcaribu-') and temp_dir in scene_path.parents:
         shutil.rmtree(scene_path)
 
 
+def _is_stale(path, *sources):
+    # path is missing or not newer than one of the files it is built from (a source rewritten within the same
+    # clock tick as path has the same mtime, and is taken as newer)
+    if not path.exists():
+        return True
+    mtime = path.stat().st_mtime_ns
+    return any(source.stat().st_mtime_ns >= mtime for source in sources)
+
+
+def _motif_is_stale(scene_path):
+    return _is_stale(scene_path / 'motif.can', scene_path / _scene_file(scene_path), scene_path / 'scene.8')
+
+
 def check_scene_and_soil(scene_path, toric=False):
     scan, labs = lcio.read_can(scene_path / 'scene.soil')
     if not toric:
-        out_path = scene_path / "scene_and_soil.can"
+        canopy = scene_path / _scene_file(scene_path)
+        out_path = scene_path / _scene_file(scene_path, "scene_and_soil")
     else:
+        canopy = scene_path / "motif.can"
         out_path = scene_path / "motif_and_soil.can"
-    if not out_path.exists():
+    if not _is_stale(out_path, canopy, scene_path / 'scene.soil'):
+        return len(labs)
+    if out_path.suffix == '.canb':
+        triangles, labels = lcio.read_canb(canopy, mmap=False)
+        lcio.write_canb(out_path, np.concatenate([triangles, scan]),
+                        np.concatenate([labels, labs.astype(np.int64)]))
+    else:
         with out_path.open("wb") as out:
-            for p in ("scene.can" if not toric else "motif.can", "scene.soil"):
-                with (scene_path / p).open("rb") as f:
+            for p in (canopy, scene_path / "scene.soil"):
+                with p.open("rb") as f:
                     shutil.copyfileobj(f, out)
     return len(labs)
 
@@ -97,15 +183,26 @@ def get_default_scene():
                      opts=lcio.canestra_opt(), soil=1)
 
 
-def periodise(scene_path, verbose=False):
-    args = ["-m", "scene.can",
+def _periodise_args(scene_path):
+    _ensure_text_scene(scene_path)
+    return ["-m", "scene.can",
             "-8", "scene.8"]
+
+
+def periodise(scene_path, verbose=False, cache=None):
+    args = _periodise_args(scene_path)
     lcmd.clean_periodise(scene_path)
+    if cache is not None:
+        key = cache.key('periodise', scene_path / _scene_file(scene_path), scene_path / 'scene.8')
+        if cache.restore(key, scene_path):
+            return None
     status = lcmd.run_periodise(scene_path, args=args, verbose=verbose)
+    if cache is not None:
+        cache.store(key, scene_path, ('Bz.dat', 'motif.can'))
     return status
 
 
-def s2v(scene_path, bands=None, layers=2, height=1, verbose=False):
+def s2v(scene_path, bands=None, layers=2, height=1, verbose=False, cache=None):
 
     if bands is None:
         bands = [opt.stem for opt in scene_path.glob("*.opt")]
@@ -114,158 +211,551 @@ def s2v(scene_path, bands=None, layers=2, height=1, verbose=False):
         bands = [bands]
     else:
         bands = list(bands)
+    lcmd.clean_s2v(scene_path)
+    if cache is not None:
+        key = cache.key('s2v', scene_path / 'motif.can', scene_path / 'scene.8', layers, height, bands,
+                        *(scene_path / f'{band}.opt' for band in bands))
+        if cache.restore(key, scene_path):
+            return None
     args = ["motif.can",
             str(layers),
             str(height),
             "scene.8"]
     args += bands
 
-    lcmd.clean_s2v(scene_path)
     status = lcmd.run_s2v(scene_path, args=args, verbose=verbose)
+    if cache is not None:
+        cache.store(key, scene_path, [f'{band}.spec' for band in bands]
+                    + ['cropchar', 'leafarea', 'out.dang', 's2v.can', 's2v.area'])
     return status
 
 
-def mcsail(scene_path, band=None):
+def mcsail(scene_path, band=None, cache=None):
     if band is None:
         band = next(scene_path.glob("*.opt")).stem
     lcmd.clean_mcsail(scene_path)
+    if cache is not None:
+        key = cache.key('mcsail', scene_path / f"{band}.spec", scene_path / 'scene.light')
+        if cache.restore(key, scene_path):
+            return None
     shutil.copy(scene_path / f"{band}.spec", scene_path / 'spectral')
     args = ["scene.light"]
     status = lcmd.run_mcsail(scene_path, args=args)
+    if cache is not None:
+        cache.store(key, scene_path, ('spectral', 'mlsail.env', 'Mcoef.dat', 'Mvec.dat', 'proflux.dat', 'profout'))
     return status
 
 
-def get_outputs(scene_path, nsoil=0):
+def get_outputs(scene_path, nsoil=0, simulation=0):
     results = measures = soil = None
-    etri = scene_path / "Etri.vec0"
+    etri = scene_path / f"Etri.vec{simulation}"
     if etri.exists():
-        results, soil = lcio.read_results(etri, nsoil)
-    solem = scene_path / "solem.dat"
+        results, soil = Results.from_file(etri).split(nsoil)
+    solem = scene_path / ("solem.dat" if simulation == 0 else f"solem{simulation}.dat")
     if solem.exists():
         measures = lcio.read_measures(solem)
     return results, soil, measures
 
 
-def raycasting(scene_path, band=None, soil=False, more_args=None, verbose=False):
-
+def _default_band(scene_path, band=None):
     if band is None:
         band = next(scene_path.glob("*.opt")).stem
+    return band
 
-    args = ["-l", "scene.light",
-            "-p", f"{band}.opt",
-            "-A",
-            "-1"]
 
+def _canestrad_args(scene_path, args, soil=False, toric=False, more_args=None):
     if not soil:
         nsoil = 0
-        args += ["-M", "scene.can"]
+        args += ["-M", "motif.can" if toric else _scene_file(scene_path)]
     else:
-        nsoil = check_scene_and_soil(scene_path, toric=False)
-        args += ["-M", "scene_and_soil.can"]
+        nsoil = check_scene_and_soil(scene_path, toric=toric)
+        args += ["-M", "motif_and_soil.can" if toric else _scene_file(scene_path, "scene_and_soil")]
 
     if more_args:
         if not isinstance(more_args, list):
             more_args = [more_args]
         args += more_args
+    return args, nsoil
 
-    lcmd.clean_canestrad(scene_path)
-    lcmd.run_canestrad(scene_path, args=args, verbose=verbose)
-    results, soil, measures = get_outputs(scene_path, nsoil)
-    return results, soil, measures
 
+def _raycasting_args(scene_path, band=None, soil=False, more_args=None):
+    args = ["-l", "scene.light",
+            "-p", f"{_default_band(scene_path, band)}.opt",
+            "-A",
+            "-1"]
+    return _canestrad_args(scene_path, args, soil, more_args=more_args)
 
-def toric_raycasting(scene_path, band=None, soil=False, more_args=None, verbose=False):
-
-    if band is None:
-        band = next(scene_path.glob("*.opt")).stem
 
+def _toric_raycasting_args(scene_path, band=None, soil=False, more_args=None):
     args = ["-8", "scene.8",
             "-l", "scene.light",
-            "-p", f"{band}.opt",
+            "-p", f"{_default_band(scene_path, band)}.opt",
             "-A",
             "-1"]
+    return _canestrad_args(scene_path, args, soil, toric=True, more_args=more_args)
 
-    if not soil:
-        nsoil = 0
-        args += ["-M", "motif.can"]
-    else:
-        nsoil = check_scene_and_soil(scene_path, toric=True)
-        args += ["-M", "motif_and_soil.can"]
-
-    if more_args:
-        if not isinstance(more_args, list):
-            more_args = [more_args]
-        args += more_args
-
-    if not (scene_path / 'motif.can').exists():
-        periodise(scene_path)
-
-    lcmd.clean_canestrad(scene_path)
-    lcmd.run_canestrad(scene_path, args=args, verbose=verbose)
-    results, soil, measures = get_outputs(scene_path, nsoil)
-    return results, soil, measures
-
-
-def radiosity(scene_path, band=None, soil=False, more_args=None, verbose=False):
-
-    if band is None:
-        band = next(scene_path.glob("*.opt")).stem
 
+def _radiosity_args(scene_path, soil=False, more_args=None):
+    # optical properties (-p) are set per band by the caller
     args = ["-l", "scene.light",
-            "-p", f"{band}.opt",
             "-A",
             "-d", "-1"]
+    return _canestrad_args(scene_path, args, soil, more_args=more_args)
 
-    if not soil:
-        nsoil = 0
-        args += ["-M", "scene.can"]
-    else:
-        nsoil = check_scene_and_soil(scene_path, toric=False)
-        args += ["-M", "scene_and_soil.can"]
 
-    if more_args:
-        if not isinstance(more_args, list):
-            more_args = [more_args]
-        args += more_args
+def _mixed_radiosity_args(scene_path, sd=0, soil=False, more_args=None):
+    # optical properties (-p) are set per band by the caller
+    args = ["-8", "scene.8",
+            "-l", "scene.light",
+            "-A",
+            "-d", str(sd),
+            "-e", "mlsail.env"]
+    return _canestrad_args(scene_path, args, soil, toric=True, more_args=more_args)
 
+
+def _resolution_args(more_args=None, screen_resolution=None, disk_resolution=None, threads=None):
+    # -L: size (pixels) of the z-buffer used for projections [1536]
+    # -R: size (pixels) of the hemispherical projection disk used for form factors [52]
+    # -j: number of threads rasterizing the projections on the z-buffer and computing form factors [1]
+    if more_args is None:
+        more_args = []
+    elif not isinstance(more_args, list):
+        more_args = [more_args]
+    else:
+        more_args = list(more_args)
+    if screen_resolution is not None:
+        more_args += ["-L", str(int(screen_resolution))]
+    if disk_resolution is not None:
+        more_args += ["-R", str(int(disk_resolution))]
+    if threads is not None:
+        more_args += ["-j", str(int(threads))]
+    return more_args
+
+
+def _solver_args(more_args, memory_budget=None):
+    # -b: memory (MB) allowed to hold the form factor matrix during the solve [1024]. Above, the matrix files are
+    # read again at each matrix-vector product of the solver
+    if memory_budget is not None:
+        more_args += ["-b", str(float(memory_budget))]
+    return more_args
+
+
+_GRID = re.compile(r'grid_[0-9a-f]{16}')
+
+
+def _grid_args(scene_path, args):
+    # -G: the voxel grid only depends on the geometry (canopy and soil, pattern) and the sphere diameter. It is
+    # written by canestrad in a file named after a hash of these inputs and read back by later runs. Grids of
+    # a previous geometry are removed (files being written, grid_*.tmp, are left to clean_grid)
+    h = hashlib.sha256()
+    for flag, value in zip(args, args[1:]):
+        if flag in ('-M', '-8'):
+            h.update(f'{flag} {file_digest(scene_path / value)}\n'.encode())
+        elif flag in ('-d', '-r'):
+            h.update(f'{flag} {value}\n'.encode())
+    name = h.hexdigest()[:16]
+    for path in scene_path.glob('grid_*'):
+        if _GRID.fullmatch(path.name) and path.name != f'grid_{name}':
+            path.unlink()
+    return args + ["-G", f'grid_{name}']
+
+
+def _run_canestrad(scene_path, args, nsoil=0, verbose=False):
     lcmd.clean_canestrad(scene_path)
-    lcmd.run_canestrad(scene_path, args=args, verbose=verbose)
+    status = lcmd.run_canestrad(scene_path, args=args, verbose=verbose)
     results, soil, measures = get_outputs(scene_path, nsoil)
+    if results is not None:
+        results.metrics = status.metrics
     return results, soil, measures
 
 
-def mixed_radiosity(scene_path, band=None, soil=False, sd=0, layers=2, height=1, more_args=None, verbose=False):
+def _ff_key(ff_store, scene_path, args, *parts):
+    # form factors only depend on the geometry (canopy and soil, pattern, sphere diameter) and disk resolution
+    geometry = []
+    for flag, value in zip(args, args[1:]):
+        if flag in ('-M', '-8'):
+            geometry += [flag, scene_path / value]
+        elif flag in ('-d', '-R'):
+            geometry += [flag, value]
+    return ff_store.key('ff', *geometry, *parts)
 
-    if band is None:
-        band = next(scene_path.glob("*.opt")).stem
 
-    if not (scene_path / 'motif.can').exists():
-        periodise(scene_path)
-    if not(scene_path / f'{band}.spec').exists():
-        s2v(scene_path, bands=band, layers=layers, height=height)
+def _run_bands(scene_path, bands, args, nsoil=0, reuse_ff=True, prepare=None, verbose=False, ff_store=None,
+               ff_key=()):
+    """Run canestrad once per band, computing the form factor matrix only once
 
-    mcsail(scene_path, band=band)
+    Form factors are purely geometric (optical properties are applied by the solver), so the matrix
+    computed with the first band is stored in scene_path and read back by the runs of the other bands,
+    that skip grid construction and form factor computation. With a ff_store (cache.FormFactorStore), the
+    matrix is also kept across calls, keyed by the geometry (and ff_key), and not computed at all if found.
+    """
+    if isinstance(bands, str):
+        bands = [bands]
+    name, computed = 'bands', False
+    if reuse_ff and ff_store is not None:
+        name = ff_store.name
+        key = _ff_key(ff_store, scene_path, args, *ff_key)
+        computed = ff_store.restore(key, scene_path)
+    outputs = {}
+    try:
+        for band in bands:
+            if prepare is not None:
+                prepare(band)
+            band_args = args + ["-p", f"{band}.opt"]
+            if reuse_ff:
+                band_args += ["-t", "./", "-w" if computed else "-f", name]
+            outputs[band] = _run_canestrad(scene_path, band_args, nsoil, verbose)
+            if reuse_ff and not computed:
+                computed = True
+                if ff_store is not None:
+                    ff_store.store_matrix(key, scene_path)
+    finally:
+        lcmd.clean_ffmatrix(scene_path, name)
+    return outputs
+
+
+def raycasting(scene_path, band=None, soil=False, more_args=None, verbose=False, screen_resolution=None,
+               threads=None):
+    more_args = _resolution_args(more_args, screen_resolution, threads=threads)
+    args, nsoil = _raycasting_args(scene_path, band, soil, more_args)
+    return _run_canestrad(scene_path, args, nsoil, verbose)
+
+
+def _run_canestrad_shm(scene_path, canopy, args, more_args=None, verbose=False):
+    # canopy is sent through shared memory: no scene file is written nor parsed
+    triangles, labels = canopy
+    if more_args:
+        args += more_args if isinstance(more_args, list) else [more_args]
+    lcmd.clean_canestrad(scene_path)
+    with SharedScene(triangles, labels) as shared:
+        status = lcmd.run_canestrad(scene_path, args=["-m", shared.key] + args, verbose=verbose)
+        results = Results.from_array(shared.results())
+    results.metrics = status.metrics
+    _, _, measures = get_outputs(scene_path)
+    return results, None, measures
+
+
+def shm_raycasting(scene_path, canopy, band=None, more_args=None, verbose=False, screen_resolution=None,
+                   threads=None):
+    """raycasting of a (triangles, labels) canopy passed to canestrad through shared memory"""
+    more_args = _resolution_args(more_args, screen_resolution, threads=threads)
+    args = ["-l", "scene.light",
+            "-p", f"{_default_band(scene_path, band)}.opt",
+            "-A",
+            "-1"]
+    return _run_canestrad_shm(scene_path, canopy, args, more_args, verbose)
 
-    args = ["-8", "scene.8",
-            "-l", "scene.light",
-            "-p", f"{band}.opt",
+
+def shm_radiosity(scene_path, canopy, band=None, more_args=None, verbose=False, screen_resolution=None, disk_resolution=None,
+                  memory_budget=None, threads=None):
+    """radiosity of a (triangles, labels) canopy passed to canestrad through shared memory"""
+    more_args = _resolution_args(more_args, screen_resolution, disk_resolution, threads)
+    more_args = _solver_args(more_args, memory_budget)
+    args = ["-l", "scene.light",
+            "-p", f"{_default_band(scene_path, band)}.opt",
             "-A",
-            "-d", str(sd),
-            "-e", "mlsail.env"]
+            "-d", "-1"]
+    return _run_canestrad_shm(scene_path, canopy, args, more_args, verbose)
+
+
+def toric_raycasting(scene_path, band=None, soil=False, more_args=None, verbose=False, cache=None,
+                     screen_resolution=None, threads=None):
+    more_args = _resolution_args(more_args, screen_resolution, threads=threads)
+    if cache is not None or _motif_is_stale(scene_path):
+        periodise(scene_path, cache=cache)
+    args, nsoil = _toric_raycasting_args(scene_path, band, soil, more_args)
+    return _run_canestrad(scene_path, args, nsoil, verbose)
+
+
+def radiosity(scene_path, band=None, soil=False, more_args=None, verbose=False, bands=None, ff_store=None,
+              screen_resolution=None, disk_resolution=None, memory_budget=None, threads=None, reuse_grid=False):
+    """Radiosity of a closed scene
+
+    memory_budget (MB, 1024 by default) bounds the size of a form factor matrix held in memory by the solver.
+    Larger matrices are read again from disk at each iteration, and 0 forces disk reads. threads (1 by default)
+    is the number of threads rasterizing the projections of the canopy on the light screen and computing the
+    form factors. With reuse_grid, the voxel grid sorting the canopy triangles is saved in scene_path and
+    reused by later runs on the same geometry.
+    """
+    more_args = _resolution_args(more_args, screen_resolution, disk_resolution, threads)
+    more_args = _solver_args(more_args, memory_budget)
+    args, nsoil = _radiosity_args(scene_path, soil, more_args)
+    if reuse_grid:
+        args = _grid_args(scene_path, args)
+    if bands is not None:
+        return _run_bands(scene_path, bands, args, nsoil, verbose=verbose, ff_store=ff_store)
+    if ff_store is not None:
+        band = _default_band(scene_path, band)
+        return _run_bands(scene_path, band, args, nsoil, verbose=verbose, ff_store=ff_store)[band]
+    args += ["-p", f"{_default_band(scene_path, band)}.opt"]
+    return _run_canestrad(scene_path, args, nsoil, verbose)
+
+
+def mixed_radiosity(scene_path, band=None, soil=False, sd=0, layers=2, height=1, more_args=None, verbose=False,
+                    bands=None, cache=None, ff_store=None, screen_resolution=None, disk_resolution=None,
+                    memory_budget=None, threads=None, reuse_grid=False):
+    more_args = _resolution_args(more_args, screen_resolution, disk_resolution, threads)
+    more_args = _solver_args(more_args, memory_budget)
+    if bands is None:
+        band = _default_band(scene_path, band)
+        run_bands = [band]
+    else:
+        run_bands = [bands] if isinstance(bands, str) else list(bands)
 
-    if not soil:
-        nsoil = 0
-        args += ["-M", "motif.can"]
+    if cache is not None:
+        # inputs are checked against the cache, instead of reusing intermediates found in scene_path
+        periodise(scene_path, cache=cache)
+        s2v(scene_path, bands=run_bands, layers=layers, height=height, cache=cache)
     else:
-        nsoil = check_scene_and_soil(scene_path, toric=True)
-        args += ["-M", "motif_and_soil.can"]
+        if _motif_is_stale(scene_path):
+            periodise(scene_path)
+        if any(_is_stale(scene_path / f'{b}.spec', scene_path / 'motif.can') for b in run_bands):
+            s2v(scene_path, bands=run_bands, layers=layers, height=height)
+
+    args, nsoil = _mixed_radiosity_args(scene_path, sd, soil, more_args)
+    if reuse_grid and sd != 0:
+        args = _grid_args(scene_path, args)
+    if bands is not None or (ff_store is not None and sd != 0):
+        # far contributions are computed per layer of the turbid medium
+        outputs = _run_bands(scene_path, run_bands, args, nsoil, reuse_ff=sd != 0,
+                             prepare=lambda b: mcsail(scene_path, band=b, cache=cache), verbose=verbose,
+                             ff_store=ff_store, ff_key=(layers, height))
+        return outputs if bands is not None else outputs[band]
+
+    mcsail(scene_path, band=band, cache=cache)
+    args += ["-p", f"{band}.opt"]
+    return _run_canestrad(scene_path, args, nsoil, verbose)
+
+
+def _run_simulations(scene_path, light_sets, args, nsoil=0, verbose=False):
+    # all light sets are simulated by one canestrad process (-S), sharing scene parsing and form factors
+    light_sets = list(light_sets)
+    lines = []
+    for i, lights in enumerate(light_sets):
+        lines += [f"{line} {i}\n" for line in lcio.canestra_light(lights).splitlines() if line.strip()]
+    (scene_path / 'simulations.light').write_text(''.join(lines))
+    args[args.index("-l") + 1] = "simulations.light"
+    args += ["-S", str(len(light_sets))]
+    lcmd.clean_canestrad(scene_path)
+    try:
+        status = lcmd.run_canestrad(scene_path, args=args, verbose=verbose)
+    finally:
+        (scene_path / 'simulations.light').unlink(missing_ok=True)
+    outputs = [get_outputs(scene_path, nsoil, simulation=i) for i in range(len(light_sets))]
+    for results, _, _ in outputs:
+        if results is not None:
+            results.metrics = status.metrics
+    return outputs
+
+
+def multi_raycasting(scene_path, light_sets, band=None, soil=False, more_args=None, verbose=False,
+                     screen_resolution=None, threads=None):
+    """raycasting of several light configurations (e.g. hourly sun positions) in one canestrad run
+
+    Args:
+        light_sets: a sequence of lights, as accepted by set_scene (list of (energy, direction) tuples or
+            array of (energy, vx, vy, vz) rows)
+
+    Returns:
+        a list of (results, soil, measures) tuples, one per light set
+    """
+    more_args = _resolution_args(more_args, screen_resolution, threads=threads)
+    args, nsoil = _raycasting_args(scene_path, band, soil, more_args)
+    return _run_simulations(scene_path, light_sets, args, nsoil, verbose)
+
+
+def multi_radiosity(scene_path, light_sets, band=None, soil=False, more_args=None, verbose=False,
+                    screen_resolution=None, disk_resolution=None, memory_budget=None, threads=None, reuse_grid=False):
+    """radiosity of several light configurations in one canestrad run, form factors being computed once
+
+    Returns:
+        a list of (results, soil, measures) tuples, one per light set
+    """
+    more_args = _resolution_args(more_args, screen_resolution, disk_resolution, threads)
+    more_args = _solver_args(more_args, memory_budget)
+    args, nsoil = _radiosity_args(scene_path, soil, more_args)
+    if reuse_grid:
+        args = _grid_args(scene_path, args)
+    args += ["-p", f"{_default_band(scene_path, band)}.opt"]
+    return _run_simulations(scene_path, light_sets, args, nsoil, verbose)
+
+
+async def aperiodise(scene_path, verbose=False, timeout=None):
+    """Async version of periodise"""
+    args = _periodise_args(scene_path)
+    lcmd.clean_periodise(scene_path)
+    return await lcmd.arun_periodise(scene_path, args=args, verbose=verbose, timeout=timeout)
 
-    if more_args:
-        if not isinstance(more_args, list):
-            more_args = [more_args]
-        args += more_args
 
+async def _arun_canestrad(scene_path, args, nsoil=0, verbose=False, timeout=None):
     lcmd.clean_canestrad(scene_path)
-    lcmd.run_canestrad(scene_path, args=args, verbose=verbose)
-    results, soil, measures = get_outputs(scene_path, nsoil)
+    status = await lcmd.arun_canestrad(scene_path, args=args, verbose=verbose, timeout=timeout)
+    results, soil, measures = await asyncio.to_thread(get_outputs, scene_path, nsoil)
+    if results is not None:
+        results.metrics = status.metrics
     return results, soil, measures
+
+
+async def araycasting(scene_path, band=None, soil=False, more_args=None, verbose=False, timeout=None,
+                      screen_resolution=None, threads=None):
+    """Async version of raycasting. timeout (s) bounds the canestrad run"""
+    more_args = _resolution_args(more_args, screen_resolution, threads=threads)
+    args, nsoil = _raycasting_args(scene_path, band, soil, more_args)
+    return await _arun_canestrad(scene_path, args, nsoil, verbose, timeout)
+
+
+async def atoric_raycasting(scene_path, band=None, soil=False, more_args=None, verbose=False, timeout=None,
+                            screen_resolution=None, threads=None):
+    """Async version of toric_raycasting. timeout (s) bounds each tool run"""
+    more_args = _resolution_args(more_args, screen_resolution, threads=threads)
+    if _motif_is_stale(scene_path):
+        await aperiodise(scene_path, timeout=timeout)
+    args, nsoil = _toric_raycasting_args(scene_path, band, soil, more_args)
+    return await _arun_canestrad(scene_path, args, nsoil, verbose, timeout)
+
+
+async def aradiosity(scene_path, band=None, soil=False, more_args=None, verbose=False, timeout=None,
+                     screen_resolution=None, disk_resolution=None, memory_budget=None, threads=None, reuse_grid=False):
+    """Async version of radiosity (single band). timeout (s) bounds the canestrad run"""
+    more_args = _resolution_args(more_args, screen_resolution, disk_resolution, threads)
+    more_args = _solver_args(more_args, memory_budget)
+    args, nsoil = _radiosity_args(scene_path, soil, more_args)
+    if reuse_grid:
+        args = _grid_args(scene_path, args)
+    args += ["-p", f"{_default_band(scene_path, band)}.opt"]
+    return await _arun_canestrad(scene_path, args, nsoil, verbose, timeout)
+
+
+def _deviation(results, reference):
+    # area-weighted relative deviation of Ei, and its maximum over triangles
+    valid = ~(np.isnan(results['Ei']) | np.isnan(reference['Ei']))
+    area = reference['area'][valid]
+    delta = np.abs(results['Ei'][valid] - reference['Ei'][valid])
+    total = np.sum(area * np.abs(reference['Ei'][valid]))
+    return (np.sum(area * delta) / total if total > 0 else np.sum(area * delta)), delta.max(initial=0)
+
+
+def tune_resolutions(scene_path, algo=raycasting, screen_resolutions=(256, 512, 1024, 1536, 2048),
+                     disk_resolutions=(None,), reference=(4096, None), **kwds):
+    """Wall time and accuracy of an algorithm over a range of projection resolutions
+
+    Args:
+        scene_path: the scene to simulate
+        algo: the algorithm to tune (raycasting, toric_raycasting, radiosity, mixed_radiosity)
+        screen_resolutions: z-buffer sizes (-L) to test, None standing for the canestrad default (1536)
+        disk_resolutions: form factor disk sizes (-R) to test, for radiosity algorithms (default 52)
+        reference: (screen, disk) resolutions of the reference simulation
+        **kwds: other arguments of algo
+
+    Returns:
+        a structured array with one row per (screen_resolution, disk_resolution) setting (-1 standing for
+        default), giving the wall time of the simulation and the area-weighted relative deviation ('error') and
+        maximal absolute deviation ('max_error') of Ei from the reference
+    """
+    def run(screen, disk):
+        options = dict(kwds, screen_resolution=screen)
+        if disk is not None:
+            options['disk_resolution'] = disk
+        start = time.perf_counter()
+        results, _, _ = algo(scene_path, **options)
+        return results, time.perf_counter() - start
+
+    expected, _ = run(*reference)
+    settings = [(screen, disk) for disk in disk_resolutions for screen in screen_resolutions]
+    report = np.empty(len(settings), dtype=[('screen_resolution', np.int32), ('disk_resolution', np.int32),
+                                            ('time', np.float64), ('error', np.float64),
+                                            ('max_error', np.float64)])
+    for row, (screen, disk) in zip(report, settings):
+        results, elapsed = run(screen, disk)
+        row['screen_resolution'] = -1 if screen is None else screen
+        row['disk_resolution'] = -1 if disk is None else disk
+        row['time'] = elapsed
+        row['error'], row['max_error'] = _deviation(results, expected)
+    return report
+
+
+def pick_resolution(report, tolerance=0.01):
+    """Fastest setting of a tune_resolutions report with an error within tolerance (None if there is none)"""
+    candidates = report[report['error'] <= tolerance]
+    if len(candidates) == 0:
+        return None
+    return candidates[np.argmin(candidates['time'])]
+
+
+def _run_job(job, keep_scene=False, scene_path=None):
+    scene, algo, band, options = (tuple(job) + (None, None))[:4]
+    if isinstance(algo, str):
+        algo = globals()[algo]
+    pooled = scene_path is not None
+    if not pooled:
+        scene_path = Path(tempfile.mkdtemp(prefix='libcaribu-'))
+    try:
+        if isinstance(scene, (str, Path)):
+            shutil.copytree(scene, scene_path, dirs_exist_ok=True)
+        else:
+            set_scene(scene_path, link=pooled, **scene)
+        outputs = algo(scene_path, band=band, **(options or {}))
+    finally:
+        if not keep_scene and not pooled:
+            shutil.rmtree(scene_path, ignore_errors=True)
+    return outputs
+
+
+def run_batch(jobs, max_workers=None, use_threads=False, keep_scenes=False, pool=None):
+    """Run independent simulations concurrently, each in its own scene directory
+
+    Args:
+        jobs: an iterable of (scene, algo, band, options) tuples, band and options being optional. scene is
+            either a dict of set_scene arguments or the path of an existing scene directory (copied), algo an
+            algorithm of this module (function or name, e.g. 'raycasting'), options a dict of extra
+            algorithm arguments (soil, more_args, ...)
+        max_workers: maximal number of simultaneous jobs (default to the number of processors)
+        use_threads: run jobs in threads instead of processes. canestrad runs in its own process anyway,
+            threads avoid pickling jobs and outputs but serialise the parsing of outputs.
+        keep_scenes: do not delete job scene directories after the run. Cannot be used with pool.
+        pool: a workspace.WorkspacePool whose directories are recycled between jobs. By default (and unless
+            keep_scenes), a pool of max_workers directories is used for the batch.
+
+    Yields:
+        (index, outputs) tuples as jobs complete, index being the position of the job in jobs and outputs
+        the value returned by the algorithm
+    """
+    if keep_scenes and pool is not None:
+        raise ValueError("keep_scenes cannot be used with a pool, whose directories are emptied after each job")
+    return _run_batch(jobs, max_workers, use_threads, keep_scenes, pool)
+
+
+def _run_batch(jobs, max_workers, use_threads, keep_scenes, pool):
+    own_pool = pool is None and not keep_scenes
+    if own_pool:
+        pool = lcws.WorkspacePool(max_workers)
+    # jobs are read and submitted as others complete, at most one per directory of the pool
+    in_flight = len(pool) if pool is not None else max_workers or os.cpu_count() or 1
+    executor_class = ThreadPoolExecutor if use_threads else ProcessPoolExecutor
+    executor = executor_class(max_workers=max_workers)
+    futures = {}  # future: (job index, scene directory of the pool)
+    try:
+        jobs = enumerate(jobs)
+        while True:
+            for i, job in itertools.islice(jobs, in_flight - len(futures)):
+                if pool is None:
+                    futures[executor.submit(_run_job, job, keep_scenes)] = i, None
+                else:
+                    # directories are handed out by the parent, and released as jobs complete
+                    scene_path = pool.acquire()
+                    futures[executor.submit(_run_job, job, scene_path=scene_path)] = i, scene_path
+            if not futures:
+                break
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                i, scene_path = futures.pop(future)
+                if scene_path is not None:
+                    pool.release(scene_path)
+                yield i, future.result()
+    finally:
+        executor.shutdown(cancel_futures=True)
+        for _, scene_path in futures.values():
+            if scene_path is not None:
+                pool.release(scene_path)
+        if own_pool:
+            pool.close()
@@ -0,0 +1,157 @@
+"""Persistent content-addressed cache of the intermediate files produced by periodise, s2v and mcsail"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+import openalea.libcaribu.io as lcio
+
+
+def _link_or_copy(src, dst):
+    dst.unlink(missing_ok=True)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+_digests = {}
+
+
+def file_digest(path):
+    """sha256 of the content of path, memoised on its resolved path, mtime and size"""
+    path = Path(path)
+    stat = path.stat()
+    memo = (str(path.resolve()), stat.st_mtime_ns, stat.st_size)
+    if memo not in _digests:
+        h = hashlib.sha256()
+        with path.open('rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+        _digests[memo] = h.hexdigest()
+    return _digests[memo]
+
+
+def default_cache_dir():
+    root = os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache'
+    return Path(root) / 'libcaribu'
+
+
+class IntermediateCache:
+    """Size-bounded LRU store of tool outputs, keyed by a hash of the tool inputs
+
+    Each entry is a directory named after its key, holding the output files of one tool run. Entries are
+    restored by copy into scene directories and evicted, least recently used first, when the total size of
+    the store exceeds max_bytes.
+    """
+
+    def __init__(self, root=None, max_bytes=2 ** 30):
+        self.root = Path(root) if root is not None else default_cache_dir() / 'intermediate'
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+
+    def _transfer(self, src, dst):
+        shutil.copyfile(src, dst)
+
+    def key(self, *parts):
+        """Hash of the inputs of a tool run. Path parts are hashed by content, other parts by repr"""
+        h = hashlib.sha256()
+        for part in parts:
+            if isinstance(part, Path):
+                h.update(b'file:' + file_digest(part).encode())
+            else:
+                h.update(b'value:' + repr(part).encode())
+            h.update(b'\0')
+        return h.hexdigest()
+
+    def restore(self, key, scene_path):
+        """Copy the files of entry key into scene_path. Returns False if key is not in the cache"""
+        entry = self.root / key
+        if not entry.is_dir():
+            return False
+        for path in entry.iterdir():
+            self._transfer(path, Path(scene_path) / path.name)
+        os.utime(entry)
+        return True
+
+    def store(self, key, scene_path, names):
+        """Store the files of scene_path matching the glob patterns names as entry key"""
+        entry = self.root / key
+        if entry.is_dir():
+            return
+        tmp = Path(tempfile.mkdtemp(prefix='.tmp-', dir=self.root))
+        for pattern in names:
+            for path in Path(scene_path).glob(pattern):
+                self._transfer(path, tmp / path.name)
+        try:
+            tmp.rename(entry)
+        except OSError:  # stored meanwhile by a concurrent run
+            shutil.rmtree(tmp, ignore_errors=True)
+        self.evict()
+
+    def size(self):
+        return sum(f.stat().st_size for f in self.root.glob('*/*') if not f.parent.name.startswith('.'))
+
+    def evict(self):
+        """Remove least recently used entries until the store fits in max_bytes"""
+        entries = []
+        for entry in self.root.iterdir():
+            if entry.is_dir() and not entry.name.startswith('.'):
+                size = sum(f.stat().st_size for f in entry.iterdir())
+                entries.append((entry.stat().st_mtime, size, entry))
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries, key=lambda e: e[0]):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        for entry in self.root.iterdir():
+            if entry.is_dir():
+                shutil.rmtree(entry, ignore_errors=True)
+
+
+class FormFactorStore(IntermediateCache):
+    """Store of canestrad form factor matrices (diag_, nz_ and Bfar_ files), keyed by a hash of the geometry
+
+    Matrices are O(N^2) for full-matrix radiosity: entries are hard linked into scene directories instead of
+    copied whenever possible, canestrad only reading them.
+    """
+
+    name = 'ff'
+
+    def __init__(self, root=None, max_bytes=2 ** 33):
+        super().__init__(root if root is not None else default_cache_dir() / 'ff', max_bytes)
+
+    def _transfer(self, src, dst):
+        _link_or_copy(src, dst)
+
+    def store_matrix(self, key, scene_path):
+        self.store(key, scene_path, [f'{prefix}_{self.name}' for prefix in ('diag', 'nz', 'Bfar')])
+
+
+class SoilCache(IntermediateCache):
+    """Store of soil mesh files (scene.soil), keyed by domain and number of subdivisions
+
+    Fine soil grids are costly to format: files are generated once and hard linked into scene directories.
+    """
+
+    def __init__(self, root=None, max_bytes=2 ** 28):
+        super().__init__(root if root is not None else default_cache_dir() / 'soil', max_bytes)
+
+    def _transfer(self, src, dst):
+        _link_or_copy(src, dst)
+
+    def set_soil(self, scene_path, domain, n_div=1):
+        """Write (or link) the soil mesh of domain as scene_path/scene.soil"""
+        scene_path = Path(scene_path)
+        key = self.key('soil', tuple(float(v) for v in domain), int(n_div))
+        if self.restore(key, scene_path):
+            # the link carries the mtime of the entry: mark the soil as newer than files built from a previous one
+            os.utime(scene_path / 'scene.soil')
+        else:
+            lcio.write_soil(scene_path / 'scene.soil', domain, n_div)
+            self.store(key, scene_path, ['scene.soil'])
@@ -1,4 +1,14 @@
+import asyncio
+import os
+import re
+import signal
 import subprocess
+import sys
+import tempfile
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 
@@ -28,7 +38,82 @@ class CommandFailed(Exception):
         return "\n".join(msg)
 
 
-def _run_tool(tool_name, workdir='.', args=None, log=None, verbose=False):
+class ToolMetrics:
+    """Resources used by one tool run
+
+    Attributes:
+        tool: the tool name
+        args: the tool arguments
+        wall_time: elapsed time (s)
+        user_time, system_time: CPU times (s) of the tool process, None if not available
+        max_rss: peak resident memory (bytes) of the tool process, None if not available
+        stages: {stage: (wall_time, cpu_time)} timings reported by the tool in its log ('load', 'grid', 'direct',
+            'formfactors', 'solve' and 'output' for canestrad)
+    """
+
+    def __init__(self, tool, args, wall_time, usage=None, stages=None):
+        self.tool = tool
+        self.args = list(args)
+        self.wall_time = wall_time
+        self.user_time = self.system_time = self.max_rss = None
+        if usage is not None:
+            self.user_time = usage.ru_utime
+            self.system_time = usage.ru_stime
+            # kB on linux, bytes on macOS
+            self.max_rss = usage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+        self.stages = stages or {}
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.tool}, wall_time={self.wall_time:.3f}s, max_rss={self.max_rss})"
+
+
+_STAGE = re.compile(r'^<stage> (\w+) wall=(\S+) cpu=(\S+)', re.MULTILINE)
+
+_metrics_hooks = []
+
+
+def add_metrics_hook(hook):
+    """Call hook(metrics) with the ToolMetrics of every tool run"""
+    _metrics_hooks.append(hook)
+
+
+def remove_metrics_hook(hook):
+    _metrics_hooks.remove(hook)
+
+
+class Profile:
+    """Collects the ToolMetrics of the tool runs done inside a with block (in any thread)"""
+
+    def __init__(self):
+        self.runs = []
+
+    def __enter__(self):
+        add_metrics_hook(self.runs.append)
+        return self
+
+    def __exit__(self, *exc):
+        remove_metrics_hook(self.runs.append)
+
+    def summary(self):
+        """{tool: {'calls', 'wall_time', 'user_time', 'system_time', 'max_rss', <stage>...}} totals
+
+        max_rss is the maximum over the calls, stage entries are total stage wall times
+        """
+        summary = {}
+        for run in self.runs:
+            total = summary.setdefault(run.tool, {'calls': 0, 'wall_time': 0., 'user_time': 0.,
+                                                  'system_time': 0., 'max_rss': 0})
+            total['calls'] += 1
+            total['wall_time'] += run.wall_time
+            total['user_time'] += run.user_time or 0
+            total['system_time'] += run.system_time or 0
+            total['max_rss'] = max(total['max_rss'], run.max_rss or 0)
+            for stage, (wall, _) in run.stages.items():
+                total[stage] = total.get(stage, 0.) + wall
+        return summary
+
+
+def _prepare_tool(tool_name, workdir='.', args=None):
     workdir = Path(workdir).resolve()
     if not workdir.is_dir():
         raise NotADirectoryError(f"Invalid working directory: {workdir}")
@@ -38,14 +123,64 @@ def _run_tool(tool_name, workdir='.', args=None, log=None, verbose=False):
         if isinstance(args, str):
             args = [args]
         cmd += list(args)
-    result = subprocess.run(cmd, cwd=workdir, capture_output=True, text=True)
+    return workdir, cmd
+
+
+def _spawn(cmd, workdir):
+    # outputs go to temporary files, so that the process can be reaped with wait4 to get its resource usage
+    stdout, stderr = tempfile.TemporaryFile(), tempfile.TemporaryFile()
+    try:
+        process = subprocess.Popen(cmd, cwd=workdir, stdout=stdout, stderr=stderr)
+    except BaseException:
+        stdout.close()
+        stderr.close()
+        raise
+    return process, stdout, stderr
+
+
+_reaping = threading.Lock()  # held while a tool process is reaped or killed
 
+
+def _wait(process):
+    if not hasattr(os, 'wait4'):
+        process.wait()
+        return None
+    while True:
+        if hasattr(os, 'waitid'):
+            # wait for the exit without reaping the process, so that its pid stays valid for _kill
+            os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOWAIT)
+        else:
+            time.sleep(0.01)
+        with _reaping:
+            pid, status, usage = os.wait4(process.pid, os.WNOHANG)
+            if pid:
+                process.returncode = os.waitstatus_to_exitcode(status)
+                return usage
+
+
+def _completed(cmd, process, stdout, stderr):
+    outputs = []
+    for f in (stdout, stderr):
+        f.seek(0)
+        outputs.append(f.read().decode(errors='replace'))
+        f.close()
+    return subprocess.CompletedProcess(cmd, process.returncode, *outputs)
+
+
+def _finish_tool(result, workdir, log=None, verbose=False, metrics=None):
     if log:
         log_path = workdir / log
-        log = log_path.read_text() if log_path.is_file() else None
+        log = log_path.read_text(errors='replace') if log_path.is_file() else None
         if log:
             log_path.unlink()
 
+    if metrics is not None:
+        if log:
+            metrics.stages = {name: (float(wall), float(cpu)) for name, wall, cpu in _STAGE.findall(log)}
+        result.metrics = metrics
+        for hook in list(_metrics_hooks):
+            hook(metrics)
+
     if verbose:
         print(result.stdout)
         print(result.stderr)
@@ -55,7 +190,7 @@ def _run_tool(tool_name, workdir='.', args=None, log=None, verbose=False):
     if result.returncode != 0:
         raise CommandFailed(
             workdir,
-            cmd,
+            result.args,
             result.returncode,
             result.stdout,
             result.stderr,
@@ -65,6 +200,80 @@ def _run_tool(tool_name, workdir='.', args=None, log=None, verbose=False):
     return result
 
 
+def _run_tool(tool_name, workdir='.', args=None, log=None, verbose=False):
+    """Run a tool in workdir. The returned CompletedProcess has a ToolMetrics `metrics` attribute"""
+    workdir, cmd = _prepare_tool(tool_name, workdir, args)
+    start = time.perf_counter()
+    process, stdout, stderr = _spawn(cmd, workdir)
+    try:
+        usage = _wait(process)
+    except BaseException:
+        process.kill()
+        process.wait()
+        raise
+    metrics = ToolMetrics(tool_name, cmd[1:], time.perf_counter() - start, usage)
+    return _finish_tool(_completed(cmd, process, stdout, stderr), workdir, log, verbose, metrics)
+
+
+_limits = weakref.WeakKeyDictionary()  # event loop: (semaphore, executor of the wait4 calls)
+
+
+def set_max_concurrency(n):
+    """Set the maximal number of tools run simultaneously by the async interface in the running event loop"""
+    loop = asyncio.get_running_loop()
+    if loop in _limits:
+        _limits[loop][1].shutdown(wait=False)
+    _limits[loop] = (asyncio.Semaphore(n), ThreadPoolExecutor(max_workers=n))
+
+
+def _limit():
+    loop = asyncio.get_running_loop()
+    if loop not in _limits:
+        n = os.cpu_count() or 1
+        _limits[loop] = (asyncio.Semaphore(n), ThreadPoolExecutor(max_workers=n))
+    return _limits[loop]
+
+
+def _kill(process):
+    # Popen.kill polls the process, which would race with the thread reaping it
+    if not hasattr(os, 'wait4'):
+        process.kill()
+        return
+    with _reaping:
+        # once reaped, the pid may be reused by another process
+        if process.returncode is None:
+            os.kill(process.pid, signal.SIGKILL)
+
+
+async def _arun_tool(tool_name, workdir='.', args=None, log=None, verbose=False, timeout=None):
+    """Async version of _run_tool
+
+    At most os.cpu_count() tools (see set_max_concurrency) run simultaneously per event loop. The tool process
+    is killed if the call is cancelled or lasts more than timeout seconds (asyncio.TimeoutError is raised).
+    """
+    workdir, cmd = _prepare_tool(tool_name, workdir, args)
+    semaphore, executor = _limit()
+    async with semaphore:
+        start = time.perf_counter()
+        process, stdout, stderr = _spawn(cmd, workdir)
+        # processes are reaped by wait4 in threads of their own, one per running tool
+        waiter = asyncio.get_running_loop().run_in_executor(executor, _wait, process)
+        try:
+            usage = await asyncio.wait_for(asyncio.shield(waiter), timeout)
+        except BaseException:
+            _kill(process)
+            try:
+                await waiter
+            except ChildProcessError:
+                pass  # already reaped
+            stdout.close()
+            stderr.close()
+            raise
+    metrics = ToolMetrics(tool_name, cmd[1:], time.perf_counter() - start, usage)
+    result = _completed(cmd, process, stdout, stderr)
+    return _finish_tool(result, workdir, log, verbose, metrics)
+
+
 def _clean_artifacts(workdir='.', artifacts=None, verbose=False):
     workdir = Path(workdir).resolve()
     if not workdir.is_dir():
@@ -85,10 +294,18 @@ def run_s2v(*args, **kwds): return _run_tool("s2v", log='s2v.log', *args, **kwds
 def run_canestrad(*args, **kwds): return _run_tool("canestrad", log='canestra.log', *args, **kwds)
 
 
-def clean_canestrad(workdir='.'): _clean_artifacts(workdir, ('_scene.can', 'trinf.can','B.dat', 'E0.dat', 'solem.dat', 'Einc.vec', 'Eabs.vec', 'Etri.vec', 'Etri.vec0'))
+async def arun_mcsail(*args, **kwds): return await _arun_tool("mcsail", log='mc-sail.log', *args, **kwds)
+async def arun_periodise(*args, **kwds): return await _arun_tool("periodise", *args, **kwds)
+async def arun_s2v(*args, **kwds): return await _arun_tool("s2v", log='s2v.log', *args, **kwds)
+async def arun_canestrad(*args, **kwds): return await _arun_tool("canestrad", log='canestra.log', *args, **kwds)
+
+
+def clean_canestrad(workdir='.'): _clean_artifacts(workdir, ('_scene.can', 'trinf.can','B.dat', 'E0.dat', 'solem*.dat', 'Einc.vec', 'Eabs.vec', 'Etri.vec', 'Etri.vec[0-9]*'))
 def clean_periodise(workdir='.'): _clean_artifacts(workdir, ('Bz.dat', 'motif.can'))
 def clean_mcsail(workdir='.'): _clean_artifacts(workdir, ('spectral', 'mlsail.env', 'Mcoef.dat', 'Mvec.dat', 'proflux.dat', 'profout'))
 def clean_s2v(workdir='.'): _clean_artifacts(workdir, ('*.spec', 'cropchar', 'leafarea', 'out.dang', 's2v.can', 's2v.area'))
+def clean_ffmatrix(workdir='.', name='*'): _clean_artifacts(workdir, (f'diag_{name}', f'nz_{name}', f'Bfar_{name}'))
+def clean_grid(workdir='.', name='*'): _clean_artifacts(workdir, (f'grid_{name}', f'grid_{name}.tmp'))
 
 
 def clean_all_artifacts(workdir='.'):
@@ -96,3 +313,5 @@ def clean_all_artifacts(workdir='.'):
     clean_periodise(workdir)
     clean_mcsail(workdir)
     clean_s2v(workdir)
+    clean_ffmatrix(workdir)
+    clean_grid(workdir)
@@ -1,6 +1,7 @@
 """utilities to write/read caribu files"""
 
 import numpy as np
+from contextlib import nullcontext
 from itertools import cycle
 from io import StringIO
 from pathlib import Path
@@ -33,6 +34,7 @@ def set_opticals(soil=0.2, leaf=(0.06, 0.07), stem=None):
 
 
 def encode_labels(opt=1, plant=1, leaf=1, elt=0):
+    """int64 canestra labels (opt * 1e11 + plant * 1e6 + leaf * 1e3 + elt), formatted as 12 digits by writers"""
     opt = np.asarray(opt, dtype=np.int64)
     plant = np.clip(np.asarray(plant, dtype=np.int64), 0, 99_999)
     leaf = np.clip(np.asarray(leaf, dtype=np.int64), 0, 999)
@@ -45,7 +47,7 @@ def encode_labels(opt=1, plant=1, leaf=1, elt=0):
             + elt
     )
 
-    return np.char.zfill(np.atleast_1d(labels).astype(str), 12)
+    return np.atleast_1d(labels)
 
 
 def decode_labels(labels):
@@ -74,12 +76,100 @@ def absorptance_from_labels(labels, opticals):
                              ))
 
 
+_CAN_ROW = "p 1 %s 3 " + " ".join(["%.6f"] * 9) + "\n"
+_CAN_INT_ROW = "p 1 %012d 3 " + " ".join(["%.6f"] * 9) + "\n"
+
+
+def write_can(file, triangles, labels, chunk_size=10_000):
+    """Write triangles in caribu canopy format
+
+    Rows are formatted by chunks of triangles with a single %-formatting call per chunk, and
+    streamed to the output, so that the content of the whole file is never held in memory.
+
+    Args:
+        file: a path or a text file object opened for writing
+        triangles: (n, 3, 3) array-like of triangle vertices
+        labels: an array-like of labels (strings, or integers zero-filled to 12 digits at formatting), repeated
+            cyclically if shorter than triangles
+        chunk_size: number of triangles formatted at once
+    """
+    triangles = np.asarray(triangles, dtype=float).reshape(-1, 9)
+    labels = np.asarray(labels).reshape(-1)
+    n = len(triangles) if labels.size else 0
+    row = _CAN_INT_ROW if labels.dtype.kind in 'iu' else _CAN_ROW
+    labels = np.resize(labels if labels.dtype.kind in 'iu' else labels.astype(str), n)
+
+    rows = np.empty((min(chunk_size, n), 10), dtype=object)
+    with nullcontext(file) if hasattr(file, 'write') else open(file, 'w') as out:
+        for start in range(0, n, chunk_size):
+            stop = min(start + chunk_size, n)
+            chunk = rows[:stop - start]
+            chunk[:, 0] = labels[start:stop]
+            chunk[:, 1:] = triangles[start:stop]
+            out.write(row * (stop - start) % tuple(chunk.ravel().tolist()))
+
+
 def can_string(triangles, labels):
-    out = []
-    for tri, label in zip(np.asarray(triangles), cycle(labels.tolist())):
-        coords = " ".join(f"{c:.6f}" for c in tri.reshape(-1))
-        out.append(f"p 1 {label} 3 {coords}\n")
-    return "".join(out)
+    out = StringIO()
+    write_can(out, triangles, labels)
+    return out.getvalue()
+
+
+_CANB_HEADER = np.dtype([('magic', 'S4'), ('itemsize', '<u4'), ('n', '<u8')])
+
+
+def write_canb(file, triangles, labels, dtype=np.float64):
+    """Write triangles in caribu binary canopy format, read by canestrad -M as .can files
+
+    Layout: a 16 bytes header (b'CANB', uint32 size of coordinates, uint64 number of triangles), followed by
+    int64 labels and float32 or float64 vertices (n x 9), all little-endian.
+
+    Args:
+        file: a path or a binary file object opened for writing
+        triangles: (n, 3, 3) array-like of triangle vertices
+        labels: an array-like of (integer or zero-filled string) labels, repeated cyclically if shorter than
+            triangles
+        dtype: coordinates type (np.float32 or np.float64)
+    """
+    dtype = np.dtype(dtype).newbyteorder('<')
+    if dtype.kind != 'f' or dtype.itemsize not in (4, 8):
+        raise ValueError(f"coordinates should be float32 or float64, not {dtype}")
+    triangles = np.asarray(triangles, dtype=dtype).reshape(-1, 9)
+    labels = np.asarray(labels).reshape(-1)
+    n = len(triangles) if labels.size else 0
+    labels = np.resize(labels.astype('<i8'), n)
+    header = np.array([(b'CANB', dtype.itemsize, n)], dtype=_CANB_HEADER)
+    with nullcontext(file) if hasattr(file, 'write') else open(file, 'wb') as out:
+        out.write(header.tobytes())
+        out.write(labels.tobytes())
+        out.write(triangles[:n].tobytes())
+
+
+def read_canb(path, mmap=True):
+    """Read a caribu binary canopy file
+
+    Args:
+        path: path to the file
+        mmap: if True (default), arrays are read-only memory maps of the file
+
+    Returns:
+        (triangles, labels): (n, 3, 3) float array and int64 labels
+    """
+    header = np.fromfile(path, dtype=_CANB_HEADER, count=1)
+    if len(header) == 0 or header['magic'][0] != b'CANB':
+        raise ValueError(f"{path} is not a caribu binary canopy file")
+    n = int(header['n'][0])
+    dtype = np.dtype(f"<f{header['itemsize'][0]}")
+    offset = _CANB_HEADER.itemsize
+    if mmap and n:
+        labels = np.memmap(path, dtype='<i8', mode='r', offset=offset, shape=(n,))
+        triangles = np.memmap(path, dtype=dtype, mode='r', offset=offset + 8 * n, shape=(n, 3, 3))
+    else:
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            labels = np.fromfile(f, dtype='<i8', count=n)
+            triangles = np.fromfile(f, dtype=dtype, count=9 * n).reshape(n, 3, 3)
+    return triangles, labels
 
 
 def canestra_scene(triangles=None, plant=1, specie=1, leaf=True, element=0):
@@ -113,17 +203,20 @@ def canestra_pattern(pattern_tuple=None):
 
 def canestra_light(lights=None):
     """ format lights as caribu light file string content
+
+    Args:
+        lights: a list of (energy, (vx, vy, vz)) tuples or a (n, 4) array of (energy, vx, vy, vz) rows,
+            as built by the sky module
     """
     if lights is None:
         lights = [(1, (0, 0, -1))]
 
-    def _as_string(light):
-        e, p = light
-        return ' '.join(map(str, [e] + list(p))) + '\n'
-
-    lines = list(map(_as_string, lights))
+    if isinstance(lights, np.ndarray):
+        rows = lights.reshape(-1, 4).tolist()
+    else:
+        rows = [[e] + list(p) for e, p in lights]
 
-    return ''.join(lines)
+    return ('%s %s %s %s\n' * len(rows)) % tuple(v for row in rows for v in row)
 
 
 def canestra_opt(opticals=None):
@@ -145,92 +238,77 @@ def canestra_opt(opticals=None):
     return o_string
 
 
-def triangulate_domain(domain, n_div=1):
-    xmin, ymin, xmax, ymax = domain
+def triangulate_domain(domain, n_div=1, out=None):
+    """Split a rectangular domain (xmin, ymin, xmax, ymax) into 2 * n_div ** 2 triangles at z=0
 
-    # grid points
+    Vertices are written directly in one (2 * n_div ** 2, 3, 3) array (out if given): the n_div ** 2 lower
+    triangles of the cells, then the upper ones, cells being ordered x-major.
+    """
+    xmin, ymin, xmax, ymax = domain
     xs = np.linspace(xmin, xmax, n_div + 1)
     ys = np.linspace(ymin, ymax, n_div + 1)
+    if out is None:
+        out = np.empty((2 * n_div * n_div, 3, 3))
+    cells = out.reshape(2, n_div, n_div, 3, 3)
+    x0, x1 = xs[:-1, None], xs[1:, None]
+    y0, y1 = ys[None, :-1], ys[None, 1:]
+    for tri, corners in enumerate((((x0, y0), (x1, y0), (x1, y1)),
+                                   ((x0, y0), (x1, y1), (x0, y1)))):
+        for vertex, (x, y) in enumerate(corners):
+            cells[tri, :, :, vertex, 0] = x
+            cells[tri, :, :, vertex, 1] = y
+    out[:, :, 2] = 0
+    return out
+
+
+def soil_mesh(domain=None, n_div=1):
+    """Soil triangles of domain and their integer labels (opt, plant and leaf being 0, elt the triangle index)"""
+    if domain is None:
+        domain = (0, 0, np.sqrt(2), np.sqrt(2))
+    triangles = triangulate_domain(domain, n_div)
+    # as encode_labels, element numbers are clipped to 999
+    labels = np.minimum(np.arange(len(triangles), dtype=np.int64), 999)
+    return triangles, labels
 
-    # create grid
-    X, Y = np.meshgrid(xs, ys, indexing="ij")
-
-    # lower-left corner of each cell
-    x0 = X[:-1, :-1]
-    y0 = Y[:-1, :-1]
-
-    # other corners of each cell
-    x1 = X[1:, :-1]
-    y1 = Y[1:, :-1]
 
-    x2 = X[1:, 1:]
-    y2 = Y[1:, 1:]
+def write_soil(file, domain=None, n_div=1):
+    """Write the soil mesh of domain in caribu canopy format"""
+    write_can(file, *soil_mesh(domain, n_div))
 
-    x3 = X[:-1, 1:]
-    y3 = Y[:-1, 1:]
 
-    # stack triangles
-    tri1 = np.stack([
-        np.stack([x0, y0, np.zeros_like(x0)], axis=-1),
-        np.stack([x1, y1, np.zeros_like(x1)], axis=-1),
-        np.stack([x2, y2, np.zeros_like(x2)], axis=-1)
-    ], axis=-2)
+def canestra_soil(domain=None, n_div=1):
+    return can_string(*soil_mesh(domain, n_div))
 
-    tri2 = np.stack([
-        np.stack([x0, y0, np.zeros_like(x0)], axis=-1),
-        np.stack([x2, y2, np.zeros_like(x2)], axis=-1),
-        np.stack([x3, y3, np.zeros_like(x3)], axis=-1)
-    ], axis=-2)
 
-    triangles = np.concatenate([tri1.reshape(-1, 3, 3),
-                                tri2.reshape(-1, 3, 3)], axis=0)
+_RESULTS_COLUMNS = ('index', 'label', 'area', 'Eabs', 'Ei', 'Ei_sup', 'Ei_inf')  # Etri.vec0 column order
+_RESULTS_KEYS = ('index', 'label', 'area', 'Ei', 'Eabs', 'Ei_sup', 'Ei_inf')
+_SOIL_KEYS = ('index', 'label', 'area', 'Ei')
 
-    return triangles
 
+def read_results(path, nsoil=0, usecols=None):
+    """Read canestrad Etri.vec0 output in a single typed pass
 
-def canestra_soil(domain=None, n_div=1):
-    if domain is None:
-        domain = (0, 0, np.sqrt(2), np.sqrt(2))
-    triangles = triangulate_domain(domain, n_div)
-    labels = encode_labels(0, 0, 0, range(len(triangles)))
-    return can_string(triangles, labels)
-
+    Args:
+        path: path to the Etri.vec0 file
+        nsoil: number of trailing rows corresponding to soil triangles
+        usecols: optional sequence of keys ('index', 'label', 'area', 'Ei', 'Eabs', 'Ei_sup', 'Ei_inf') to
+            restrict parsing to. Default (None) parses all columns.
 
-def read_results(path, nsoil=0):
-    data_array = np.loadtxt(path, skiprows=2, dtype=str)
-    data_array = np.atleast_2d(data_array)  # ensures 2D shape even if one triangle
-    # assuming columns: index label area Eabs Ei_sup Ei_inf
-    idx = data_array[:, 0].astype(float)
-    label = np.array([l.zfill(12) for l in data_array[:, 1]])
-    area, Eabs, Ei, Ei_sup, Ei_inf = data_array[:, 2:].astype(float).T
+    Returns:
+        (data, soil_data) dicts of arrays (soil_data is None if nsoil is 0). index and label are int64 and
+        energies float64 (nan for rejected triangles)
+    """
+    keys = _RESULTS_KEYS if usecols is None else [k for k in _RESULTS_KEYS if k in usecols]
+    names = [c for c in _RESULTS_COLUMNS if c in keys]
+    dtype = np.dtype([(c, np.int64 if c in ('index', 'label') else np.float64) for c in names])
+    table = np.loadtxt(path, skiprows=2, ndmin=1, dtype=dtype,
+                       usecols=[_RESULTS_COLUMNS.index(c) for c in names])
+    columns = {k: table[k] for k in keys}
 
     if nsoil == 0:
-        soil_data = None
-        data = {
-            'index': idx,
-            'label': label,
-            'area': area,
-            'Ei': Ei,
-            'Eabs': Eabs,
-            'Ei_sup': Ei_sup,
-            'Ei_inf': Ei_inf,
-        }
-    else:
-        data = {
-            'index': idx[:-nsoil],
-            'label': label[:-nsoil],
-            'area': area[:-nsoil],
-            'Ei': Ei[:-nsoil],
-            'Eabs': Eabs[:-nsoil],
-            'Ei_sup': Ei_sup[:-nsoil],
-            'Ei_inf': Ei_inf[:-nsoil],
-        }
-        soil_data = {
-            'index': idx[-nsoil:],
-            'label': label[-nsoil:],
-            'area': area[-nsoil:],
-            'Ei': Ei[-nsoil:],
-        }
+        return columns, None
+    data = {k: v[:-nsoil] for k, v in columns.items()}
+    soil_data = {k: v[-nsoil:] for k, v in columns.items() if k in _SOIL_KEYS}
     return data, soil_data
 
 
@@ -287,16 +365,22 @@ def read_opt(source):
     return {'soil': soil_reflectance, 'species': species}
 
 
+_PRIMITIVE_DTYPE = np.dtype([('label', np.int64), ('xyz', np.float64, (9,))])
+
+
+def _read_primitives(infile):
+    # label is the first attribute, vertices the last 9 columns, whatever the number of attributes
+    table = np.loadtxt(infile, comments="#", ndmin=1, dtype=_PRIMITIVE_DTYPE, usecols=(2,) + tuple(range(-9, 0)))
+    triangles = np.ascontiguousarray(table['xyz']).reshape(-1, 3, 3)
+    return triangles, np.ascontiguousarray(table['label'])
+
+
 def read_can(source):
     if isinstance(source, Path) or source.endswith('.can'):
         infile = Path(source)
     else:
         infile = StringIO(source)
-
-    can = np.loadtxt(infile, comments="#", ndmin=2, dtype=str)
-    labels = can[:, 2]
-    triangles = can[:, -9:].astype(float).reshape(-1, 3, 3)
-    return triangles, labels
+    return _read_primitives(infile)
 
 
 def read_sensors(source):
@@ -304,11 +388,7 @@ def read_sensors(source):
         infile = Path(source)
     else:
         infile = StringIO(source)
-
-    can = np.loadtxt(infile, comments="#", ndmin=2, dtype=str)
-    ids = can[:, 2].astype(int)
-    triangles = can[:, -9:].astype(float).reshape(-1, 3, 3)
-    return triangles, ids
+    return _read_primitives(infile)
 
 
 def read_soil(source):
@@ -316,10 +396,7 @@ def read_soil(source):
         infile = Path(source)
     else:
         infile = StringIO(source)
-    soil = np.loadtxt(infile, comments="#", ndmin=2, dtype=str)
-    labels = soil[:, 2]
-    triangles = soil[:, -9:].astype(float).reshape(-1, 3, 3)
-    return triangles, labels
+    return _read_primitives(infile)
 
 
 def read_light(source):
@@ -0,0 +1,220 @@
+"""Container for canestrad per-triangle outputs"""
+
+from collections.abc import Mapping
+from itertools import islice
+
+import numpy as np
+
+import openalea.libcaribu.io as lcio
+
+RESULTS_DTYPE = np.dtype([
+    ('index', np.int64),
+    ('label', np.int64),
+    ('area', np.float64),
+    ('Eabs', np.float64),
+    ('Ei', np.float64),
+    ('Ei_sup', np.float64),
+    ('Ei_inf', np.float64),
+    ('opt', np.int16),
+    ('plant', np.int32),
+    ('leaf', np.int16),
+    ('elt', np.int16),
+])
+
+_PARSED_DTYPE = np.dtype([(name, RESULTS_DTYPE[name]) for name in lcio._RESULTS_COLUMNS])
+_ENERGIES = ('Ei', 'Eabs', 'Ei_sup', 'Ei_inf')
+
+
+def _fields(fields):
+    return [fields] if isinstance(fields, str) else list(fields)
+
+
+def _group(table, fields):
+    # decoded label columns are non-negative: combine them into one int64 key
+    code = np.zeros(len(table), dtype=np.int64)
+    for f in fields:
+        column = table[f].astype(np.int64)
+        code = code * (int(column.max(initial=0)) + 1) + column
+    _, first, inverse = np.unique(code, return_index=True, return_inverse=True)
+    return first, inverse.reshape(-1), len(first)
+
+
+def _energy_sums(table, fields):
+    # per group: total area, and flux (energy * area) and area of triangles with a valid (non nan) energy
+    first, inverse, n = _group(table, fields)
+    sums = np.empty(n, dtype=[(f, RESULTS_DTYPE[f]) for f in fields] + [('area', np.float64)]
+                             + [(f'{name}_{s}', np.float64) for name in _ENERGIES for s in ('flux', 'area')])
+    for f in fields:
+        sums[f] = table[f][first]
+    area = table['area']
+    sums['area'] = np.bincount(inverse, weights=area, minlength=n)
+    for name in _ENERGIES:
+        energy = table[name]
+        valid = ~np.isnan(energy)
+        sums[f'{name}_flux'] = np.bincount(inverse, weights=np.where(valid, energy * area, 0), minlength=n)
+        sums[f'{name}_area'] = np.bincount(inverse, weights=np.where(valid, area, 0), minlength=n)
+    return sums
+
+
+def _merge_sums(sums, fields):
+    first, inverse, n = _group(sums, fields)
+    merged = np.empty(n, dtype=sums.dtype)
+    for f in sums.dtype.names:
+        if f in fields:
+            merged[f] = sums[f][first]
+        else:
+            merged[f] = np.bincount(inverse, weights=sums[f], minlength=n)
+    return merged
+
+
+def _means(sums):
+    names = [f for f in sums.dtype.names if f == 'area' or not f.startswith(tuple(_ENERGIES))]
+    grouped = np.empty(len(sums), dtype=[(f, sums.dtype[f]) for f in names]
+                                        + [(name, np.float64) for name in _ENERGIES])
+    for f in names:
+        grouped[f] = sums[f]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for name in _ENERGIES:
+            grouped[name] = sums[f'{name}_flux'] / sums[f'{name}_area']
+    return grouped
+
+
+def _count_lines(path, block_size=2 ** 20):
+    count, last = 0, b'\n'
+    with open(path, 'rb') as f:
+        while block := f.read(block_size):
+            count += block.count(b'\n')
+            last = block[-1:]
+    return count + (last != b'\n')
+
+
+class Results(Mapping):
+    """Per-triangle outputs of canestrad, backed by one structured array
+
+    The mapping interface gives the same columns as io.read_results ('index', 'label', 'area', 'Ei', 'Eabs',
+    'Ei_sup', 'Ei_inf'). Decoded label columns ('opt', 'plant', 'leaf', 'elt') are available from the
+    underlying `table`. `metrics` holds the
+    commands.ToolMetrics of the canestrad run that produced the results, if any.
+    """
+
+    _keys = lcio._RESULTS_KEYS
+
+    def __init__(self, table):
+        self.table = table
+        self.metrics = None
+
+    @classmethod
+    def from_array(cls, parsed):
+        """Build from an array holding (at least) the Etri.vec0 columns, decoding labels once"""
+        table = np.empty(len(parsed), dtype=RESULTS_DTYPE)
+        for name in _PARSED_DTYPE.names:
+            table[name] = parsed[name]
+        table['opt'], table['plant'], table['leaf'], table['elt'] = lcio.decode_labels(table['label'])
+        return cls(table)
+
+    @classmethod
+    def from_file(cls, path):
+        """Read a canestrad Etri.vec0 file"""
+        return cls.from_array(np.loadtxt(path, skiprows=2, ndmin=1, dtype=_PARSED_DTYPE))
+
+    @classmethod
+    def iter_file(cls, path, chunk_size=100_000, nsoil=0):
+        """Read a canestrad Etri.vec0 file by blocks of at most chunk_size rows, memory staying bounded
+
+        Args:
+            nsoil: number of trailing rows corresponding to soil triangles
+
+        Yields:
+            (canopy, soil) Results of the rows of each block, as split(), either being None if the block has
+            no row of this part
+        """
+        nrows = _count_lines(path) - 2 if nsoil else 0
+        start = 0
+        with open(path) as f:
+            for _ in islice(f, 2):
+                pass
+            while lines := list(islice(f, chunk_size)):
+                block = cls.from_array(np.loadtxt(lines, ndmin=1, dtype=_PARSED_DTYPE))
+                stop = start + block.size
+                split = min(max(nrows - nsoil - start, 0), block.size) if nsoil else block.size
+                canopy = type(block)(block.table[:split]) if split > 0 else None
+                soil = type(block)(block.table[split:]) if split < block.size else None
+                yield canopy, soil
+                start = stop
+
+    def __getitem__(self, key):
+        if key not in self.table.dtype.names:
+            raise KeyError(key)
+        return self.table[key]
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.size} triangles)"
+
+    @property
+    def size(self):
+        """number of triangles"""
+        return len(self.table)
+
+    def split(self, nsoil=0):
+        """Views on the canopy and soil (the trailing nsoil rows) parts, without copy
+
+        Returns:
+            (canopy, soil) Results, soil being None if nsoil is 0
+        """
+        if nsoil == 0:
+            return self, None
+        return type(self)(self.table[:-nsoil]), type(self)(self.table[-nsoil:])
+
+    def groupby(self, fields):
+        """Area-weighted aggregation of energies over groups of triangles
+
+        Args:
+            fields: a (sequence of) decoded label column(s) ('opt', 'plant', 'leaf', 'elt') defining groups
+
+        Returns:
+            a structured array with one row per group, holding the group fields, the total area and the
+            area-weighted mean of Ei, Eabs, Ei_sup and Ei_inf. Triangles with nan energies (rejected by
+            canestrad) are ignored in the mean of that energy.
+        """
+        return _means(_energy_sums(self.table, _fields(fields)))
+
+    def groupby_plant(self):
+        """Area-weighted energies per plant"""
+        return self.groupby('plant')
+
+    def groupby_organ(self):
+        """Area-weighted energies per organ (plant, leaf), leaf=0 being the stem"""
+        return self.groupby(['plant', 'leaf'])
+
+
+def reduce_file(path, fields=('plant',), nsoil=0, chunk_size=100_000):
+    """Area-weighted aggregation of the energies of a canestrad Etri.vec0 file, read by blocks
+
+    The full table is never loaded: memory is bounded by chunk_size and the number of groups.
+
+    Args:
+        fields: the decoded label column(s) defining canopy groups, as in Results.groupby
+        nsoil: number of trailing rows corresponding to soil triangles
+
+    Returns:
+        (canopy, soil) structured arrays, as returned by Results.groupby, canopy holding one row per group and
+        soil one row (the whole soil), or None if nsoil is 0
+    """
+    fields = _fields(fields)
+    canopy_sums = soil_sums = None
+    for canopy, soil in Results.iter_file(path, chunk_size, nsoil):
+        if canopy is not None:
+            sums = _energy_sums(canopy.table, fields)
+            canopy_sums = sums if canopy_sums is None else _merge_sums(np.concatenate((canopy_sums, sums)), fields)
+        if soil is not None:
+            sums = _energy_sums(soil.table, [])
+            soil_sums = sums if soil_sums is None else _merge_sums(np.concatenate((soil_sums, sums)), [])
+    if canopy_sums is None:
+        canopy_sums = _energy_sums(np.empty(0, dtype=RESULTS_DTYPE), fields)
+    return _means(canopy_sums), None if soil_sums is None else _means(soil_sums)
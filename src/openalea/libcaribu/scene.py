@@ -0,0 +1,100 @@
+"""Incremental update of scene canopy files between simulation steps"""
+
+import io
+from pathlib import Path
+
+import numpy as np
+
+import openalea.libcaribu.io as lcio
+
+
+def _signature(path):
+    stat = path.stat()
+    return stat.st_mtime_ns, stat.st_size
+
+
+class IncrementalScene:
+    """Canopy of a scene directory stored as blocks of triangles (one per plant, organ...)
+
+    Blocks are formatted once, when updated, and flush only rewrites the part of scene.can (and of
+    scene_and_soil.can if the scene has a soil) that changed since the previous flush: blocks of unchanged
+    size are overwritten in place, otherwise the files are rewritten from the first changed block. Files
+    modified by someone else since the previous flush are rewritten entirely.
+
+    Blocks are written in insertion order: adding the blocks that change most often last minimises rewrites.
+    """
+
+    def __init__(self, scene_path):
+        self.scene_path = Path(scene_path)
+        self._blocks = {}
+        # (key, data) of the blocks as written, and signatures of the written files
+        self._written = []
+        self._signatures = {}
+
+    def __contains__(self, key):
+        return key in self._blocks
+
+    def __len__(self):
+        return len(self._blocks)
+
+    def keys(self):
+        return self._blocks.keys()
+
+    def update(self, key, triangles, labels):
+        """Set the triangles of block key. labels is a (list of) canestra label(s), cycled over triangles"""
+        if np.ndim(labels) == 0:
+            labels = [labels]
+        buffer = io.StringIO()
+        lcio.write_can(buffer, triangles, labels)
+        self._blocks[key] = buffer.getvalue().encode()
+
+    def remove(self, key):
+        del self._blocks[key]
+
+    def _is_current(self, path):
+        return path.exists() and self._signatures.get(path.name) == _signature(path)
+
+    def _patch(self, path, blocks, suffix=b''):
+        """Write blocks (then suffix) to path, touching only the bytes that changed. Returns bytes written"""
+        if not self._is_current(path):
+            data = b''.join(data for _, data in blocks) + suffix
+            path.write_bytes(data)
+            self._signatures[path.name] = _signature(path)
+            return len(data)
+        written = 0
+        offset = 0
+        with path.open('r+b') as f:
+            for i, (key, data) in enumerate(blocks):
+                old = self._written[i] if i < len(self._written) else None
+                if old is None or old[0] != key or len(old[1]) != len(data):
+                    # layout changed from here: rewrite the tail
+                    f.seek(offset)
+                    written += f.write(b''.join(data for _, data in blocks[i:]) + suffix)
+                    f.truncate()
+                    break
+                if old[1] != data:
+                    f.seek(offset)
+                    written += f.write(data)
+                offset += len(data)
+            else:
+                if len(blocks) < len(self._written):
+                    f.seek(offset)
+                    written += f.write(suffix)
+                    f.truncate()
+        self._signatures[path.name] = _signature(path)
+        return written
+
+    def flush(self):
+        """Write pending changes to scene.can and scene_and_soil.can. Returns the number of bytes written"""
+        blocks = list(self._blocks.items())
+        (self.scene_path / 'scene.canb').unlink(missing_ok=True)
+        written = self._patch(self.scene_path / 'scene.can', blocks)
+        soil = self.scene_path / 'scene.soil'
+        if soil.exists():
+            combined = self.scene_path / 'scene_and_soil.can'
+            if self._signatures.get('scene.soil') != _signature(soil):
+                combined.unlink(missing_ok=True)
+                self._signatures['scene.soil'] = _signature(soil)
+            written += self._patch(combined, blocks, soil.read_bytes())
+        self._written = blocks
+        return written
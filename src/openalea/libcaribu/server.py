@@ -0,0 +1,295 @@
+"""Long-lived canestrad processes (canestrad -D), loading a scene once and answering a stream of simulations"""
+
+import os
+import subprocess
+import tempfile
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+
+import openalea.libcaribu.algos as lcal
+import openalea.libcaribu.commands as lcmd
+
+ALGOS = ('raycasting', 'toric_raycasting', 'radiosity', 'mixed_radiosity')
+_FF_NAME = 'server'  # form factor matrix computed by the first radiosity simulation, read back by the next ones
+
+
+def _stop(process, stderr, scene_path):
+    if process.poll() is None:
+        try:
+            process.stdin.write(b'quit\n')
+            process.stdin.close()
+            process.wait(timeout=10)
+        except (OSError, subprocess.TimeoutExpired):
+            process.kill()
+            process.wait()
+    process.stdout.close()
+    stderr.close()
+    if scene_path.is_dir():
+        lcmd.clean_ffmatrix(scene_path, _FF_NAME)
+        (scene_path / 'canestra.log').unlink(missing_ok=True)
+
+
+def _usable(server):
+    return not server.closed and not server.stale()
+
+
+def _close(future):
+    # stop a server of the pool, once started
+    try:
+        server = future.result()
+    except BaseException:
+        return
+    server.close()
+
+
+def _signature(paths):
+    return [(path.stat().st_mtime_ns, path.stat().st_size) if path.exists() else None for path in paths]
+
+
+class CanestradServer:
+    """A canestrad process holding a scene and running simulations on request
+
+    The canopy (with soil, pattern and sensors) is parsed and the voxel grid built once, at start. For radiosity,
+    form factors are computed by the first simulation and read back by the next ones. Each simulation sets the
+    lights and the band (optical file, and turbid medium fluxes for mixed_radiosity) and returns the outputs as
+    the algos functions. Sensors are part of the loaded scene (they are diffusers of the form factor matrix):
+    another sensor set needs another server. Simulations are serialised, and scene_path should not be used by
+    other runs while the server is alive.
+
+    Args:
+        scene_path: a scene directory (algos.set_scene)
+        algo: one of 'raycasting', 'toric_raycasting', 'radiosity' and 'mixed_radiosity'
+        band: band loaded at start and simulated by default (the first optical file of the scene if None)
+        soil, sd, layers, height, more_args, screen_resolution, disk_resolution, memory_budget, threads: as in the
+            algos functions
+    """
+
+    def __init__(self, scene_path, algo='raycasting', band=None, soil=False, sd=0, layers=2, height=1,
+                 more_args=None, screen_resolution=None, disk_resolution=None, memory_budget=None, threads=None):
+        if algo not in ALGOS:
+            raise ValueError(f"unknown algorithm: {algo}, should be one of {ALGOS}")
+        self.scene_path = scene_path = Path(scene_path).resolve()
+        self.algo = algo
+        self.band = lcal._default_band(scene_path, band)
+        self.layers, self.height = layers, height
+        more_args = lcal._resolution_args(more_args, screen_resolution, disk_resolution, threads)
+        more_args = lcal._solver_args(more_args, memory_budget)
+        toric = algo in ('toric_raycasting', 'mixed_radiosity')
+        scene_file = scene_path / lcal._scene_file(scene_path)
+        if toric and lcal._motif_is_stale(scene_path):
+            lcal.periodise(scene_path)
+        if algo == 'raycasting':
+            args, self.nsoil = lcal._raycasting_args(scene_path, self.band, soil, more_args)
+        elif algo == 'toric_raycasting':
+            args, self.nsoil = lcal._toric_raycasting_args(scene_path, self.band, soil, more_args)
+        else:
+            if algo == 'radiosity':
+                args, self.nsoil = lcal._radiosity_args(scene_path, soil, more_args)
+                reuse_ff = True
+            else:
+                self._prepare_band(self.band)
+                args, self.nsoil = lcal._mixed_radiosity_args(scene_path, sd, soil, more_args)
+                reuse_ff = sd != 0
+            args += ["-p", f"{self.band}.opt"]
+            if reuse_ff:
+                args += ["-t", "./", "-f", _FF_NAME]
+        # the server is restarted by ServerPool if one of its geometric inputs changes
+        self._inputs = [scene_file, scene_path / 'scene.8'] + [scene_path / value for flag, value in
+                                                               zip(args, args[1:]) if flag in ('-M', '-8', '-C')]
+        self._signature = _signature(self._inputs)
+
+        lcmd.clean_canestrad(scene_path)
+        workdir, self.cmd = lcmd._prepare_tool("canestrad", scene_path, ["-D"] + args)
+        stderr = tempfile.TemporaryFile()
+        try:
+            self._process = subprocess.Popen(self.cmd, cwd=workdir, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                             stderr=stderr)
+        except BaseException:
+            stderr.close()
+            raise
+        self._stderr = stderr
+        self._lock = threading.Lock()
+        self._finalizer = weakref.finalize(self, _stop, self._process, stderr, scene_path)
+
+    def _prepare_band(self, band):
+        # turbid medium fluxes of the band, under the current lights
+        if lcal._is_stale(self.scene_path / f'{band}.spec', self.scene_path / 'motif.can'):
+            lcal.s2v(self.scene_path, bands=[band], layers=self.layers, height=self.height)
+        lcal.mcsail(self.scene_path, band=band)
+
+    def _failed(self, request, reply):
+        log = self.scene_path / 'canestra.log'
+        self._stderr.seek(0)
+        return lcmd.CommandFailed(self.scene_path, self.cmd + [request], self._process.poll(), reply,
+                                  self._stderr.read().decode(errors='replace'),
+                                  log.read_text(errors='replace') if log.is_file() else None)
+
+    def run(self, lights=None, band=None, simulations=1):
+        """Simulate lights in band
+
+        Args:
+            lights: light sources (see algos.set_scene), the current scene.light if None
+            band: the band simulated, default to the band of the server
+            simulations: number of light configurations in scene.light, identified by the fifth column of the
+                light file (see algos.multi_raycasting)
+
+        Returns:
+            (results, soil, measures) as the algos functions, or a list of such tuples, one per simulation,
+            if simulations > 1
+        """
+        band = self.band if band is None else band
+        with self._lock:
+            if self.closed:
+                raise ValueError("canestrad server is closed")
+            if lights is not None:
+                lcal.set_scene(self.scene_path, lights=lights)
+            if self.algo == 'mixed_radiosity':
+                self._prepare_band(band)
+            lcmd.clean_canestrad(self.scene_path)
+            request = f"-l scene.light -p {band}.opt -S {int(simulations)}"
+            start = time.perf_counter()
+            try:
+                self._process.stdin.write(request.encode() + b'\n')
+                self._process.stdin.flush()
+                reply = self._process.stdout.readline().decode().strip()
+            except BrokenPipeError:
+                reply = ''
+            if reply != 'ok':
+                if not reply:  # canestrad exited
+                    self._process.wait()
+                error = self._failed(request, reply)
+                if not reply:
+                    self._finalizer()
+                raise error
+            metrics = lcmd.ToolMetrics("canestrad", self.cmd + request.split(), time.perf_counter() - start)
+            for hook in list(lcmd._metrics_hooks):
+                hook(metrics)
+            outputs = [lcal.get_outputs(self.scene_path, self.nsoil, i) for i in range(simulations)]
+        for results, _, _ in outputs:
+            if results is not None:
+                results.metrics = metrics
+        return outputs if simulations > 1 else outputs[0]
+
+    def stale(self):
+        """True if the canopy, pattern or sensors files changed since the server started"""
+        return _signature(self._inputs) != self._signature
+
+    def close(self):
+        """Stop the canestrad process, after the simulation running if any"""
+        with self._lock:
+            self._finalizer()
+
+    @property
+    def closed(self):
+        return not self._finalizer.alive
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ServerPool:
+    """CanestradServer processes kept between simulations, one per scene directory
+
+    Servers are started on first use of a scene directory, and restarted when used with another algorithm or
+    other options, or when the canopy, pattern or sensors of the scene changed. At most max_servers processes are
+    kept, the least recently used idle one being stopped first. Simulations of different scene directories run in
+    parallel with submit, or from several threads.
+
+    Args:
+        max_servers: maximal number of canestrad processes (default to the number of processors)
+    """
+
+    def __init__(self, max_servers=None):
+        self.max_servers = max_servers or os.cpu_count() or 1
+        # scene directory: (server options, future server), least recently used first. Servers are started and
+        # stopped outside of the lock, their entry holding a pending future meanwhile
+        self._servers = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _victim(self):
+        # least recently used idle server, else least recently used busy one (stopped after its simulation)
+        started = [path for path, (_, future) in self._servers.items() if future.done()]
+        for path in started:
+            if not self._servers[path][1].result()._lock.locked():
+                return path
+        return started[0] if started else None
+
+    def server(self, scene_path, algo='raycasting', **options):
+        """The server of scene_path for algo and options (see CanestradServer), started if needed"""
+        scene_path = Path(scene_path).resolve()
+        key = (algo, repr(sorted(options.items())))
+        victims = []
+        with self._lock:
+            if self._servers is None:
+                raise ValueError("server pool is closed")
+            entry = self._servers.pop(scene_path, None)
+            if entry is not None and entry[0] == key and (not entry[1].done() or _usable(entry[1].result())):
+                self._servers[scene_path] = entry
+                future = None
+            else:
+                if entry is not None:
+                    victims.append(entry[1])
+                while len(self._servers) >= self.max_servers:
+                    path = self._victim()
+                    if path is None:  # all servers are starting
+                        break
+                    victims.append(self._servers.pop(path)[1])
+                future = Future()
+                self._servers[scene_path] = (key, future)
+        for victim in victims:
+            _close(victim)
+        if future is None:
+            return entry[1].result()
+        try:
+            server = CanestradServer(scene_path, algo, **options)
+        except BaseException as error:
+            with self._lock:
+                if self._servers is not None and self._servers.get(scene_path, (None, None))[1] is future:
+                    del self._servers[scene_path]
+            future.set_exception(error)
+            raise
+        future.set_result(server)
+        return server
+
+    def run(self, scene_path, algo='raycasting', lights=None, band=None, simulations=1, **options):
+        """Simulate lights in band with the server of scene_path (see CanestradServer.run)"""
+        while True:
+            server = self.server(scene_path, algo, **options)
+            try:
+                return server.run(lights, band, simulations)
+            except ValueError:
+                # stopped by another thread (least recently used) before the simulation started
+                if not server.closed:
+                    raise
+
+    def submit(self, scene_path, algo='raycasting', lights=None, band=None, simulations=1, **options):
+        """run in a thread of the pool. Returns a concurrent.futures.Future"""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_servers)
+            executor = self._executor
+        return executor.submit(self.run, scene_path, algo, lights, band, simulations, **options)
+
+    def close(self):
+        """Stop all servers"""
+        with self._lock:
+            servers, self._servers = self._servers or {}, None
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+        for _, future in servers.values():
+            _close(future)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
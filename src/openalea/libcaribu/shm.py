@@ -0,0 +1,151 @@
+"""Transfer of canopies to canestrad through System V shared memory segments (canestrad -m)
+
+canestrad -m key reads its primitives from the segment (clef % 100), where key = (n + 1) * 100 + clef, as an
+array of Patch structures (label type, float vertices), and writes its outputs in the segment
+(clef % 100 + 1900) as 5 blocks of n doubles: Eabs * area, Ei_sup * area, Ei_inf * area (-area for opaque
+primitives), area and Ei.
+"""
+
+import ctypes
+import ctypes.util
+import os
+
+import numpy as np
+
+import openalea.libcaribu.io as lcio
+
+IPC_CREAT = 0o1000
+IPC_EXCL = 0o2000
+IPC_RMID = 0
+_OUTPUT_OFFSET = 1900  # OFFS in transf.h
+
+# typedef struct {signed char t; float P[3][3];} Patch;
+PATCH_DTYPE = np.dtype([('t', 'i1'), ('P', '<f4', (3, 3))], align=True)
+
+_libc = None
+
+
+def _lib():
+    global _libc
+    if _libc is None:
+        if os.name != 'posix':
+            raise OSError("System V shared memory is only available on posix systems")
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        libc.shmget.argtypes = (ctypes.c_int, ctypes.c_size_t, ctypes.c_int)
+        libc.shmget.restype = ctypes.c_int
+        libc.shmat.argtypes = (ctypes.c_int, ctypes.c_void_p, ctypes.c_int)
+        libc.shmat.restype = ctypes.c_void_p
+        libc.shmdt.argtypes = (ctypes.c_void_p,)
+        libc.shmdt.restype = ctypes.c_int
+        libc.shmctl.argtypes = (ctypes.c_int, ctypes.c_int, ctypes.c_void_p)
+        libc.shmctl.restype = ctypes.c_int
+        _libc = libc
+    return _libc
+
+
+def _check(result, what):
+    if result == -1 or result is None or result == ctypes.c_void_p(-1).value:
+        errno = ctypes.get_errno()
+        raise OSError(errno, f"{what}: {os.strerror(errno)}")
+    return result
+
+
+class _Segment:
+    """A newly created System V shared memory segment, attached and viewed as a numpy array"""
+
+    def __init__(self, key, dtype, count):
+        libc = _lib()
+        nbytes = max(1, count) * dtype.itemsize
+        self.shmid = _check(libc.shmget(key, nbytes, IPC_CREAT | IPC_EXCL | 0o600), f"shmget({key})")
+        try:
+            self.address = _check(libc.shmat(self.shmid, None, 0), "shmat")
+        except OSError:
+            libc.shmctl(self.shmid, IPC_RMID, None)
+            raise
+        buffer = (ctypes.c_char * nbytes).from_address(self.address)
+        self.array = np.frombuffer(buffer, dtype=dtype, count=count)
+
+    def close(self):
+        libc = _lib()
+        self.array = None
+        libc.shmdt(self.address)
+        libc.shmctl(self.shmid, IPC_RMID, None)
+
+
+def _int_labels(labels, n):
+    return np.resize(np.asarray(labels).astype(np.int64), n)
+
+
+def patches(triangles, labels):
+    """Patch records of triangles: type is 0 for soil, -opt for opaque and opt for translucent primitives"""
+    triangles = np.asarray(triangles, dtype=np.float64)
+    opt, _, leaf, _ = lcio.decode_labels(_int_labels(labels, len(triangles)))
+    records = np.zeros(len(triangles), dtype=PATCH_DTYPE)
+    records['t'] = np.where(leaf == 0, -opt, opt)
+    records['P'] = triangles
+    return records
+
+
+class SharedScene:
+    """Input and output segments of a canestrad -m run for a canopy, removed on close
+
+    Args:
+        triangles: (n, 3, 3) array-like of triangle vertices
+        labels: canestra labels of triangles, cycled over triangles
+
+    Attributes:
+        key: the canestrad -m argument
+    """
+
+    def __init__(self, triangles, labels):
+        records = patches(triangles, labels)
+        self.n = len(records)
+        self.labels = _int_labels(labels, self.n)
+        self._input = self._output = None
+        # segment ids are below 100, and the output segment is offset by 1900. Id 0 is IPC_PRIVATE: canestrad
+        # would attach to a new, empty segment
+        for clef in 1 + np.random.permutation(99):
+            try:
+                self._input = _Segment(int(clef), PATCH_DTYPE, self.n)
+            except OSError:
+                continue
+            try:
+                # canestrad maps 5 * (n + 1) doubles
+                self._output = _Segment(int(clef) + _OUTPUT_OFFSET, np.dtype(np.float64), 5 * (self.n + 1))
+            except OSError:
+                self._input.close()
+                self._input = None
+                continue
+            break
+        else:
+            raise OSError("no free shared memory segment id for canestrad")
+        self._input.array[:] = records
+        self._output.array[:] = np.nan
+        self.key = str((self.n + 1) * 100 + int(clef))
+
+    def results(self):
+        """Per-triangle outputs of the run (the Etri.vec0 columns), rows of rejected primitives being nan"""
+        eabs, ei_sup, ei_inf, area, ei = self._output.array[:5 * self.n].reshape(5, self.n).copy()
+        table = np.zeros(self.n, dtype=[(name, np.float64) for name in ('area', 'Eabs', 'Ei', 'Ei_sup', 'Ei_inf')]
+                         + [('index', np.int64), ('label', np.int64)])
+        table['index'] = np.arange(self.n)
+        table['label'] = self.labels
+        table['area'] = area
+        with np.errstate(invalid='ignore', divide='ignore'):
+            table['Eabs'] = eabs / area
+            table['Ei_sup'] = ei_sup / area
+            table['Ei_inf'] = ei_inf / area
+        table['Ei'] = ei
+        return table
+
+    def close(self):
+        for segment in (self._input, self._output):
+            if segment is not None:
+                segment.close()
+        self._input = self._output = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,197 @@
+"""Sky and sun light sources for caribu
+
+Sources are returned as (n, 4) arrays of rows (energy, dx, dy, dz), that io.canestra_light (and set_scene)
+write to a single light file, so that all sources are processed in one canestrad run. Energies are horizontal
+irradiances (the irradiance received by a horizontal surface exposed to the source) and directions are unit
+vectors pointing from the sky to the ground.
+
+Angles are in degrees. Elevations are measured from the horizon. Sky sector azimuths are measured
+counter-clockwise from the scene X+ axis, sun azimuths clockwise from North (astronomical convention), North
+being located at `north` degrees counter-clockwise from X+.
+"""
+
+import numpy as np
+
+SOLAR_CONSTANT = 1361.  # W.m-2
+
+_TURTLE46 = (
+    [(9.23, a) for a in (12.23, 59.77, 84.23, 131.77, 156.23, 203.77, 228.23, 275.77, 300.23, 347.77)]
+    + [(10.81, a) for a in (36, 108, 180, 252, 324)]
+    + [(26.57, a) for a in (0, 72, 144, 216, 288)]
+    + [(31.08, a) for a in (23.27, 48.73, 95.27, 120.73, 167.27, 192.73, 239.27, 264.73, 311.27, 336.73)]
+    + [(47.41, a) for a in (0, 72, 144, 216, 288)]
+    + [(52.62, a) for a in (36, 108, 180, 252, 324)]
+    + [(69.16, a) for a in (0, 72, 144, 216, 288)]
+    + [(90, 180)])
+
+_TREGENZA_BANDS = (30, 30, 24, 24, 18, 12, 6, 1)  # sectors per 12 degrees elevation band, from the horizon
+
+
+def turtle46():
+    """Directions of the 46 equal solid angle sectors of den Dulk turtle sky
+
+    Returns:
+        elevation, azimuth, solid_angle arrays
+    """
+    elevation, azimuth = np.array(_TURTLE46, dtype=float).T
+    return elevation, azimuth, np.full(46, 2 * np.pi / 46)
+
+
+def tregenza145():
+    """Directions of the 145 sectors of Tregenza sky (12 degrees elevation bands)
+
+    Returns:
+        elevation, azimuth, solid_angle arrays
+    """
+    counts = np.array(_TREGENZA_BANDS)
+    lower = np.radians(12 * np.arange(len(counts)))
+    upper = np.minimum(lower + np.radians(12), np.pi / 2)
+    upper[-1] = np.pi / 2
+    lower[-1] = np.radians(84)
+    band = np.repeat(np.arange(len(counts)), counts)
+    rank = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    elevation = np.where(band == len(counts) - 1, 90, 6 + 12 * band).astype(float)
+    azimuth = rank * 360. / counts[band]
+    solid_angle = (2 * np.pi * (np.sin(upper) - np.sin(lower)) / counts)[band]
+    return elevation, azimuth, solid_angle
+
+
+def uniform_hemisphere(n=100):
+    """n directions evenly spread over the hemisphere (Fibonacci lattice), with equal solid angles
+
+    Returns:
+        elevation, azimuth, solid_angle arrays
+    """
+    i = np.arange(n)
+    elevation = np.degrees(np.arcsin((i + 0.5) / n))
+    azimuth = np.degrees(i * np.pi * (3 - np.sqrt(5))) % 360
+    return elevation, azimuth, np.full(n, 2 * np.pi / n)
+
+
+_SKIES = {'turtle46': turtle46, 'tregenza145': tregenza145}
+
+
+def sky_directions(sky='turtle46'):
+    """Sector directions of a sky discretisation name ('turtle46', 'tregenza145', 'uniform<n>')"""
+    if sky in _SKIES:
+        return _SKIES[sky]()
+    if sky.startswith('uniform'):
+        return uniform_hemisphere(int(sky[len('uniform'):] or 100))
+    raise ValueError(f"unknown sky discretisation: {sky}")
+
+
+def radiance_distribution(elevation, model='soc'):
+    """Relative radiance of the sky at elevation: 'soc' (standard overcast sky) or 'uoc' (uniform)"""
+    elevation = np.radians(np.asarray(elevation, dtype=float))
+    if model == 'soc':
+        return (1 + 2 * np.sin(elevation)) / 3
+    if model == 'uoc':
+        return np.ones_like(elevation)
+    raise ValueError(f"unknown sky radiance model: {model}")
+
+
+def directions(elevation, azimuth):
+    """Unit propagation vectors of light coming from elevation, azimuth (counter-clockwise from X+)"""
+    h = np.radians(np.asarray(elevation, dtype=float))
+    a = np.radians(np.asarray(azimuth, dtype=float))
+    return np.stack([-np.cos(h) * np.cos(a), -np.cos(h) * np.sin(a), -np.sin(h)], axis=-1)
+
+
+def sources(energy, elevation, azimuth):
+    """Pack energies and directions as (n, 4) light source rows"""
+    energy, elevation, azimuth = np.broadcast_arrays(energy, elevation, azimuth)
+    return np.column_stack([energy.ravel(), directions(elevation.ravel(), azimuth.ravel())])
+
+
+def sky_sources(irradiance=1, sky='turtle46', model='soc'):
+    """Diffuse sky as a set of directional sources
+
+    Args:
+        irradiance: horizontal diffuse irradiance shared by the sources
+        sky: sky discretisation ('turtle46', 'tregenza145', 'uniform<n>')
+        model: sky radiance distribution ('soc' or 'uoc')
+
+    Returns:
+        (n, 4) array of (energy, dx, dy, dz) rows, energies summing to irradiance
+    """
+    elevation, azimuth, solid_angle = sky_directions(sky)
+    weights = radiance_distribution(elevation, model) * np.sin(np.radians(elevation)) * solid_angle
+    return sources(irradiance * weights / weights.sum(), elevation, azimuth)
+
+
+def sun_position(times, latitude, longitude):
+    """Sun elevation and azimuth (clockwise from North), using low precision (0.01 deg) ephemeris
+
+    Args:
+        times: (array of) UTC times (numpy datetime64 or ISO strings)
+        latitude: latitude of the site (degrees, North positive)
+        longitude: longitude of the site (degrees, East positive)
+
+    Returns:
+        elevation, azimuth arrays
+    """
+    times = np.asarray(times, dtype='datetime64[s]')
+    d = (times - np.datetime64('2000-01-01T12:00:00')) / np.timedelta64(1, 'D')
+    g = np.radians(357.529 + 0.98560028 * d)
+    q = 280.459 + 0.98564736 * d
+    ecliptic = np.radians(q + 1.915 * np.sin(g) + 0.020 * np.sin(2 * g))
+    obliquity = np.radians(23.439 - 0.00000036 * d)
+    right_ascension = np.arctan2(np.cos(obliquity) * np.sin(ecliptic), np.cos(ecliptic))
+    declination = np.arcsin(np.sin(obliquity) * np.sin(ecliptic))
+    sidereal = np.radians((280.46061837 + 360.98564736629 * d + longitude) % 360)
+    hour_angle = sidereal - right_ascension
+    lat = np.radians(latitude)
+    elevation = np.arcsin(np.sin(lat) * np.sin(declination)
+                          + np.cos(lat) * np.cos(declination) * np.cos(hour_angle))
+    azimuth = np.arctan2(-np.sin(hour_angle),
+                         np.tan(declination) * np.cos(lat) - np.sin(lat) * np.cos(hour_angle))
+    return np.degrees(elevation), np.degrees(azimuth) % 360
+
+
+def extraterrestrial_irradiance(times, elevation):
+    """Horizontal irradiance at the top of the atmosphere"""
+    times = np.asarray(times, dtype='datetime64[s]')
+    day = (times - times.astype('datetime64[Y]')) / np.timedelta64(1, 'D')
+    normal = SOLAR_CONSTANT * (1 + 0.033 * np.cos(2 * np.pi * day / 365))
+    return np.maximum(0, normal * np.sin(np.radians(elevation)))
+
+
+def diffuse_fraction(ghi, times, elevation):
+    """Diffuse fraction of global horizontal irradiance (Erbs et al., 1982)"""
+    ghi = np.asarray(ghi, dtype=float)
+    i0 = extraterrestrial_irradiance(times, elevation)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        kt = np.where(i0 > 0, ghi / i0, 0)
+    fraction = np.where(kt <= 0.22, 1 - 0.09 * kt,
+                        np.where(kt <= 0.8,
+                                 0.9511 - 0.1604 * kt + 4.388 * kt ** 2 - 16.638 * kt ** 3 + 12.336 * kt ** 4,
+                                 0.165))
+    return np.where(i0 > 0, fraction, 1)
+
+
+def sun_sky_sources(times, ghi, latitude, longitude, sky='turtle46', model='soc', north=90):
+    """Sun and sky sources for global horizontal irradiances measured at times, packed in one light set
+
+    Direct irradiance is set on the sun positions (one source per time step with the sun above the horizon),
+    diffuse irradiance of all time steps is accumulated on the sky sectors.
+
+    Args:
+        times: (array of) UTC times
+        ghi: global horizontal irradiance for each time
+        latitude, longitude: location of the site (degrees)
+        sky: sky discretisation ('turtle46', 'tregenza145', 'uniform<n>')
+        model: sky radiance distribution ('soc' or 'uoc')
+        north: angle (degrees, counter-clockwise) from the scene X+ axis to North
+
+    Returns:
+        (n, 4) array of (energy, dx, dy, dz) rows
+    """
+    times = np.atleast_1d(np.asarray(times, dtype='datetime64[s]'))
+    ghi = np.broadcast_to(np.asarray(ghi, dtype=float), times.shape)
+    elevation, azimuth = sun_position(times, latitude, longitude)
+    diffuse = ghi * diffuse_fraction(ghi, times, elevation)
+    direct = ghi - diffuse
+    up = (elevation > 0) & (direct > 0)
+    sun = sources(direct[up], elevation[up], north - azimuth[up])
+    sky = sky_sources(diffuse.sum(), sky, model)
+    return np.concatenate([sun, sky])
@@ -0,0 +1,104 @@
+"""Pool of reusable scene directories, recycled between simulations instead of created and deleted per call"""
+
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import weakref
+from contextlib import contextmanager
+from pathlib import Path
+
+import openalea.libcaribu.algos as lcal
+import openalea.libcaribu.commands as lcmd
+
+SHM_DIR = Path('/dev/shm')
+
+
+def _remove(root, owned, slots):
+    if owned:
+        shutil.rmtree(root, ignore_errors=True)
+    else:
+        for path in slots:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+class WorkspacePool:
+    """A fixed number of scene directories, handed out to one simulation at a time
+
+    Released directories are emptied (clean_all_artifacts, then removal of the scene inputs) and reused. Scenes
+    set through the pool link their light, optical, pattern and sensor files instead of copying them. All
+    directories are removed on close, at the exit of a with block or, failing that, when the pool is garbage
+    collected or at interpreter exit.
+
+    Args:
+        size: number of directories (default to the number of processors)
+        root: directory holding the pool (a new temporary directory, removed on close, if None)
+        tmpfs: create the temporary root in /dev/shm (memory backed) when available
+    """
+
+    def __init__(self, size=None, root=None, tmpfs=False):
+        self.size = size or os.cpu_count() or 1
+        self._owned = root is None
+        if root is None:
+            parent = SHM_DIR if tmpfs and SHM_DIR.is_dir() and os.access(SHM_DIR, os.W_OK) else None
+            root = tempfile.mkdtemp(prefix='libcaribu-pool-', dir=parent)
+        self.root = Path(root).resolve()
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._slots = []
+        self._free = queue.Queue()
+        for i in range(self.size):
+            path = self.root / f'scene{i}'
+            path.mkdir(exist_ok=True)
+            self._slots.append(path)
+            self._free.put(path)
+        self._lock = threading.Lock()
+        self._finalizer = weakref.finalize(self, _remove, self.root, self._owned, list(self._slots))
+
+    def __len__(self):
+        return self.size
+
+    def acquire(self, timeout=None):
+        """Get a free (empty) scene directory, waiting at most timeout seconds (queue.Empty is raised then)"""
+        if not self._finalizer.alive:
+            raise ValueError("workspace pool is closed")
+        return self._free.get(timeout=timeout)
+
+    def release(self, scene_path):
+        """Empty scene_path and make it available again"""
+        scene_path = Path(scene_path)
+        if scene_path not in self._slots:
+            raise ValueError(f"{scene_path} is not a directory of this pool")
+        lcmd.clean_all_artifacts(scene_path)
+        for path in scene_path.iterdir():
+            if path.is_dir() and not path.is_symlink():
+                shutil.rmtree(path)
+            else:
+                path.unlink()
+        self._free.put(scene_path)
+
+    @contextmanager
+    def scene(self, timeout=None, **scene):
+        """A scene directory set with set_scene(**scene) for the duration of a with block"""
+        scene_path = self.acquire(timeout)
+        try:
+            if scene:
+                lcal.set_scene(scene_path, link=True, **scene)
+            yield scene_path
+        finally:
+            self.release(scene_path)
+
+    def close(self):
+        """Remove the directories of the pool"""
+        with self._lock:
+            self._finalizer()
+
+    @property
+    def closed(self):
+        return not self._finalizer.alive
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
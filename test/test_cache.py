@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+from importlib.resources import files
+import openalea.libcaribu.algos as lcal
+import openalea.libcaribu.commands as lcmd
+import openalea.libcaribu.io as lcio
+from openalea.libcaribu.cache import IntermediateCache, SoilCache
+
+data_dir = files('openalea.libcaribu.data')
+
+
+def _scene(path, opts=data_dir / "par.opt"):
+    return lcal.set_scene(path,
+                          canopy=data_dir / "filterT.can",
+                          pattern=data_dir / "filter.8",
+                          lights=data_dir / "zenith.light",
+                          opts=opts)
+
+
+def _no_tool(*args, **kwds):
+    raise AssertionError("tool should not run")
+
+
+def test_cache_restores_intermediates(tmp_path, monkeypatch):
+    cache = IntermediateCache(tmp_path / "cache")
+    expected, _, _ = lcal.mixed_radiosity(_scene(tmp_path / "a"), sd=1, layers=6, height=21, cache=cache)
+    assert len(list(cache.root.iterdir())) == 3  # periodise, s2v, mcsail
+
+    for tool in ("run_periodise", "run_s2v", "run_mcsail"):
+        monkeypatch.setattr(lcmd, tool, _no_tool)
+    results, _, _ = lcal.mixed_radiosity(_scene(tmp_path / "b"), sd=1, layers=6, height=21, cache=cache)
+    for k in expected:
+        np.testing.assert_array_equal(results[k], expected[k])
+
+    # optics change invalidates s2v and mcsail outputs, not periodise ones
+    nir = "n 2\ns d 0.2\ne d 0.3   d 0.2 0.1  d 0.2 0.1\ne d 0.3   d 0.2 0.1  d 0.2 0.1\n"
+    with pytest.raises(AssertionError, match="should not run"):
+        lcal.mixed_radiosity(_scene(tmp_path / "c", opts=nir), band="band0", sd=1, layers=6, height=21, cache=cache)
+    assert (tmp_path / "c" / "motif.can").exists()
+
+
+def test_cache_eviction(tmp_path):
+    cache = IntermediateCache(tmp_path / "cache", max_bytes=0)
+    scene = _scene(tmp_path / "scene")
+    lcal.periodise(scene, cache=cache)
+    assert cache.size() == 0
+    cache.max_bytes = 2 ** 20
+    lcal.periodise(scene, cache=cache)
+    key = cache.key('periodise', scene / 'scene.can', scene / 'scene.8')
+    assert (cache.root / key / 'motif.can').exists()
+    cache.clear()
+    assert cache.size() == 0
+
+
+def test_default_roots(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    soil = SoilCache()
+    lcal.set_scene(tmp_path / "scene", pattern=(0, 0, 10, 10), soil=2, soil_cache=soil)
+    cache = IntermediateCache()
+    assert cache.size() == 0
+    cache.max_bytes = 0
+    cache.evict()
+    cache.clear()
+    assert len(list(soil.root.iterdir())) == 1
+
+
+def test_soil_cache(tmp_path):
+    cache = SoilCache(tmp_path / "soil")
+    a = lcal.set_scene(tmp_path / "a", pattern=(0, 0, 10, 10), soil=20, soil_cache=cache)
+    b = lcal.set_scene(tmp_path / "b", pattern=(0, 0, 10, 10), soil=20, soil_cache=cache)
+    assert len(list(cache.root.iterdir())) == 1
+    assert (a / "scene.soil").samefile(b / "scene.soil")
+    assert (a / "scene.soil").read_text() == lcio.canestra_soil((0, 0, 10, 10), n_div=20)
+
+    # a cached soil replacing another one is seen as new
+    lcal.set_scene(b, canopy=data_dir / "filterT.can", soil=2, soil_cache=cache)
+    assert lcal.check_scene_and_soil(b) == 8
+    lcal.set_scene(b, soil=20, soil_cache=cache)
+    assert lcal.check_scene_and_soil(b) == 800
+    lcal.set_scene(b, soil=2)
+    assert (a / "scene.soil").read_text() == lcio.canestra_soil((0, 0, 10, 10), n_div=20)
@@ -1,3 +1,4 @@
+import asyncio
 import pytest
 import shutil
 from pathlib import Path
@@ -63,3 +64,61 @@ def test_run_and_clean(tmp_path):
     lcmd.clean_all_artifacts(tmp_path)
     count = sum(1 for f in tmp_path.iterdir() if f.is_file())
     assert count == len(infiles)
+
+
+def test_async_tools(tmp_path):
+    for name in ("filterT.can", "zenith.light", "par.opt"):
+        shutil.copy(data_dir / name, tmp_path)
+    args = ["-M", "filterT.can", "-l", "zenith.light", "-p", "par.opt", "-A", "-1"]
+
+    async def main():
+        lcmd.set_max_concurrency(1)
+        result = await lcmd.arun_canestrad(tmp_path, args)
+        assert result.returncode == 0
+        with pytest.raises(lcmd.CommandFailed):
+            await lcmd.arun_canestrad(tmp_path, ["-M", "missing.can", "-p", "par.opt"])
+        with pytest.raises(asyncio.TimeoutError):
+            await lcmd._arun_tool("sleep", tmp_path, ["10"], timeout=0.1)
+        task = asyncio.create_task(lcmd._arun_tool("sleep", tmp_path, ["10"]))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    assert (tmp_path / "Etri.vec0").exists()
+
+
+def test_kill_reaped_process(tmp_path, monkeypatch):
+    process, stdout, stderr = lcmd._spawn(["true"], tmp_path)
+    lcmd._wait(process)
+    lcmd._completed(["true"], process, stdout, stderr)
+
+    def kill(*args):
+        raise AssertionError("a reaped process should not be signalled")
+
+    monkeypatch.setattr(lcmd.os, "kill", kill)
+    lcmd._kill(process)
+
+
+def test_tool_metrics(tmp_path):
+    for name in ("filterT.can", "zenith.light", "par.opt"):
+        shutil.copy(data_dir / name, tmp_path)
+    args = ["-M", "filterT.can", "-l", "zenith.light", "-p", "par.opt", "-A", "-d", "-1"]
+    with lcmd.Profile() as profile:
+        result = lcmd.run_canestrad(tmp_path, args)
+        asyncio.run(lcmd.arun_canestrad(tmp_path, args))
+    metrics = result.metrics
+    assert metrics.tool == "canestrad"
+    assert metrics.wall_time > 0
+    if metrics.max_rss is not None:
+        assert metrics.max_rss > 0 and metrics.user_time >= 0
+    assert {"load", "direct", "formfactors", "solve", "output"} <= set(metrics.stages)
+    assert sum(wall for wall, _ in metrics.stages.values()) <= metrics.wall_time
+    assert len(profile.runs) == 2
+    summary = profile.summary()["canestrad"]
+    assert summary["calls"] == 2
+    assert summary["solve"] == sum(run.stages["solve"][0] for run in profile.runs)
+    # hooks are removed on exit
+    lcmd.run_canestrad(tmp_path, args)
+    assert len(profile.runs) == 2
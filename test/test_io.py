@@ -1,3 +1,4 @@
+import numpy as np
 from importlib.resources import files
 import openalea.libcaribu.io as lcio
 
@@ -31,7 +32,7 @@ def test_opticals():
 
 def test_labels():
     labels = lcio.encode_labels(opt=1, plant=2, leaf=3, elt=4)
-    assert labels[0] == "100002003004"
+    assert labels.dtype == np.int64 and labels[0] == 100002003004
     opt, plant, leaf, elt = lcio.decode_labels(labels)
     assert opt[0] == 1 and plant[0] == 2 and leaf[0] == 3 and elt[0] == 4
 
@@ -59,7 +60,36 @@ def test_canopy():
     #from file
     triangles, labels = lcio.read_can(data_dir / 'filterT.can')
     assert len(triangles) == 192
-    assert labels[0] == "100001001000"
+    assert labels.dtype == np.int64 and labels[0] == 100001001000
+
+
+def test_write_can(tmp_path):
+    triangles, labels = lcio.read_can(data_dir / 'filterT.can')
+    path = tmp_path / 'scene.can'
+    lcio.write_can(path, triangles, labels, chunk_size=7)
+    assert path.read_text() == lcio.can_string(triangles, labels)
+    tris, labs = lcio.read_can(path)
+    assert (labs == labels).all()
+    assert abs(tris - triangles).max() < 1e-6
+    # labels are repeated cyclically
+    content = lcio.can_string(triangles[:3], labels[:1])
+    assert content.splitlines()[2].split()[2] == f"{labels[0]:012d}"
+    # string labels are written as is
+    content = lcio.can_string(triangles[:1], ["000000000007"])
+    assert content.split()[2] == "000000000007"
+
+
+def test_canb(tmp_path):
+    triangles, labels = lcio.read_can(data_dir / 'filterT.can')
+    path = tmp_path / 'scene.canb'
+    lcio.write_canb(path, triangles, labels)
+    tris, labs = lcio.read_canb(path)
+    assert isinstance(tris, np.memmap) and labs.dtype == np.int64
+    np.testing.assert_array_equal(tris, triangles)
+    np.testing.assert_array_equal(labs, labels.astype(np.int64))
+    lcio.write_canb(path, triangles, labels[:1], dtype=np.float32)
+    tris, labs = lcio.read_canb(path, mmap=False)
+    assert tris.dtype == np.float32 and (labs == labs[0]).all()
 
 
 def test_light():
@@ -105,6 +135,31 @@ def test_soil():
     soil_string = lcio.canestra_soil(domain, n_div=2)
     assert len(soil_string.splitlines()) == 8  # n_div * n_div * 2
     triangles, labels = lcio.read_can(soil_string)
-    assert labels[0] == "0" * 12
+    assert labels[0] == 0
+    assert soil_string.split()[2] == "0" * 12
     x,y,_ = triangles.reshape(-1, 3).T
-    assert (x.min(), y.min(), x.max(), y.max()) == domain
\ No newline at end of file
+    assert (x.min(), y.min(), x.max(), y.max()) == domain
+
+    triangles, labels = lcio.soil_mesh((0, 0, 2, 4), n_div=30)
+    assert triangles.shape == (1800, 3, 3) and labels.dtype == np.int64
+    assert labels[-1] == 999  # element numbers are clipped as in encode_labels
+    u, v = triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0]
+    area = np.cross(u, v)[:, 2] / 2
+    np.testing.assert_allclose(area, 8 / 1800)  # counter-clockwise, covering the domain
+    soil_string = lcio.canestra_soil((0, 0, 2, 4), n_div=30)
+    assert soil_string.splitlines()[1].split()[2] == "000000000001"
+    np.testing.assert_allclose(lcio.read_can(soil_string)[0], triangles, atol=1e-6)
+
+
+def test_results():
+    path = data_dir / 'projection_toric_scene.vec0'
+    data, soil = lcio.read_results(path)
+    assert soil is None
+    assert data['index'].dtype == np.int64 and data['Eabs'].dtype == np.float64
+    assert data['label'].dtype == np.int64 and data['label'][0] == 100001001000
+    expected = np.loadtxt(path)
+    np.testing.assert_array_equal(data['Eabs'], expected[:, 3])
+    data, soil = lcio.read_results(path, nsoil=2, usecols=('label', 'Ei'))
+    assert list(data) == ['label', 'Ei'] and list(soil) == ['label', 'Ei']
+    assert len(data['Ei']) == len(expected) - 2 and len(soil['Ei']) == 2
+    np.testing.assert_array_equal(soil['Ei'], expected[-2:, 4])
@@ -1,10 +1,14 @@
 """
 Test caribu legacy test suite, using libcaribu.algos
 """
+import asyncio
 import pytest
 import numpy as np
 from importlib.resources import files
 import openalea.libcaribu.algos as lcal
+import openalea.libcaribu.io as lcio
+import openalea.libcaribu.sky as sky
+from openalea.libcaribu.cache import FormFactorStore
 
 data_dir = files('openalea.libcaribu.data')
 
@@ -77,4 +81,217 @@ def test_nested_radiosity_toric_scene(caribu_test_scene):
     assert resfile.exists()
     expected = np.loadtxt(data_dir / 'nested_radiosity_toric_scene.vec0')
     res = np.loadtxt(resfile)
-    np.testing.assert_allclose(res, expected)
\ No newline at end of file
+    np.testing.assert_allclose(res, expected)
+
+def test_multiband_radiosity_matches_single_band(tmp_path):
+    nir = "n 2\ns d 0.2\ne d 0.3   d 0.2 0.1  d 0.2 0.1\ne d 0.3   d 0.2 0.1  d 0.2 0.1\n"
+    caribu_test_scene = lcal.set_scene(tmp_path,
+                                       canopy=data_dir / "filterT.can",
+                                       pattern=data_dir / "filter.8",
+                                       lights=data_dir / "zenith.light",
+                                       opts=[data_dir / "par.opt", nir],
+                                       bands=["par", "nir"])
+    for algo, kwds in ((lcal.radiosity, {}),
+                       (lcal.mixed_radiosity, dict(sd=1, layers=6, height=21))):
+        outputs = algo(caribu_test_scene, bands=["par", "nir"], **kwds)
+        assert list(outputs) == ["par", "nir"]
+        assert not list(caribu_test_scene.glob("diag_*"))
+        for band in ("par", "nir"):
+            expected, _, _ = algo(caribu_test_scene, band=band, **kwds)
+            results, _, _ = outputs[band]
+            for k in expected:
+                np.testing.assert_array_equal(results[k], expected[k])
+
+
+def test_ff_store(tmp_path):
+    store = FormFactorStore(tmp_path / "ff")
+    scene = lcal.set_scene(tmp_path / "scene",
+                           canopy=data_dir / "filterT.can",
+                           pattern=data_dir / "filter.8",
+                           lights=data_dir / "zenith.light",
+                           opts=[data_dir / "par.opt"],
+                           bands=["par"])
+    for algo, kwds in ((lcal.radiosity, {}),
+                       (lcal.mixed_radiosity, dict(sd=1, layers=6, height=21))):
+        expected, _, _ = algo(scene, **kwds)
+        for _ in range(2):
+            results, _, _ = algo(scene, ff_store=store, **kwds)
+            for k in expected:
+                if k != "label":  # far contributions read back from the store are rounded to float
+                    np.testing.assert_allclose(results[k], expected[k], rtol=1e-5)
+        assert not list(scene.glob("diag_*"))
+    assert len(list(store.root.iterdir())) == 2
+    # stored form factors are reused with other lights
+    lcal.set_scene(scene, lights=[(100, (0.5, 0, -0.8))])
+    expected, _, _ = lcal.radiosity(scene)
+    results, _, _ = lcal.radiosity(scene, ff_store=store)
+    for k in expected:
+        np.testing.assert_array_equal(results[k], expected[k])
+    assert len(list(store.root.iterdir())) == 2
+
+
+def test_shared_memory_scene(caribu_test_scene):
+    canopy = lcio.read_can(data_dir / "filterT.can")
+    for algo, shm_algo in ((lcal.raycasting, lcal.shm_raycasting), (lcal.radiosity, lcal.shm_radiosity)):
+        expected, _, _ = algo(caribu_test_scene)
+        results, _, _ = shm_algo(caribu_test_scene, canopy)
+        np.testing.assert_array_equal(results["label"], expected["label"])
+        for k in ("area", "Eabs", "Ei", "Ei_sup", "Ei_inf"):
+            np.testing.assert_allclose(results[k], expected[k], atol=1e-5)
+
+
+def test_shared_memory_lowest_key(caribu_test_scene, monkeypatch):
+    # segment ids are tried in order
+    monkeypatch.setattr(np.random, "permutation", np.arange)
+    canopy = lcio.read_can(data_dir / "filterT.can")
+    expected, _, _ = lcal.raycasting(caribu_test_scene)
+    results, _, _ = lcal.shm_raycasting(caribu_test_scene, canopy)
+    np.testing.assert_allclose(results["Ei"], expected["Ei"], atol=1e-5)
+
+
+def test_resolutions(caribu_test_scene):
+    report = lcal.tune_resolutions(caribu_test_scene, screen_resolutions=(64, 512, 4096))
+    assert list(report['screen_resolution']) == [64, 512, 4096]
+    assert report['error'][-1] == 0
+    assert report['error'][0] > report['error'][1]
+    assert lcal.pick_resolution(report, tolerance=1)['screen_resolution'] in (64, 512, 4096)
+    assert lcal.pick_resolution(report, tolerance=-1) is None
+
+    report = lcal.tune_resolutions(caribu_test_scene, algo=lcal.radiosity, screen_resolutions=(512,),
+                                   disk_resolutions=(16, 52), reference=(512, 52))
+    assert list(report['disk_resolution']) == [16, 52]
+    assert report['error'][1] == 0
+    assert report['error'][0] > 0
+
+
+def test_multi_simulations(tmp_path):
+    scene = lcal.set_scene(tmp_path,
+                           canopy=data_dir / "filterT.can",
+                           opts=data_dir / "par.opt",
+                           sensors=data_dir / "filterT.sensor")
+    light_sets = [[(1, (0, 0, -1))], [(2, (0.5, 0, -0.8)), (1, (0, 0, -1))], sky.sky_sources(1)]
+    for algo, multi_algo in ((lcal.raycasting, lcal.multi_raycasting), (lcal.radiosity, lcal.multi_radiosity)):
+        outputs = multi_algo(scene, light_sets, more_args=["-C", "scene.sensor"])
+        assert len(outputs) == len(light_sets)
+        assert not (scene / "simulations.light").exists()
+        for lights, (results, _, measures) in zip(light_sets, outputs):
+            lcal.set_scene(scene, lights=lights)
+            expected, _, expected_measures = algo(scene, more_args=["-C", "scene.sensor"])
+            for k in expected:
+                np.testing.assert_array_equal(results[k], expected[k])
+            for k in expected_measures:
+                np.testing.assert_array_equal(measures[k], expected_measures[k])
+
+
+def test_binary_scene_matches_text_scene(tmp_path):
+    triangles, labels = lcio.read_can(data_dir / "filterT.can")
+    scenes = [lcal.set_scene(tmp_path / name,
+                             canopy=(triangles, labels),
+                             pattern=data_dir / "filter.8",
+                             lights=data_dir / "zenith.light",
+                             opts=data_dir / "par.opt",
+                             soil=2,
+                             binary=binary) for name, binary in (("text", False), ("binary", True))]
+    assert (scenes[1] / "scene.canb").exists() and not (scenes[1] / "scene.can").exists()
+    for algo in (lcal.raycasting, lcal.toric_raycasting):
+        expected, soil_expected, _ = algo(scenes[0], soil=True)
+        results, soil, _ = algo(scenes[1], soil=True)
+        for k in expected:
+            np.testing.assert_array_equal(results[k], expected[k])
+        for k in soil_expected:
+            np.testing.assert_array_equal(soil[k], soil_expected[k])
+
+
+def test_run_batch(caribu_test_scene):
+    scene = dict(canopy=data_dir / "filterT.can",
+                 pattern=data_dir / "filter.8",
+                 lights=data_dir / "zenith.light",
+                 opts=data_dir / "par.opt")
+    jobs = [(scene, 'raycasting'),
+            (scene, lcal.radiosity, 'par'),
+            (caribu_test_scene, 'toric_raycasting', None, {'soil': False})]
+    outputs = dict(lcal.run_batch(jobs, max_workers=2))
+    assert sorted(outputs) == [0, 1, 2]
+    for i, name in enumerate(('projection_non_toric_scene', 'radiosity_non_toric_scene',
+                              'projection_toric_scene')):
+        expected = np.loadtxt(data_dir / f'{name}.vec0')
+        results, _, _ = outputs[i]
+        np.testing.assert_allclose(results['Eabs'], expected[:, 3])
+
+
+def test_async_algos(tmp_path):
+    scenes = [lcal.set_scene(tmp_path / str(i),
+                             canopy=data_dir / "filterT.can",
+                             pattern=data_dir / "filter.8",
+                             lights=data_dir / "zenith.light",
+                             opts=data_dir / "par.opt") for i in range(3)]
+
+    async def main():
+        return await asyncio.gather(lcal.araycasting(scenes[0]),
+                                    lcal.atoric_raycasting(scenes[1]),
+                                    lcal.aradiosity(scenes[2]))
+
+    outputs = asyncio.run(main())
+    for name, (results, _, _) in zip(('projection_non_toric_scene', 'projection_toric_scene',
+                                      'radiosity_non_toric_scene'), outputs):
+        expected = np.loadtxt(data_dir / f'{name}.vec0')
+        np.testing.assert_allclose(results['Eabs'], expected[:, 3])
+
+
+def test_solver_memory_budget(caribu_test_scene):
+    expected, _, _ = lcal.radiosity(caribu_test_scene)
+    results, _, _ = lcal.radiosity(caribu_test_scene, memory_budget=0)
+    for k in expected:
+        np.testing.assert_array_equal(results[k], expected[k])
+    results, _, _ = lcal.mixed_radiosity(caribu_test_scene, sd=1, layers=6, height=21, memory_budget=0)
+    expected = np.loadtxt(data_dir / 'nested_radiosity_toric_scene.vec0')
+    np.testing.assert_allclose(results['Eabs'], expected[:, 3])
+
+
+def test_threads(caribu_test_scene):
+    for algo, kwds in ((lcal.raycasting, {}),
+                       (lcal.toric_raycasting, {}),
+                       (lcal.radiosity, {}),
+                       (lcal.mixed_radiosity, dict(sd=1, layers=6, height=21))):
+        expected, _, _ = algo(caribu_test_scene, **kwds)
+        for threads in (2, 5):
+            results, _, _ = algo(caribu_test_scene, threads=threads, **kwds)
+            for k in expected:
+                np.testing.assert_array_equal(results[k], expected[k])
+
+
+def test_reuse_grid(tmp_path):
+    scene = lcal.set_scene(tmp_path,
+                           canopy=data_dir / "filterT.can",
+                           pattern=data_dir / "filter.8",
+                           lights=data_dir / "zenith.light",
+                           opts=data_dir / "par.opt")
+    for algo, kwds in ((lcal.radiosity, {}),
+                       (lcal.mixed_radiosity, dict(sd=1, layers=6, height=21))):
+        expected, _, _ = algo(scene, **kwds)
+        stats = []
+        for _ in range(2):
+            results, _, _ = algo(scene, reuse_grid=True, **kwds)
+            grid, = scene.glob("grid_*")
+            stats.append(grid.stat())
+            for k in expected:
+                np.testing.assert_array_equal(results[k], expected[k])
+        # the grid is read back, not written again
+        assert stats[0].st_mtime_ns == stats[1].st_mtime_ns
+    # the grid of a previous canopy is replaced, a corrupted grid is built again
+    triangles, labels = lcio.read_can(data_dir / "filterT.can")
+    lcal.set_scene(scene, canopy=(triangles[:-1], labels[:-1]))
+    expected, _, _ = lcal.radiosity(scene)
+    for _ in range(2):
+        results, _, _ = lcal.radiosity(scene, reuse_grid=True)
+        for k in expected:
+            np.testing.assert_array_equal(results[k], expected[k])
+        new_grid, = scene.glob("grid_*")
+        assert new_grid.name != grid.name
+        assert new_grid.stat().st_size > 100
+        new_grid.write_bytes(new_grid.read_bytes()[:100])
+    # a grid being written by another run is left in place
+    partial = scene / "grid_0123456789abcdef.tmp"
+    partial.write_bytes(b"")
+    lcal.radiosity(scene, reuse_grid=True)
+    assert partial.exists()
@@ -0,0 +1,74 @@
+import numpy as np
+from importlib.resources import files
+import openalea.libcaribu.io as lcio
+from openalea.libcaribu.results import Results, reduce_file
+
+data_dir = files('openalea.libcaribu.data')
+
+
+def test_results_mapping():
+    path = data_dir / 'projection_toric_scene.vec0'
+    res = Results.from_file(path)
+    data, _ = lcio.read_results(path)
+    assert list(res) == list(data)
+    for k in data:
+        np.testing.assert_array_equal(res[k], data[k])
+    assert res.size == len(data['area'])
+    assert (res.table['plant'] == 1).all()
+
+    canopy, soil = res.split(2)
+    assert canopy.size + soil.size == res.size
+    assert np.shares_memory(soil.table, res.table)
+    np.testing.assert_array_equal(soil['Ei'], data['Ei'][-2:])
+
+
+def test_groupby():
+    parsed = np.zeros(5, dtype=Results.from_file(data_dir / 'projection_toric_scene.vec0').table.dtype)
+    parsed['label'] = lcio.encode_labels(1, [1, 1, 2, 2, 2], [1, 0, 1, 1, 1])
+    parsed['area'] = [1, 1, 1, 2, 1]
+    parsed['Ei'] = [1, 3, 1, 4, np.nan]
+    res = Results.from_array(parsed)
+
+    plants = res.groupby_plant()
+    np.testing.assert_array_equal(plants['plant'], [1, 2])
+    np.testing.assert_array_equal(plants['area'], [2, 4])
+    np.testing.assert_allclose(plants['Ei'], [2, 3])
+
+    organs = res.groupby_organ()
+    np.testing.assert_array_equal(organs['plant'], [1, 1, 2])
+    np.testing.assert_array_equal(organs['leaf'], [0, 1, 1])
+    np.testing.assert_allclose(organs['Ei'], [3, 1, 3])
+
+
+def test_reduce_file(tmp_path):
+    path = data_dir / 'projection_toric_scene.vec0'
+    res = Results.from_file(path)
+    chunks = list(Results.iter_file(path, chunk_size=7, nsoil=2))
+    assert len(chunks) == -(-res.size // 7)
+    canopy = np.concatenate([c.table for c, _ in chunks if c is not None])
+    soil = np.concatenate([s.table for _, s in chunks if s is not None])
+    expected_canopy, expected_soil = res.split(2)
+    np.testing.assert_array_equal(canopy, expected_canopy.table)
+    np.testing.assert_array_equal(soil, expected_soil.table)
+
+    # several plants and organs, soil rows spanning two blocks
+    table = res.table.copy()
+    table['label'] = lcio.encode_labels(1, np.arange(res.size) % 3 + 1, np.arange(res.size) % 2)
+    table['Ei'][::5] = np.nan
+    lines = [f"{r['index']} {r['label']} {r['area']} {r['Eabs']} {r['Ei']} {r['Ei_sup']} {r['Ei_inf']}\n"
+             for r in table]
+    (tmp_path / 'Etri.vec0').write_text("# header\n# columns\n" + ''.join(lines))
+    expected_canopy, expected_soil = Results.from_array(table).split(3)
+    for chunk_size in (2, 5, 1000):
+        for fields in ('plant', ['plant', 'leaf']):
+            canopy, soil = reduce_file(tmp_path / 'Etri.vec0', fields, nsoil=3, chunk_size=chunk_size)
+            expected = expected_canopy.groupby(fields)
+            assert canopy.dtype == expected.dtype
+            for name in expected.dtype.names:
+                np.testing.assert_allclose(canopy[name], expected[name])
+            expected = expected_soil.groupby([])
+            for name in expected.dtype.names:
+                np.testing.assert_allclose(soil[name], expected[name])
+    canopy, soil = reduce_file(tmp_path / 'Etri.vec0', chunk_size=4)
+    assert soil is None
+    np.testing.assert_allclose(canopy['area'], Results.from_array(table).groupby_plant()['area'])
@@ -0,0 +1,92 @@
+import os
+
+import numpy as np
+import openalea.libcaribu.algos as lcal
+import openalea.libcaribu.io as lcio
+from openalea.libcaribu.scene import IncrementalScene
+
+
+def _plant(i, n=10, height=1.):
+    x = np.arange(n, dtype=float) + 10 * i
+    triangles = np.zeros((n, 3, 3))
+    triangles[:, 1, 0] = 1
+    triangles[:, 2, 1] = 1
+    triangles[..., 0] += x[:, None]
+    triangles[..., 2] = height
+    return triangles, f"1{i + 1:05d}001000"
+
+
+def _expected(scene_path, plants):
+    lcio.write_can(scene_path / 'expected.can',
+                   np.concatenate([t for t, _ in plants]),
+                   [lab for t, lab in plants for _ in range(len(t))])
+    return (scene_path / 'expected.can').read_bytes()
+
+
+def test_incremental_scene(tmp_path):
+    s = lcal.set_scene(tmp_path, pattern=(0, 0, 50, 50), soil=1)
+    scene = IncrementalScene(s)
+    plants = [_plant(i) for i in range(5)]
+    for i, p in enumerate(plants):
+        scene.update(i, *p)
+    full = scene.flush()
+    assert (s / 'scene.can').read_bytes() == _expected(s, plants)
+    nsoil = lcal.check_scene_and_soil(s)
+    combined = (s / 'scene_and_soil.can').read_bytes()
+    assert combined == (s / 'scene.can').read_bytes() + (s / 'scene.soil').read_bytes()
+
+    # same size update is done in place
+    plants[2] = _plant(2, height=2.)
+    scene.update(2, *plants[2])
+    assert scene.flush() < full / 2
+    assert (s / 'scene.can').read_bytes() == _expected(s, plants)
+    assert lcal.check_scene_and_soil(s) == nsoil
+    assert (s / 'scene_and_soil.can').read_bytes() == (s / 'scene.can').read_bytes() + (
+            s / 'scene.soil').read_bytes()
+
+    # growth of the last plant only rewrites the tail
+    plants[4] = _plant(4, n=12)
+    scene.update(4, *plants[4])
+    assert scene.flush() < full
+    assert (s / 'scene.can').read_bytes() == _expected(s, plants)
+
+    # removal and new soil
+    scene.remove(1)
+    del plants[1]
+    lcal.set_scene(s, soil=2)
+    scene.flush()
+    assert (s / 'scene.can').read_bytes() == _expected(s, plants)
+    lcal.check_scene_and_soil(s)
+    assert (s / 'scene_and_soil.can').read_bytes() == (s / 'scene.can').read_bytes() + (
+            s / 'scene.soil').read_bytes()
+
+    # external rewrite of the canopy is detected
+    lcal.set_scene(s, canopy=plants[0])
+    scene.flush()
+    assert (s / 'scene.can').read_bytes() == _expected(s, plants)
+
+
+def test_check_scene_and_soil_staleness(tmp_path):
+    s = lcal.set_scene(tmp_path, canopy=_plant(0), pattern=(0, 0, 50, 50), soil=1, lights=[(1, (0, 0, -1))],
+                       opts=lcio.set_opticals(leaf=(0.06, 0.04)))
+    lcal.check_scene_and_soil(s)
+    lcal.set_scene(s, canopy=_plant(0, n=3))
+    nsoil = lcal.check_scene_and_soil(s)
+    triangles, _ = lcio.read_can(s / 'scene_and_soil.can')
+    assert len(triangles) == 3 + nsoil
+    res, soil, _ = lcal.raycasting(s, soil=True)
+    assert len(res['area']) == 3
+    assert len(soil['area']) == nsoil
+
+
+def test_toric_raycasting_after_canopy_rewrite(tmp_path):
+    s = lcal.set_scene(tmp_path, canopy=_plant(0), pattern=(0, 0, 50, 50), lights=[(1, (0, 0, -1))],
+                       opts=lcio.set_opticals(leaf=(0.06, 0.04)))
+    res, _, _ = lcal.toric_raycasting(s)
+    assert len(res['area']) == 10
+    # a rewrite within the clock tick of motif.can is still seen
+    lcal.set_scene(s, canopy=_plant(0, n=3))
+    mtime = (s / 'motif.can').stat().st_mtime_ns
+    os.utime(s / 'scene.can', ns=(mtime, mtime))
+    res, _, _ = lcal.toric_raycasting(s)
+    assert len(res['area']) == 3
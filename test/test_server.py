@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+from importlib.resources import files
+import openalea.libcaribu.algos as lcal
+import openalea.libcaribu.commands as lcmd
+import openalea.libcaribu.io as lcio
+from openalea.libcaribu.server import CanestradServer, ServerPool
+
+data_dir = files('openalea.libcaribu.data')
+
+lights = [[(1, (0, 0, -1))], [(2, (0.5, 0, -0.8)), (1, (0, 0, -1))]]
+nir = "n 2\ns d 0.2\ne d 0.3   d 0.2 0.1  d 0.2 0.1\ne d 0.3   d 0.2 0.1  d 0.2 0.1\n"
+
+
+def _scene(path):
+    return lcal.set_scene(path,
+                          canopy=data_dir / "filterT.can",
+                          pattern=data_dir / "filter.8",
+                          lights=data_dir / "zenith.light",
+                          opts=[data_dir / "par.opt", nir],
+                          bands=["par", "nir"])
+
+
+@pytest.mark.parametrize("algo, kwds", [(lcal.raycasting, {}),
+                                        (lcal.toric_raycasting, {}),
+                                        (lcal.radiosity, {}),
+                                        (lcal.mixed_radiosity, dict(sd=1, layers=6, height=21))])
+def test_server_matches_algos(tmp_path, algo, kwds):
+    scene = _scene(tmp_path)
+    expected = {}
+    for i, light in enumerate(lights):
+        lcal.set_scene(scene, lights=light)
+        for band in ("par", "nir"):
+            expected[i, band], _, _ = algo(scene, band=band, **kwds)
+    with CanestradServer(scene, algo.__name__, **kwds) as server:
+        for _ in range(2):
+            for i, light in enumerate(lights):
+                for band in ("par", "nir"):
+                    results, _, _ = server.run(light, band)
+                    for k in results:
+                        # far contributions read back from the matrix files are rounded to float
+                        np.testing.assert_allclose(results[k], expected[i, band][k], rtol=1e-5 if kwds else 0)
+    assert not list(scene.glob("diag_*"))
+
+
+def test_server_errors(tmp_path):
+    scene = _scene(tmp_path)
+    with CanestradServer(scene) as server:
+        with pytest.raises(lcmd.CommandFailed):
+            server.run(band="uv")
+        # the server answers the next requests
+        results, _, _ = server.run()
+        expected = np.loadtxt(data_dir / 'projection_non_toric_scene.vec0')
+        np.testing.assert_allclose(results['Eabs'], expected[:, 3])
+    with pytest.raises(ValueError):
+        server.run()
+
+
+def test_server_pool(tmp_path):
+    scenes = [_scene(tmp_path / str(i)) for i in range(3)]
+    expected, _, _ = lcal.radiosity(scenes[0])
+    with ServerPool(max_servers=2) as pool:
+        futures = [pool.submit(scene, 'radiosity') for scene in scenes * 2]
+        for future in futures:
+            results, _, _ = future.result()
+            for k in expected:
+                np.testing.assert_array_equal(results[k], expected[k])
+        assert len(pool._servers) == 2
+        # the server is restarted when the canopy changes
+        server = pool.server(scenes[0], 'radiosity')
+        assert pool.server(scenes[0], 'radiosity') is server
+        triangles, labels = lcio.read_can(data_dir / "filterT.can")
+        lcal.set_scene(scenes[0], canopy=(triangles[:-1], labels[:-1]))
+        results, _, _ = pool.run(scenes[0], 'radiosity')
+        assert server.closed
+        assert len(results['Eabs']) == len(labels) - 1
+
+
+def test_server_pool_evicts_idle_servers(tmp_path):
+    scenes = [_scene(tmp_path / str(i)) for i in range(3)]
+    with ServerPool(max_servers=2) as pool:
+        busy, idle = (pool.server(scene) for scene in scenes[:2])
+        with busy._lock:  # a simulation is running
+            pool.server(scenes[2])
+            assert idle.closed and not busy.closed
+        assert list(pool._servers) == [scenes[0], scenes[2]]
@@ -0,0 +1,49 @@
+import numpy as np
+from numpy.testing import assert_almost_equal
+import openalea.libcaribu.algos as lcal
+import openalea.libcaribu.io as lcio
+import openalea.libcaribu.sky as sky
+
+
+def test_sky_sources():
+    for name, n in (('turtle46', 46), ('tregenza145', 145), ('uniform100', 100)):
+        elevation, azimuth, solid_angle = sky.sky_directions(name)
+        assert len(elevation) == len(azimuth) == n
+        assert_almost_equal(solid_angle.sum(), 2 * np.pi, 6)
+        sources = sky.sky_sources(100, name)
+        assert sources.shape == (n, 4)
+        assert_almost_equal(sources[:, 0].sum(), 100)
+        assert_almost_equal(np.linalg.norm(sources[:, 1:], axis=1), 1)
+        assert (sources[:, 3] < 0).all()
+    # standard overcast sky is brighter at zenith than uniform sky
+    assert sky.sky_sources(1, model='soc')[-1, 0] > sky.sky_sources(1, model='uoc')[-1, 0]
+
+
+def test_sun_position():
+    elevation, azimuth = sky.sun_position(['2024-06-21T12:00', '2024-12-21T12:00'], 48.85, 2.35)
+    assert_almost_equal(elevation, [64.6, 17.7], 0)
+    assert_almost_equal(azimuth, [184, 182], 0)
+    elevation, _ = sky.sun_position('2024-06-21T00:00', 48.85, 2.35)
+    assert elevation < 0
+
+
+def test_sun_sky_sources():
+    times = np.arange('2024-06-21T00', '2024-06-22T00', dtype='datetime64[h]')
+    elevation, _ = sky.sun_position(times, 48.85, 2.35)
+    ghi = np.where(elevation > 0, 800 * np.sin(np.radians(elevation)), 0)
+    sources = sky.sun_sky_sources(times, ghi, 48.85, 2.35)
+    assert len(sources) == 46 + (elevation > 0).sum()
+    assert_almost_equal(sources[:, 0].sum(), ghi.sum())
+    # the noon sun comes from the south, i.e. light propagates northward (Y+ by default)
+    noon = sky.sun_sky_sources('2024-06-21T12:00', 800, 48.85, 2.35)
+    assert noon[0, 2] > 0
+
+
+def test_sky_in_one_canestrad_run(tmp_path):
+    horizontal = ((0, 0, 0), (np.sqrt(2), 0, 0), (0, np.sqrt(2), 0))
+    sources = sky.sky_sources(100, 'tregenza145')
+    s = lcal.set_scene(tmp_path, canopy=[horizontal], lights=sources,
+                       opts=lcio.set_opticals(leaf=(0.06, 0.04)))
+    assert len((s / 'scene.light').read_text().splitlines()) == 145
+    res, _, _ = lcal.raycasting(s)
+    assert_almost_equal(res['Ei'][0], 100, 0)
@@ -0,0 +1,72 @@
+import os
+import numpy as np
+import pytest
+from importlib.resources import files
+import openalea.libcaribu.algos as lcal
+from openalea.libcaribu.workspace import WorkspacePool
+
+data_dir = files('openalea.libcaribu.data')
+
+scene = dict(canopy=data_dir / "filterT.can",
+             pattern=data_dir / "filter.8",
+             lights=data_dir / "zenith.light",
+             opts=data_dir / "par.opt")
+
+
+def test_workspace_pool(tmp_path):
+    expected = np.loadtxt(data_dir / 'projection_non_toric_scene.vec0')
+    with WorkspacePool(2, root=tmp_path / "pool") as pool:
+        for _ in range(3):
+            with pool.scene(**scene) as scene_path:
+                assert scene_path.parent == pool.root
+                light = scene_path / "scene.light"
+                assert os.path.samefile(light, data_dir / "zenith.light")
+                results, _, _ = lcal.raycasting(scene_path)
+                np.testing.assert_allclose(results['Eabs'], expected[:, 3])
+                # inputs set afterwards replace links, sources are left untouched
+                lcal.set_scene(scene_path, lights=[(2, (0, 0, -1))])
+                assert not os.path.samefile(light, data_dir / "zenith.light")
+            assert not list(scene_path.iterdir())
+        paths = [pool.acquire(), pool.acquire()]
+        assert len(set(paths)) == 2
+        with pytest.raises(Exception):
+            pool.acquire(timeout=0)
+        for path in paths:
+            pool.release(path)
+    assert pool.closed
+    assert not list((tmp_path / "pool").iterdir())
+    assert (data_dir / "zenith.light").read_text().split()[0] != "2"
+
+    with WorkspacePool(1) as pool:
+        root = pool.root
+        assert root.is_dir()
+    assert not root.exists()
+
+
+def test_run_batch_with_pool(tmp_path):
+    jobs = [(scene, 'raycasting'), (scene, 'radiosity'), (scene, 'raycasting')]
+    with WorkspacePool(2, root=tmp_path) as pool:
+        outputs = dict(lcal.run_batch(jobs, max_workers=2, use_threads=True, pool=pool))
+        assert sorted(outputs) == [0, 1, 2]
+        assert all(not list(path.iterdir()) for path in pool.root.iterdir())
+    for i, name in enumerate(('projection_non_toric_scene', 'radiosity_non_toric_scene',
+                              'projection_non_toric_scene')):
+        expected = np.loadtxt(data_dir / f'{name}.vec0')
+        np.testing.assert_allclose(outputs[i][0]['Eabs'], expected[:, 3])
+
+
+def test_run_batch_reads_jobs_lazily(tmp_path):
+    read = []
+
+    def jobs():
+        for i in range(4):
+            read.append(i)
+            yield scene, 'raycasting'
+
+    with WorkspacePool(1, root=tmp_path) as pool:
+        batch = lcal.run_batch(jobs(), use_threads=True, pool=pool)
+        index, _ = next(batch)
+        assert index == 0 and read == [0]
+        assert sorted(i for i, _ in batch) == [1, 2, 3]
+        with pytest.raises(ValueError):
+            lcal.run_batch(jobs(), keep_scenes=True, pool=pool)